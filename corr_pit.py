@@ -1,143 +1,236 @@
 import os
-import random
-import csv
 import numpy as np
 import d4j
-import xml.sax as sax
+import sampling
+import store
+import sys
+from array import array
+from xml.etree import ElementTree
 from collections import defaultdict
 import json
 import gzip
 
 np.seterr(all='raise')
+CACHE_DIR = "pit_cache"
 
 
-class PitParser(sax.handler.ContentHandler):
-    def __init__(self, test_size, method_changes, line_changes):
+class PitParser:
+    def __init__(self, test_size):
         self._method_name = None
         self._class_name = None
-        self.killmap = {}
+        self._method_desc = None
+        self._line = None
+        self.tests = []
+        self._test_ids = {}
+        self._kill_tests = array("I")
+        self._kill_mutants = array("I")
         self.mutants = {}
-        self.method_mutants = []
         self._freeze = False
-        self.stmt_mutants = []
         self._mutator = None
         self._index = None
         self._block = None
         self._test_size = test_size
-        self._content = ""
-        self._warn = set()
-        self._method_changes = set()
-        for m in method_changes:
-            if m == "org.apache.commons.math.optimization.univariate.MultiStartUnivariateRealOptimizer@optimize(FUNC,org.apache.commons.math.optimization.GoalType,double,double)":
-                m = m.replace("FUNC", "org.apache.commons.math.analysis.UnivariateRealFunction")
-            else:
-                try:
-                    idx = 0
-                    while True:
-                        pos = m.find("<", idx)
-                        if pos < 0:
-                            m = m.replace("T[]", "java.lang.Object[]")
-                            break
-
-                        end = m.find(">", pos + 1)
-                        target = m[pos:end + 1]
-                        if target == "<init>":
-                            idx = end + 1
-                            continue
-
-                        m = m.replace(target, "")
-                except:
-                    pass
-            self._method_changes.add(m)
-
-        self._line_changes = line_changes
-
-
-    # def setDocumentLocator(self, locator):
-    #     super().setDocumentLocator(locator)
-
-    # def startDocument(self):
-    #     super().startDocument()
-
-    def endDocument(self):
-        super().endDocument()
-        killmap = self.killmap
-        for i in range(self._test_size - len(killmap)):
-            killmap[str(i)] = []
-
-    # def startPrefixMapping(self, prefix, uri):
-    #     super().startPrefixMapping(prefix, uri)
-
-    # def endPrefixMapping(self, prefix):
-    #     super().endPrefixMapping(prefix)
-
-    # def startElement(self, name, attrs):
-    #
-
-    def endElement(self, name):
-        content = self._content
-        self._content = ""
-        if name == "mutatedClass":
-            self._class_name = content
-        elif name == "mutatedMethod":
-            self._method_name = content.replace("$", ".")
-        elif name == "methodDescription":
-            self._method_desc = _parse_desc(content.replace("$", "."))
-        elif name == "lineNumber":
-            self._line = int(content)
-        elif name == "mutator":
-            self._mutator = content
-        elif name == "index":
-            self._index = int(content)
-        elif name == "block":
-            self._block = int(content)
-        elif name == "killingTests":
+        self._descs = {}
+
+
+    def parse(self, fh):
+        context = ElementTree.iterparse(fh, events=("start", "end",))
+        _, root = next(context)
+        for event, elem in context:
+            if event == "end" and elem.tag == "mutation":
+                self._end_mutation(elem)
+                # drop the parsed mutations so that memory stays bounded.
+                root.clear()
+
+        self._end_document()
+
+
+    def _test_id(self, name):
+        idx = self._test_ids.get(name)
+        if idx is None:
+            idx = len(self.tests)
+            self._test_ids[name] = idx
+            self.tests.append(sys.intern(name))
+
+        return idx
+
+
+    def _end_document(self):
+        for i in range(self._test_size - len(self.tests)):
+            self._test_id(str(i))
+
+
+    def _end_mutation(self, elem):
+        kills = None
+        for child in elem.iter():
+            tag = child.tag
+            content = child.text or ""
+            if tag == "mutatedClass":
+                self._class_name = sys.intern(content)
+            elif tag == "mutatedMethod":
+                self._method_name = sys.intern(content.replace("$", "."))
+            elif tag == "methodDescription":
+                desc = self._descs.get(content)
+                if desc is None:
+                    desc = self._descs[content] = _parse_desc(content.replace("$", "."))
+                self._method_desc = desc
+            elif tag == "lineNumber":
+                self._line = int(content)
+            elif tag == "mutator":
+                self._mutator = sys.intern(content)
+            elif tag == "index":
+                self._index = int(content)
+            elif tag == "block":
+                self._block = int(content)
+            elif tag == "killingTests":
+                kills = content
+
+        if kills:
+            # kills are recorded before the mutation itself is registered, as the sax parser did.
             idx = len(self.mutants)
-            for name in content.split("|"):
-                if len(name) == 0:
-                    continue
+            tests = [self._test_id(name) for name in kills.split("|") if len(name) > 0]
+            self._kill_tests.extend(tests)
+            self._kill_mutants.extend([idx] * len(tests))
 
-                x = self.killmap.get(name)
-                if x is None:
-                    x = []
-                    self.killmap[name] = x
+        mutant_key = (self._class_name, self._method_name, self._line, self._mutator, self._method_desc, self._block, self._index,)
+        if mutant_key not in self.mutants:
+            self.mutants[mutant_key] = len(self.mutants)
 
-                x.append(idx)
-        elif name == "mutation":
-            mutant_key = (self._class_name, self._method_name, self._line, self._mutator, self._method_desc, self._block, self._index,)
-            idx = self.mutants.get(mutant_key)
-            if idx is None:
-                idx = len(self.mutants)
-                self.mutants[mutant_key] = idx
 
-                if self._line in self._line_changes[self._class_name]:
-                    self.stmt_mutants.append(idx)
+    def freeze(self):
+        self._freeze = True
 
-                total_name = self._class_name + "@" + self._method_name + self._method_desc
-                if total_name in self._method_changes:
-                    self.method_mutants.append(idx)
 
-    # def startElementNS(self, name, qname, attrs):
-    #     super().startElementNS(name, qname, attrs)
-    #
-    # def endElementNS(self, name, qname):
-    #     super().endElementNS(name, qname)
+    def sparse(self, mutant_count):
+        return sampling.SparseKillmap.from_pairs(np.frombuffer(self._kill_tests, dtype=np.uint32),
+                np.frombuffer(self._kill_mutants, dtype=np.uint32), (len(self.tests), mutant_count,))
 
-    def characters(self, content):
-        self._content += content
 
-    def freeze(self):
-        self._freeze = True
+class PitMatrix:
+    # the key order of PitParser.mutants.
+    KEYS = ("class", "method", "line", "mutator", "desc", "block", "index",)
+    STRINGS = ("class", "method", "mutator", "desc",)
+    # caches of an older format held a packed dense matrix and are rebuilt.
+    FORMAT = 2
+
+
+    def __init__(self, columns, tests, kills, mutant_count):
+        self.columns = columns
+        self.tests = tests
+        self.kills = kills
+        self.mutant_count = mutant_count
+
+
+    @property
+    def mutants(self):
+        columns = [self.columns[k].tolist() for k in PitMatrix.KEYS]
+        return [tuple(None if v == -1 else v for v in key) for key in zip(*columns)]
+
+
+    @staticmethod
+    def from_parser(parser):
+        keys = list(parser.mutants.keys())
+        columns = {}
+        for idx, name in enumerate(PitMatrix.KEYS):
+            values = [key[idx] for key in keys]
+            if name in PitMatrix.STRINGS:
+                columns[name] = np.array(values, dtype=str)
+            else:
+                columns[name] = np.array([-1 if v is None else v for v in values], dtype=np.int64)
+
+        mutant_count = len(keys) + 1
+        return PitMatrix(columns, list(parser.tests), parser.sparse(mutant_count), mutant_count)
+
+
+    @staticmethod
+    def _sources(paths):
+        result = []
+        for p in sorted(paths):
+            st = os.stat(p)
+            result.append([os.path.basename(p), st.st_size, st.st_mtime_ns])
+
+        return result
+
+
+    def save(self, cache_dir, paths, test_size):
+        os.makedirs(cache_dir, exist_ok=True)
+        for name, values in self.columns.items():
+            np.save(os.path.join(cache_dir, name + ".npy"), values)
+        np.save(os.path.join(cache_dir, "tests.npy"), np.array(self.tests, dtype=str))
+        np.save(os.path.join(cache_dir, "indptr.npy"), self.kills.indptr)
+        np.save(os.path.join(cache_dir, "indices.npy"), self.kills.indices)
 
+        # meta.json is written last and marks the entry as complete.
+        meta = {"format": PitMatrix.FORMAT, "sources": PitMatrix._sources(paths), "test_size": test_size, "mutant_count": self.mutant_count}
+        with open(os.path.join(cache_dir, "meta.json.tmp"), "w") as fh:
+            json.dump(meta, fh)
+        os.replace(os.path.join(cache_dir, "meta.json.tmp"), os.path.join(cache_dir, "meta.json"))
 
-    # def ignorableWhitespace(self, whitespace):
-    #     super().ignorableWhitespace(whitespace)
 
-    # def processingInstruction(self, target, data):
-    #     super().processingInstruction(target, data)
-    #
-    # def skippedEntity(self, name):
-    #     super().skippedEntity(name)
+    @staticmethod
+    def load(cache_dir, paths, test_size):
+        p = os.path.join(cache_dir, "meta.json")
+        if not os.path.exists(p):
+            return None
+
+        with open(p, "r") as fh:
+            meta = json.load(fh)
+
+        if meta.get("format") != PitMatrix.FORMAT:
+            return None
+        if meta["sources"] != PitMatrix._sources(paths) or meta["test_size"] != test_size:
+            return None
+
+        columns = {name: np.load(os.path.join(cache_dir, name + ".npy")) for name in PitMatrix.KEYS}
+        tests = np.load(os.path.join(cache_dir, "tests.npy")).tolist()
+        indptr = np.load(os.path.join(cache_dir, "indptr.npy"), mmap_mode="r")
+        indices = np.load(os.path.join(cache_dir, "indices.npy"), mmap_mode="r")
+        kills = sampling.SparseKillmap(indptr, indices, (len(tests), meta["mutant_count"],))
+        return PitMatrix(columns, tests, kills, meta["mutant_count"])
+
+
+    def killed(self):
+        return self.kills.killed()
+
+
+    def select(self, method_changes, line_changes):
+        classes = self.columns["class"]
+        lines = self.columns["line"]
+        stmt_mask = np.zeros(len(classes), dtype=bool)
+        for cls_name, changed in line_changes.items():
+            stmt_mask |= (classes == cls_name) & np.isin(lines, list(changed))
+
+        names = np.char.add(np.char.add(np.char.add(classes, "@"), self.columns["method"]), self.columns["desc"])
+        method_mask = np.isin(names, list(method_changes))
+        return np.flatnonzero(stmt_mask).tolist(), np.flatnonzero(method_mask).tolist(),
+
+
+def _normalize_method_changes(method_changes):
+    result = set()
+    for m in method_changes:
+        if m == "org.apache.commons.math.optimization.univariate.MultiStartUnivariateRealOptimizer@optimize(FUNC,org.apache.commons.math.optimization.GoalType,double,double)":
+            m = m.replace("FUNC", "org.apache.commons.math.analysis.UnivariateRealFunction")
+        else:
+            try:
+                idx = 0
+                while True:
+                    pos = m.find("<", idx)
+                    if pos < 0:
+                        m = m.replace("T[]", "java.lang.Object[]")
+                        break
+
+                    end = m.find(">", pos + 1)
+                    target = m[pos:end + 1]
+                    if target == "<init>":
+                        idx = end + 1
+                        continue
+
+                    m = m.replace(target, "")
+            except:
+                pass
+        result.add(m)
+
+    return result
 
 
 def _parse_tarbz_level(name):
@@ -170,36 +263,42 @@ def _load_testmap(suite_dir, filelist):
     return result
 
 
-def _load_xml(suite_dir, test_size, method_changes, line_changes):
-    parser = PitParser(test_size, method_changes, line_changes)
-    count = 0
-    for file in os.listdir(suite_dir):
-        if not file.endswith(".xml.gz"):
-            continue
+def _load_xml(suite_dir, test_size):
+    paths = [os.path.join(suite_dir, file) for file in os.listdir(suite_dir) if file.endswith(".xml.gz")]
+    if len(paths) < 2:
+        return None
 
-        with gzip.GzipFile(os.path.join(suite_dir, file), 'rb') as fh:
-            sax.parse(fh, parser)
+    cache_dir = os.path.join(suite_dir, CACHE_DIR)
+    result = PitMatrix.load(cache_dir, paths, test_size)
+    if result is not None:
+        return result
 
-        parser.freeze()
-        count += 1
+    parser = PitParser(test_size)
+    for p in paths:
+        with gzip.open(p, 'rb') as fh:
+            parser.parse(fh)
 
-    if count < 2:
-        return None
+        parser.freeze()
 
+    result = PitMatrix.from_parser(parser)
+    result.save(cache_dir, paths, test_size)
+    return result
 
-    return parser
 
+def _normalize_test_names(tests):
+    tests = np.char.partition(np.array(tests, dtype=str), "(")[:, 0]
+    parts = np.char.rpartition(tests, ".")
+    names = np.char.add(np.char.add(parts[:, 0], "::"), parts[:, 2]).tolist()
+    # a name without a package keeps the old slicing with rfind() == -1.
+    for idx in np.flatnonzero(parts[:, 1] == "").tolist():
+        name = str(tests[idx])
+        names[idx] = name[:-1] + "::" + name
 
-def _mask_from_array(indices, size):
-    row = np.zeros(size, dtype=bool)
-    row[indices] = 1
-    return row
+    return np.array(names, dtype=str)
 
 
-def compute_correlation(proj_name, bug_id, line_changes, method_changes, u1, u2, u3):
+def compute_correlation(proj_name, bug_id, line_changes, method_changes, u1, u2, u3, analytic = False, shared = False):
     # print(proj_name, bug_id)
-    killmap = []
-    trigger_tests = []
     fails = set()
     suite_dir = os.path.join("suites", proj_name, bug_id + "f")
     file_list = os.listdir(suite_dir)
@@ -248,23 +347,25 @@ def compute_correlation(proj_name, bug_id, line_changes, method_changes, u1, u2,
         print(proj_name, bug_id, "Not enough test cases: ", test_size)
         return None, "insufficient",
 
-    pit_result = _load_xml(suite_dir, test_size, method_changes, line_changes)
+    pit_result = _load_xml(suite_dir, test_size)
     if pit_result is None:
         print(proj_name, bug_id, "No PIT result")
         return None, "mutation_error",
 
-    if len(pit_result.stmt_mutants) == 0:
+    method_changes = _normalize_method_changes(method_changes)
+    stmt_mutants, method_mutants = pit_result.select(method_changes, line_changes)
+    if len(stmt_mutants) == 0:
         print("No statement mutants", proj_name, bug_id)
-        for key, lines in pit_result._line_changes.items():
+        for key, lines in line_changes.items():
             for mutant in pit_result.mutants:
                 if key in mutant:
                     t = mutant[2]
                     if t in lines:
                         print(key, lines, mutant)
         return None, "no_stmt_mutants",
-    if len(pit_result.method_mutants) == 0:
+    if len(method_mutants) == 0:
         print("No methods mutants", proj_name, bug_id)
-        for name in pit_result._method_changes:
+        for name in method_changes:
             print("==============", name)
             name, desc = name.split("@")[1].split("(")
             for mutant in pit_result.mutants:
@@ -272,24 +373,13 @@ def compute_correlation(proj_name, bug_id, line_changes, method_changes, u1, u2,
                     print(mutant)
         return None, "no_method_mutants",
 
-    killmap = []
-    total_count = len(pit_result.mutants) + 1
-    has_dev_fail = False
-    for test_name, indices in pit_result.killmap.items():
-        idx = test_name.find("(")
-        if idx >= 0:
-            test_name = test_name[:idx]
-
-        idx = test_name.rfind(".")
-        test_name = test_name[:idx] + "::" + test_name[idx + 1:]
-        try:
-            fails.remove(test_name)
-            trigger_tests.append(len(killmap))
-            has_dev_fail |= "ESTest" not in test_name or "Regression" not in test_name
-        except KeyError:
-            pass
-
-        killmap.append(_mask_from_array(indices, total_count))
+    total_count = pit_result.mutant_count
+    test_names = _normalize_test_names(pit_result.tests)
+    # only the first test of each failing name triggers, as the names were removed from fails once matched.
+    names, first = np.unique(test_names, return_index=True)
+    matched = np.isin(names, list(fails))
+    trigger_tests = np.sort(first[matched]).tolist()
+    has_dev_fail = any("ESTest" not in name or "Regression" not in name for name in names[matched].tolist())
 
     if not has_dev_fail:
         print(proj_name, bug_id, "has no dev failure")
@@ -299,61 +389,17 @@ def compute_correlation(proj_name, bug_id, line_changes, method_changes, u1, u2,
         print(proj_name, bug_id, "No trigger tests found: ", len(trigger_tests))
         return None, "no_fails",
 
-    killmap = np.stack(killmap)
-    method_level_mutants = np.array(pit_result.method_mutants, dtype=int)
-    line_level_mutants = np.array(pit_result.stmt_mutants, dtype=int)
+    killmap = pit_result.kills
+    method_level_mutants = np.array(method_mutants, dtype=int)
+    line_level_mutants = np.array(stmt_mutants, dtype=int)
     all_mask = np.array(range(total_count - 1))
+    masks = [all_mask, method_level_mutants, line_level_mutants]
+    if analytic:
+        return sampling.make_exact(proj_name, bug_id, killmap, total_count, trigger_tests, masks, test_size=test_size), None,
+    if shared:
+        return sampling.SharedKillmap(proj_name, bug_id, killmap, total_count, trigger_tests, masks, test_size=test_size), None,
 
-    def _add_to(mask):
-        def _add(covers):
-            covers = covers[mask]
-            try:
-                return np.sum(covers) / len(covers)
-            except Exception:
-                print("Ignore covers that have only ", np.unique(covers))
-                return None
-
-        return _add
-
-    def _generator(ratio):
-        class_level = _add_to(all_mask)
-        method_level = _add_to(method_level_mutants)
-        line_level = _add_to(line_level_mutants)
-
-        is_type = isinstance(ratio, str)
-        if ratio is None or is_type:
-            if ratio == "max20":
-                max_size = int(test_size * 0.2)
-            elif ratio == "max50":
-                max_size = int(test_size * 0.5)
-            else:
-                max_size = test_size
-                    
-            for _ in range(10000):
-                size = random.randint(1, max_size)
-                row = [proj_name, bug_id, size / test_size]
-                testset = np.random.choice(test_size, size=size)
-                is_bug = len(np.intersect1d(testset, trigger_tests)) > 0
-                covered = np.any(killmap[testset,:], axis=0)
-
-                row.append(class_level(covered))
-                row.append(method_level(covered))
-                row.append(line_level(covered))
-                row.append(is_bug)
-                yield row
-        else:
-            size = int(ratio * test_size)                
-            for _ in range(10000):
-                row = [proj_name, bug_id, size]
-                testset = np.random.choice(test_size, size=size)
-                is_bug = len(np.intersect1d(testset, trigger_tests)) > 0
-                covered = np.any(killmap[testset,:], axis=0)
-
-                row.append(class_level(covered))
-                row.append(method_level(covered))
-                row.append(line_level(covered))
-                row.append(is_bug)
-                yield row
+    _generator = sampling.make_generator(proj_name, bug_id, killmap, total_count, trigger_tests, masks, test_size=test_size)
 
     return _generator, None,
 
@@ -365,34 +411,96 @@ def _run(proj_name, item):
         if generator is None:
             return error, proj_name, item,
 
-        out_root = os.path.join("cov_pit", proj_name, bug_id)
-        os.makedirs(out_root, exist_ok=True)
         for t in ["max20", "max50"]:
-            out_file = os.path.join(out_root, "{}.csv".format(t))
-            if not os.path.exists(out_file):
+            if not store.has_partition("cov_pit", proj_name, bug_id, t):
                 print(proj_name, bug_id, t)
-                try:
-                    with open(out_file, "w", newline='') as fh:
-                        writer = csv.writer(fh)
-                        for row in generator(t):
-                            writer.writerow(row)
-                except Exception as e:
-                    os.unlink(out_file)
-                    raise e
+                store.write_partition(store.get_partition_path("cov_pit", proj_name, bug_id, t), proj_name, bug_id, generator(t))
 
         for ratio in range(25, 525, 25):
-            out_file = os.path.join(out_root, "{}.csv".format(ratio))
+            out_file = store.get_partition_path("cov_pit", proj_name, bug_id, ratio)
+            exists = store.has_partition("cov_pit", proj_name, bug_id, ratio)
             ratio /= 1000
-            if not os.path.exists(out_file):
+            if not exists:
                 print(proj_name, bug_id, ratio)
-                try:
-                    with open(out_file, "w", newline='') as fh:
-                        writer = csv.writer(fh)
-                        for row in generator(ratio):
-                            writer.writerow(row)
-                except Exception as e:
-                    os.unlink(out_file)
-                    raise e
+                store.write_partition(out_file, proj_name, bug_id, generator(ratio))
+        return None
+    except Exception as e:
+        print(proj_name, bug_id, e)
+        return "unknown", proj_name, bug_id,
+
+
+def _run_ratio(spec, out_file, proj_name, bug_id, ratio):
+    try:
+        store.write_partition(out_file, proj_name, bug_id, sampling.sample_shared(spec, ratio))
+    except Exception as e:
+        print(proj_name, bug_id, ratio, e)
+        return False
+
+    return True
+
+
+def _share(pool, proj_name, item):
+    bug_id = item[0]
+    pending = []
+    for key, ratio in [(t, t) for t in ["max20", "max50"]] + [(r, r / 1000) for r in range(25, 525, 25)]:
+        if not store.has_partition("cov_pit", proj_name, bug_id, key):
+            pending.append((store.get_partition_path("cov_pit", proj_name, bug_id, key), ratio,))
+    if len(pending) == 0:
+        return None, None, [],
+
+    try:
+        shared, error = compute_correlation(proj_name, *item, shared=True)
+    except Exception as e:
+        print(proj_name, bug_id, e)
+        return "unknown", None, [],
+    if shared is None:
+        return error, None, [],
+
+    jobs = []
+    for out_file, ratio in pending:
+        print(proj_name, bug_id, ratio)
+        jobs.append(pool.apply_async(_run_ratio, (shared.spec, out_file, proj_name, bug_id, ratio)))
+    return None, shared, jobs,
+
+
+def _collect(stats, total, proj_name, status, shared, jobs):
+    for job in jobs:
+        if not job.get():
+            status = "unknown"
+    if shared is not None:
+        shared.close()
+
+    if status is not None:
+        stats[proj_name][status] += 1
+        total[status] += 1
+
+
+def _main_shared(pool, stats, total):
+    # the next bug is loaded while the ratios of the previous one still run on the workers.
+    running = None
+    for proj_name in d4j.NAMES:
+        for item in d4j.iterate_instance(proj_name):
+            current = (proj_name,) + _share(pool, proj_name, item)
+            if running is not None:
+                _collect(stats, total, *running)
+            running = current
+
+    if running is not None:
+        _collect(stats, total, *running)
+
+
+def _run_exact(proj_name, item):
+    bug_id = item[0]
+    out_file = store.get_exact_path("cov_pit_exact", proj_name, bug_id)
+    if os.path.exists(out_file):
+        return None
+
+    try:
+        exact, error = compute_correlation(proj_name, *item, analytic=True)
+        if exact is None:
+            return error, proj_name, item,
+
+        store.write_exact(out_file, [exact(t) for t in sampling.RATIOS])
         return None
     except Exception as e:
         print(proj_name, bug_id, e)
@@ -400,22 +508,33 @@ def _run(proj_name, item):
 
 
 def _main():
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--analytic", action="store_true", help="write the exact expected curves to cov_pit_exact instead of sampling")
+    parser.add_argument("--shared", action="store_true", help="load one bug at a time into shared memory and sample its ratios on all workers")
+    args = parser.parse_args(sys.argv[1:])
+
     stats = defaultdict(lambda: defaultdict(int))
     total = defaultdict(int)
     import multiprocessing
     import pprint
+    if args.shared:
+        sampling.start_sharing()
     with multiprocessing.Pool(8) as pool:
-        tasks = []
-        for proj_name in d4j.NAMES:
-            for item in d4j.iterate_instance(proj_name):
-                tasks.append(pool.apply_async(_run, (proj_name, item)))
-
-        for k in tasks:
-            t = k.get()
-            if t is not None:
-                t, name, bug_id = t
-                stats[name][t] += 1
-                total[t] += 1
+        if args.shared:
+            _main_shared(pool, stats, total)
+        else:
+            tasks = []
+            for proj_name in d4j.NAMES:
+                for item in d4j.iterate_instance(proj_name):
+                    tasks.append(pool.apply_async(_run_exact if args.analytic else _run, (proj_name, item)))
+
+            for k in tasks:
+                t = k.get()
+                if t is not None:
+                    t, name, bug_id = t
+                    stats[name][t] += 1
+                    total[t] += 1
 
     pp = pprint.PrettyPrinter(indent=2)
     pp.pprint(stats)
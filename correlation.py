@@ -1,9 +1,10 @@
 import os
-import random
-import csv
 import numpy as np
 import d4j
 import json
+import sampling
+import store
+from killmap import PackedKillmap, Killmap
 
 np.seterr(all='raise')
 
@@ -29,7 +30,7 @@ def _map_evosuite(tarbz, m):
 
 
 
-def compute_correlation(proj_name, bug_id, line_changes, method_changes, line_mutants, method_mutants, mutant_count):
+def compute_correlation(proj_name, bug_id, line_changes, method_changes, line_mutants, method_mutants, mutant_count, analytic = False, shared = False):
     killmap = []
     trigger_tests = []
     fails = set()
@@ -55,8 +56,30 @@ def compute_correlation(proj_name, bug_id, line_changes, method_changes, line_mu
         print(proj_name, bug_id, "No triggering tests found")
         return None, "no_fails",
 
+    blocks = []
+    test_size = 0
     for killmap_file in filter(lambda x: x.endswith(".killmap.csv"), file_list):
-        with open(os.path.join(suite_dir, killmap_file)) as fh:
+        prefix = os.path.join(suite_dir, killmap_file[:-len(".killmap.csv")])
+        if Killmap.read_mode(prefix) == "kill-pruned":
+            # rows of a pruned killmap miss the mutants earlier tests killed, so samples would be wrong.
+            print(proj_name, bug_id, "Pruned killmap", prefix)
+            return None, "pruned",
+
+        packed = PackedKillmap.load(prefix, mutant_count)
+        if packed is not None:
+            for idx, name in enumerate(packed.names):
+                try:
+                    fails.remove(name)
+                    trigger_tests.append(test_size + idx)
+                except KeyError:
+                    pass
+
+            blocks.append(packed.bits)
+            test_size += len(packed)
+            continue
+
+        killmap = []
+        with open(prefix + ".killmap.csv") as fh:
             for line in fh:
                 row = line.strip().split(",")
                 kills = row[1:]
@@ -65,105 +88,75 @@ def compute_correlation(proj_name, bug_id, line_changes, method_changes, line_mu
 
                 try:
                     fails.remove(row[0])
-                    trigger_tests.append(len(killmap))
+                    trigger_tests.append(test_size + len(killmap))
                 except KeyError:
                     pass
 
-                subrow = [v in {"EXC", "FAIL"} for v in kills]
+                subrow = [v in PackedKillmap.KILLED for v in kills]
                 if len(subrow) != mutant_count:
                     print(len(subrow), mutant_count, line)
                     return None, "error",
                 killmap.append(subrow)
 
-    test_size = len(killmap)
-    expected = mutant_count * test_size
+        if len(killmap) > 0:
+            blocks.append(sampling.pack(np.array(killmap, ndmin=2, dtype=bool)))
+        test_size += len(killmap)
+
     if test_size < 532:
-        print(proj_name, bug_id, "Not enough test cases: ", len(killmap))
+        print(proj_name, bug_id, "Not enough test cases: ", test_size)
         return None, "insufficient",
 
     if len(trigger_tests) == 0:
         print(proj_name, bug_id, "No trigger tests found: ", len(trigger_tests))
         return None, "no_fails",
 
-    killmap = np.array(killmap, ndmin=2, dtype=bool)
-    if killmap.size != expected:
+    killmap = np.concatenate(blocks)
+    if killmap.shape != (test_size, (mutant_count + 7) // 8):
         return None, "error",
-    method_level_mutants = np.array(method_mutants, dtype=int)
-    line_level_mutants = np.array(line_mutants, dtype=int)
+    method_level_mutants = np.asarray(method_mutants, dtype=int)
+    line_level_mutants = np.asarray(line_mutants, dtype=int)
     all_mask = np.array(range(mutant_count - 1))
+    masks = [all_mask, method_level_mutants, line_level_mutants]
+    if analytic:
+        return sampling.make_exact(proj_name, bug_id, killmap, mutant_count, trigger_tests, masks), None,
+    if shared:
+        return sampling.SharedKillmap(proj_name, bug_id, killmap, mutant_count, trigger_tests, masks), None,
 
-    def _add_to(mask):
-        def _add(covers):
-            covers = covers[mask]
-            try:
-                return np.sum(covers) / len(covers)
-            except Exception:
-                print("Ignore covers that have only ", np.unique(covers))
-                return None
-
-        return _add
-
-    def _generator(ratio):
-        class_level = _add_to(all_mask)
-        method_level = _add_to(method_level_mutants)
-        line_level = _add_to(line_level_mutants)
-
-        is_type = isinstance(ratio, str)
-        if ratio is None or is_type:
-            if ratio == "max20":
-                max_size = int(test_size * 0.2)
-            elif ratio == "max50":
-                max_size = int(test_size * 0.5)
-            else:
-                max_size = test_size
-                    
-            for _ in range(10000):
-                size = random.randint(1, max_size)
-                row = [proj_name, bug_id, size / test_size]
-                testset = np.random.choice(test_size, size=size)
-                is_bug = len(np.intersect1d(testset, trigger_tests)) > 0
-                covered = np.any(killmap[testset,:], axis=0)
-
-                row.append(class_level(covered))
-                row.append(method_level(covered))
-                row.append(line_level(covered))
-                row.append(is_bug)
-                yield row
-        else:
-            size = int(ratio * test_size)                
-            for _ in range(10000):
-                row = [proj_name, bug_id, size]
-                testset = np.random.choice(test_size, size=size)
-                is_bug = len(np.intersect1d(testset, trigger_tests)) > 0
-                covered = np.any(killmap[testset,:], axis=0)
-
-                row.append(class_level(covered))
-                row.append(method_level(covered))
-                row.append(line_level(covered))
-                row.append(is_bug)
-                yield row
+    _generator = sampling.make_generator(proj_name, bug_id, killmap, mutant_count, trigger_tests, masks)
 
     return _generator, None,
 
 
 def _main():
+    import argparse
+    import sys
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--analytic", action="store_true", help="write the exact expected curves to cov_exact instead of sampling")
+    parser.add_argument("--shared", action="store_true", help="load one bug at a time into shared memory and sample its ratios on all workers")
+    args = parser.parse_args(sys.argv[1:])
+
     from collections import defaultdict
     stats = defaultdict(lambda: defaultdict(int))
     total = defaultdict(int)
     import multiprocessing
     import pprint
+    if args.shared:
+        sampling.start_sharing()
     with multiprocessing.Pool(4) as pool:
-        tasks = []
-        for proj_name in d4j.NAMES:
-#         for proj_name in ["Chart"]:
-            for item in d4j.iterate_instance(proj_name):
-                tasks.append(pool.apply_async(_run, (proj_name, item)))
-
-        for k in tasks:
-            t = k.get()
-            t, name, bug_id = t
-            stats[name][t] += 1
-            total[t] += 1
+        if args.shared:
+            _main_shared(pool, stats, total)
+        else:
+            tasks = []
+            for proj_name in d4j.NAMES:
+#             for proj_name in ["Chart"]:
+                for item in d4j.iterate_instance(proj_name):
+                    tasks.append(pool.apply_async(_run_exact if args.analytic else _run, (proj_name, item)))
+
+            for k in tasks:
+                t = k.get()
+                t, name, bug_id = t
+                stats[name][t] += 1
+                total[t] += 1
 
     pp = pprint.PrettyPrinter(indent=2)
     pp.pprint(stats)
@@ -177,37 +170,101 @@ def _run(proj_name, item):
     if generator is None:
         return error, proj_name, item,
 
-    out_root = os.path.join("cov", proj_name, bug_id)
-    os.makedirs(out_root, exist_ok=True)
     for t in ["max20", "max50"]:
-        out_file = os.path.join(out_root, "{}.csv".format(t))
-        if not os.path.exists(out_file):
+        if not store.has_partition("cov", proj_name, bug_id, t):
             print(proj_name, bug_id, t)
             try:
-                with open(out_file, "w", newline='') as fh:
-                    writer = csv.writer(fh)
-                    for row in generator(t):
-                        writer.writerow(row)
+                store.write_partition(store.get_partition_path("cov", proj_name, bug_id, t), proj_name, bug_id, generator(t))
             except Exception as e:
-                os.unlink(out_file)
                 return "u", proj_name, bug_id,
 
     for ratio in range(25, 525, 25):
-        out_file = os.path.join(out_root, "{}.csv".format(ratio))
+        out_file = store.get_partition_path("cov", proj_name, bug_id, ratio)
+        exists = store.has_partition("cov", proj_name, bug_id, ratio)
         ratio /= 1000
-        if not os.path.exists(out_file):
+        if not exists:
             print(proj_name, bug_id, ratio)
             try:
-                with open(out_file, "w", newline='') as fh:
-                    writer = csv.writer(fh)
-                    for row in generator(ratio):
-                        writer.writerow(row)
+                store.write_partition(out_file, proj_name, bug_id, generator(ratio))
             except Exception as e:
-                os.unlink(out_file)
                 return "u", proj_name, bug_id,
     
     return "s", proj_name, bug_id,
 
 
+def _run_ratio(spec, out_file, proj_name, bug_id, ratio):
+    try:
+        store.write_partition(out_file, proj_name, bug_id, sampling.sample_shared(spec, ratio))
+    except Exception as e:
+        print(proj_name, bug_id, ratio, e)
+        return False
+
+    return True
+
+
+def _share(pool, proj_name, item):
+    bug_id = item[0]
+    pending = []
+    for key, ratio in [(t, t) for t in ["max20", "max50"]] + [(r, r / 1000) for r in range(25, 525, 25)]:
+        if not store.has_partition("cov", proj_name, bug_id, key):
+            pending.append((store.get_partition_path("cov", proj_name, bug_id, key), ratio,))
+    if len(pending) == 0:
+        return "s", None, [],
+
+    shared, error = compute_correlation(proj_name, *item, shared=True)
+    if shared is None:
+        return error, None, [],
+
+    jobs = []
+    for out_file, ratio in pending:
+        print(proj_name, bug_id, ratio)
+        jobs.append(pool.apply_async(_run_ratio, (shared.spec, out_file, proj_name, bug_id, ratio)))
+    return "s", shared, jobs,
+
+
+def _collect(stats, total, proj_name, status, shared, jobs):
+    for job in jobs:
+        if not job.get():
+            status = "u"
+    if shared is not None:
+        shared.close()
+
+    stats[proj_name][status] += 1
+    total[status] += 1
+
+
+def _main_shared(pool, stats, total):
+    # the next bug is loaded while the ratios of the previous one still run on the workers.
+    running = None
+    for proj_name in d4j.NAMES:
+        for item in d4j.iterate_instance(proj_name):
+            current = (proj_name,) + _share(pool, proj_name, item)
+            if running is not None:
+                _collect(stats, total, *running)
+            running = current
+
+    if running is not None:
+        _collect(stats, total, *running)
+
+
+def _run_exact(proj_name, item):
+    bug_id = item[0]
+    out_file = store.get_exact_path("cov_exact", proj_name, bug_id)
+    if os.path.exists(out_file):
+        return "s", proj_name, bug_id,
+
+    exact, error = compute_correlation(proj_name, *item, analytic=True)
+    if exact is None:
+        return error, proj_name, item,
+
+    try:
+        store.write_exact(out_file, [exact(t) for t in sampling.RATIOS])
+    except Exception as e:
+        print(proj_name, bug_id, e)
+        return "u", proj_name, bug_id,
+
+    return "s", proj_name, bug_id,
+
+
 if __name__ == "__main__":
     _main()
@@ -1,9 +1,11 @@
 import patch
 import os
-from collections import defaultdict
 import json
+from collections import OrderedDict
+import numpy as np
 
 NAMES = ("Time","Closure","Lang", "Math", "Chart",)
+INDEX_CACHE_BYTES = 1 << 28
 
 
 _empties = {
@@ -56,30 +58,163 @@ _empties = {
 }
 
 
-def _load_mutants(mutant_file):
-    l2m = defaultdict(set)
-    l2l = defaultdict(lambda: defaultdict(set))
-    cnt = 0
-
+def _parse_mutants(mutant_file):
+    methods = []
+    classes = []
+    line_nos = []
+    ids = []
     with open(mutant_file, "r") as fh:
         for line in fh:
-            cnt += 1
             line = line.strip()
             if line.count(":") != 6:
                 if "24:00" in line:
                     line = line.replace("24:00", "24\\00")
 
             arguments = line.split(":")
-            mid = int(arguments[0]) - 1
-            method_name = arguments[4]
-            line_no = int(arguments[5])
+            ids.append(int(arguments[0]) - 1)
+            methods.append(arguments[4])
+            classes.append(arguments[4].split("@")[0])
+            line_nos.append(int(arguments[5]))
+
+    return methods, classes, line_nos, ids,
+
+
+def _group(keys, ids):
+    # CSR offsets into ids sorted by key, one row per distinct key.
+    order = np.lexsort((ids, keys,))
+    rows, counts = np.unique(keys[order], return_counts=True)
+    indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+    np.cumsum(counts, out=indptr[1:])
+    return rows, indptr, ids[order],
+
+
+class MutantIndex:
+    # mutant ids of the Major mutants file, looked up by method and by (class, line).
+    _cache = OrderedDict()
+    _cache_bytes = 0
+
+
+    def __init__(self, count, methods, method_indptr, method_ids, classes, line_classes, line_numbers, line_indptr, line_ids):
+        self.count = count
+        self.methods = methods
+        self.method_indptr = method_indptr
+        self.method_ids = method_ids
+        self.classes = classes
+        self.line_classes = line_classes
+        self.line_numbers = line_numbers
+        self.line_indptr = line_indptr
+        self.line_ids = line_ids
+
+
+    @staticmethod
+    def clear_cache():
+        MutantIndex._cache.clear()
+        MutantIndex._cache_bytes = 0
 
-            line_key = method_name.split("@")[0]
 
-            l2m[method_name].add(mid)
-            l2l[line_key][line_no].add(mid)
+    def nbytes(self):
+        return sum(a.nbytes for a in (self.methods, self.method_indptr, self.method_ids, self.classes,
+                self.line_classes, self.line_numbers, self.line_indptr, self.line_ids))
 
-        return l2m, l2l, cnt
+
+    @staticmethod
+    def _get_index_path(mutant_file):
+        return mutant_file + ".index.npz"
+
+
+    @staticmethod
+    def build(mutant_file):
+        methods, classes, line_nos, ids = _parse_mutants(mutant_file)
+        ids = np.array(ids, dtype=np.int64)
+        method_names, method_keys = np.unique(np.array(methods, dtype=str), return_inverse=True)
+        method_rows, method_indptr, method_ids = _group(method_keys.astype(np.int64), ids)
+
+        class_names, class_keys = np.unique(np.array(classes, dtype=str), return_inverse=True)
+        line_nos = np.array(line_nos, dtype=np.int64)
+        base = int(line_nos.max()) + 1 if len(line_nos) > 0 else 1
+        line_rows, line_indptr, line_ids = _group(class_keys.astype(np.int64) * base + line_nos, ids)
+        line_classes, line_numbers = np.divmod(line_rows, base)
+        return MutantIndex(len(ids), method_names[method_rows], method_indptr, method_ids,
+                class_names, line_classes, line_numbers, line_indptr, line_ids)
+
+
+    def save(self, path, source):
+        tmp_path = path + ".tmp.npz"
+        np.savez(tmp_path, source=np.array(source, dtype=np.int64), count=np.array(self.count),
+                methods=self.methods, method_indptr=self.method_indptr, method_ids=self.method_ids,
+                classes=self.classes, line_classes=self.line_classes, line_numbers=self.line_numbers,
+                line_indptr=self.line_indptr, line_ids=self.line_ids)
+        os.replace(tmp_path, path)
+
+
+    @staticmethod
+    def load(mutant_file):
+        if not os.path.exists(mutant_file):
+            return None
+
+        st = os.stat(mutant_file)
+        # the mutants file only grows when a killmap adds mutants, which changes its size and mtime.
+        source = [st.st_size, st.st_mtime_ns]
+        cached = MutantIndex._cache.get(mutant_file)
+        if cached is not None and cached[0] == source:
+            MutantIndex._cache.move_to_end(mutant_file)
+            return cached[1]
+
+        index = None
+        path = MutantIndex._get_index_path(mutant_file)
+        if os.path.exists(path):
+            with np.load(path) as data:
+                if data["source"].tolist() == source:
+                    index = MutantIndex(int(data["count"]), data["methods"], data["method_indptr"], data["method_ids"],
+                            data["classes"], data["line_classes"], data["line_numbers"], data["line_indptr"], data["line_ids"])
+
+        if index is None:
+            index = MutantIndex.build(mutant_file)
+            index.save(path, source)
+
+        if cached is not None:
+            MutantIndex._cache_bytes -= cached[2]
+        size = index.nbytes()
+        MutantIndex._cache[mutant_file] = (source, index, size,)
+        MutantIndex._cache.move_to_end(mutant_file)
+        MutantIndex._cache_bytes += size
+        # a full-corpus run loads every bug, so only the recent indexes stay in memory.
+        while MutantIndex._cache_bytes > INDEX_CACHE_BYTES and len(MutantIndex._cache) > 1:
+            _, evicted = MutantIndex._cache.popitem(last=False)
+            MutantIndex._cache_bytes -= evicted[2]
+
+        return index
+
+
+    def _find(self, keys, key):
+        pos = np.searchsorted(keys, key)
+        if pos < len(keys) and keys[pos] == key:
+            return int(pos)
+
+        return None
+
+
+    def method(self, method_name):
+        row = self._find(self.methods, method_name)
+        if row is None:
+            return None
+
+        return self.method_ids[self.method_indptr[row]:self.method_indptr[row + 1]]
+
+
+    def lines(self, cls_name, line_nos):
+        cls = self._find(self.classes, cls_name)
+        if cls is None:
+            return None
+
+        lo, hi = np.searchsorted(self.line_classes, [cls, cls + 1])
+        numbers = self.line_numbers[lo:hi]
+        line_nos = np.array(sorted(line_nos), dtype=np.int64)
+        pos = np.searchsorted(numbers, line_nos)
+        found = pos < len(numbers)
+        found[found] = numbers[pos[found]] == line_nos[found]
+        rows = lo + pos[found]
+        return np.concatenate([self.line_ids[self.line_indptr[r]:self.line_indptr[r + 1]] for r in rows.tolist()] + [np.zeros(0, dtype=np.int64)])
 
 
 def iterate_instance(name):
@@ -94,11 +229,10 @@ def iterate_instance(name):
         total += 1
 
         mutant_file = os.path.join("suites", name, bug_id + "f", "mutants")
-        if not os.path.exists(mutant_file):
+        index = MutantIndex.load(mutant_file)
+        if index is None:
             continue
 
-        l2m, l2l, count = _load_mutants(mutant_file)
-
         suite_name = "-".join([name, bug_id + "f"])
         method_mutants = []
         line_mutants = []
@@ -107,26 +241,23 @@ def iterate_instance(name):
             if method_name == "no_method":
                 continue
 
-            selected = l2m.get(method_name)
+            selected = index.method(method_name)
             if selected is None:
                 if str(suite_name) not in _empties or method_name not in _empties[str(suite_name)]:
                     print("Should confirm that", method_name, "has no mutants in {}".format(suite_name))
             else:
-                method_mutants.extend(selected)
+                method_mutants.append(selected)
 
         for key, lines in line_changes.items():
-            l = l2l.get(key)
-            if l is None:
-                continue
-
-            for line_no in lines:
-                result = l.get(line_no)
-                if result is not None:
-                    line_mutants.extend(result)
+            result = index.lines(key, lines)
+            if result is not None:
+                line_mutants.append(result)
 
+        method_mutants = np.concatenate(method_mutants) if len(method_mutants) > 0 else []
+        line_mutants = np.concatenate(line_mutants) if len(line_mutants) > 0 else []
         if len(method_mutants) == 0 or len(line_mutants) == 0:
             no_fine_mutants += 1
             continue
 
-        yield bug_id, line_changes, method_changes, line_mutants, method_mutants, count,
+        yield bug_id, line_changes, method_changes, line_mutants, method_mutants, index.count,
     print("{}: {} no fine-level mutants".format(name, no_fine_mutants))
\ No newline at end of file
@@ -1,9 +1,14 @@
 import os
+import re
 import subprocess
 import tempfile
 import unidiff
 import shutil
 import sys
+import fcntl
+import uuid
+import multiprocessing.util
+from collections import OrderedDict
 from datetime import datetime
 from contextlib import contextmanager
 
@@ -13,8 +18,19 @@ _EVOSUITE_BIN = os.path.join(_D4J_HOME, "framework", "bin", "run_evosuite.pl")
 _RANDOOP_BIN = os.path.join(_D4J_HOME, "framework", "bin", "run_randoop.pl")
 _D4J_BIN = os.path.join(_D4J_HOME, "framework", "bin", "defects4j")
 _D4J_FIX_SUITE_BIN = os.path.join(_D4J_HOME, "framework", "util", "fix_test_suite.pl")
+_MAJOR_ANT_BIN = os.path.join(_D4J_HOME, "major", "bin", "ant")
+_BUILD_XML = os.path.abspath("build.xml")
 NAMES = ("Time","Closure","Lang", "Math", "Chart",)
 # NAMES = ("Time","Lang", "Math", "Chart",)
+CHECKOUT_ROOT = os.path.abspath("checkouts")
+USE_CHECKOUT_POOL = True
+WORKER_CHECKOUT_LIMIT = 4
+# idle working copies kept per bug, and bugs whose checkouts are kept at all (least recently used go first).
+IDLE_CHECKOUT_LIMIT = 4
+CHECKOUT_BUG_LIMIT = 32
+# cp falls back to a full copy without copy-on-write (e.g., ext4), which is only reported once.
+_reflink_warned = False
+_worker_checkouts = OrderedDict()
 
 
 def _shell(*cmd, stdout=None, timeout = None, cwd=os.getcwd(), envs=os.environ):
@@ -60,20 +76,21 @@ def d4j_checkout_into(proj_name, bug_id, tmp_dir):
             #workaround?
 
 
-def d4j_opposed_checkout_into(proj_name, bug_id, tmp_dir):
+def d4j_opposed_version(bug_id):
     prefix = "f" if bug_id[-1] == "b" else "b"
-    version = bug_id[:-1] + prefix
-    return d4j_checkout_into(proj_name, version, tmp_dir)
+    return bug_id[:-1] + prefix
+
+
+def d4j_opposed_checkout_into(proj_name, bug_id, tmp_dir):
+    return d4j_checkout_into(proj_name, d4j_opposed_version(bug_id), tmp_dir)
 
 
 def d4j_opposed_checkout(proj_name, bug_id):
-    prefix = "f" if bug_id[-1] == "b" else "b"
-    version = bug_id[:-1] + prefix
-    return d4j_checkout(proj_name, version)
+    return d4j_checkout(proj_name, d4j_opposed_version(bug_id))
 
 
 @contextmanager
-def d4j_checkout(proj_name, bug_id):
+def _d4j_fresh_checkout(proj_name, bug_id):
     cnt = 0
     try:
         while True:
@@ -97,6 +114,236 @@ def d4j_checkout(proj_name, bug_id):
             raise e
 
 
+class CheckoutPool:
+    PRISTINE = "pristine"
+    IDLE = "idle"
+    BUSY = "busy"
+
+
+    def __init__(self, proj_name, bug_id, root = None):
+        self.proj_name = proj_name
+        self.bug_id = bug_id
+        self.base = CHECKOUT_ROOT if root is None else root
+        self.root = os.path.join(self.base, proj_name, bug_id)
+        for name in (CheckoutPool.IDLE, CheckoutPool.BUSY):
+            os.makedirs(os.path.join(self.root, name), exist_ok=True)
+
+
+    def __str__(self):
+        return "CheckoutPool({}-{})".format(self.proj_name, self.bug_id)
+
+
+    @contextmanager
+    def _lock(self):
+        with open(os.path.join(self.root, ".lock"), "w") as fh:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+    def _pristine(self):
+        p = os.path.join(self.root, CheckoutPool.PRISTINE)
+        if os.path.exists(p):
+            return p
+
+        with self._lock():
+            if not os.path.exists(p):
+                cnt = 0
+                while True:
+                    cnt += 1
+                    tmp_dir = tempfile.mkdtemp(dir=self.root)
+                    try:
+                        _shell(_D4J_BIN, "checkout", "-w", tmp_dir, "-p", self.proj_name, "-v", self.bug_id)
+                        d4j_compile(tmp_dir)
+                        break
+                    except subprocess.CalledProcessError:
+                        shutil.rmtree(tmp_dir, ignore_errors=True)
+                        if cnt >= 10:
+                            raise Exception(self.proj_name + self.bug_id)
+
+                os.rename(tmp_dir, p)
+
+            _evict_checkouts(self.base, self.root)
+
+        return p
+
+
+    @staticmethod
+    def _busy_name(name):
+        # busy clones carry the pid of their owner, so that clones of dead processes can be reclaimed.
+        return "{}-{}".format(os.getpid(), name)
+
+
+    def _reclaim(self):
+        busy_dir = os.path.join(self.root, CheckoutPool.BUSY)
+        for name in os.listdir(busy_dir):
+            pid = _get_owner(name)
+            if pid is None or _is_alive(pid):
+                continue
+
+            try:
+                # the clone may be in any state, but _claim resets it before handing it out.
+                os.rename(os.path.join(busy_dir, name), os.path.join(self.root, CheckoutPool.IDLE, name.partition("-")[2]))
+            except FileNotFoundError:
+                pass
+
+
+    def _claim(self):
+        self._reclaim()
+        idle_dir = os.path.join(self.root, CheckoutPool.IDLE)
+        for name in os.listdir(idle_dir):
+            dest = os.path.join(self.root, CheckoutPool.BUSY, CheckoutPool._busy_name(name))
+            try:
+                # rename is atomic, so only one worker can claim an idle clone.
+                os.rename(os.path.join(idle_dir, name), dest)
+            except FileNotFoundError:
+                continue
+
+            try:
+                _shell("git", "reset", "--hard", "-q", cwd=dest)
+                # mutants.log tells the ids of excluded mutants in the next run (see killmap._write_exclude).
+                _shell("git", "clean", "-fdq", "-e", "mutants.log", cwd=dest)
+                return dest
+            except subprocess.CalledProcessError:
+                shutil.rmtree(dest, ignore_errors=True)
+
+        return None
+
+
+    def acquire(self):
+        _touch(self.root)
+        git_home = self._claim()
+        if git_home is None:
+            git_home = os.path.join(self.root, CheckoutPool.BUSY, CheckoutPool._busy_name(uuid.uuid4().hex))
+            # Working copies are modified in place (e.g., pit._compile_dev), so hardlinks are not safe here.
+            _copy_tree(self._pristine(), git_home)
+
+        return git_home
+
+
+    def release(self, git_home):
+        idle_dir = os.path.join(self.root, CheckoutPool.IDLE)
+        if len(os.listdir(idle_dir)) >= IDLE_CHECKOUT_LIMIT:
+            shutil.rmtree(git_home, ignore_errors=True)
+            return
+
+        name = os.path.basename(git_home).partition("-")[2]
+        os.rename(git_home, os.path.join(idle_dir, name))
+
+
+    @contextmanager
+    def checkout(self):
+        git_home = self.acquire()
+        try:
+            yield git_home
+        except BaseException:
+            # do not return a working copy in unknown state to the pool.
+            shutil.rmtree(git_home, ignore_errors=True)
+            raise
+        else:
+            self.release(git_home)
+
+
+def _get_owner(name):
+    # busy clones are named <pid>-<uuid>, anything else is not a working copy.
+    m = re.fullmatch(r"(\d+)-[0-9a-f]{32}", name)
+    return int(m.group(1)) if m is not None else None
+
+
+def _is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+
+    return True
+
+
+def _touch(path):
+    with open(os.path.join(path, ".used"), "a"):
+        pass
+    os.utime(os.path.join(path, ".used"))
+
+
+def _copy_tree(src, dest):
+    global _reflink_warned
+    try:
+        _shell("cp", "-a", "--reflink=always", src, dest)
+        return
+    except subprocess.CalledProcessError:
+        shutil.rmtree(dest, ignore_errors=True)
+
+    if not _reflink_warned:
+        print("No copy-on-write support under", CHECKOUT_ROOT, "- working copies are full copies")
+        _reflink_warned = True
+    _shell("cp", "-a", src, dest)
+
+
+def _evict_checkouts(base, keep):
+    # drops the least recently used bugs beyond CHECKOUT_BUG_LIMIT, unless one of their clones is in use.
+    roots = []
+    for proj_name in os.listdir(base):
+        proj_dir = os.path.join(base, proj_name)
+        if not os.path.isdir(proj_dir):
+            continue
+        for bug_id in os.listdir(proj_dir):
+            root = os.path.join(proj_dir, bug_id)
+            used = os.path.join(root, ".used")
+            roots.append((os.path.getmtime(used) if os.path.exists(used) else 0, root,))
+
+    roots.sort(reverse=True)
+    for _, root in roots[CHECKOUT_BUG_LIMIT:]:
+        busy_dir = os.path.join(root, CheckoutPool.BUSY)
+        owners = [_get_owner(name) for name in os.listdir(busy_dir)] if os.path.exists(busy_dir) else []
+        if root == keep or any(pid is not None and _is_alive(pid) for pid in owners):
+            continue
+
+        print("Evict checkouts of", root)
+        shutil.rmtree(root, ignore_errors=True)
+
+
+@contextmanager
+def d4j_checkout(proj_name, bug_id):
+    if not USE_CHECKOUT_POOL:
+        with _d4j_fresh_checkout(proj_name, bug_id) as git_home:
+            yield git_home
+        return
+
+    with CheckoutPool(proj_name, bug_id).checkout() as git_home:
+        yield git_home
+
+
+def _release_worker_checkouts():
+    while len(_worker_checkouts) > 0:
+        _, (pool, git_home) = _worker_checkouts.popitem(last=False)
+        pool.release(git_home)
+
+
+def d4j_worker_checkout(proj_name, bug_id):
+    # Keeps a few working copies open per process, so that the units of the same bug run in one checkout.
+    key = (proj_name, bug_id,)
+    item = _worker_checkouts.get(key)
+    if item is not None:
+        _worker_checkouts.move_to_end(key)
+        return item[1]
+
+    if len(_worker_checkouts) == 0:
+        multiprocessing.util.Finalize(None, _release_worker_checkouts, exitpriority=10)
+
+    while len(_worker_checkouts) >= WORKER_CHECKOUT_LIMIT:
+        _, (pool, git_home) = _worker_checkouts.popitem(last=False)
+        pool.release(git_home)
+
+    pool = CheckoutPool(proj_name, bug_id)
+    git_home = pool.acquire()
+    _worker_checkouts[key] = (pool, git_home,)
+    return git_home
+
+
 def d4j_test(git_home, suite_path = None):
     if suite_path is None:
         _shell(_D4J_BIN, "test", "-w", git_home, "-r")
@@ -140,15 +387,73 @@ def d4j_iterate_fixes(proj_name, is_fixed = True):
     return (str(i) + suffix for i in range(1, max_id + 1))
 
 
-def d4j_run_mutation(git_home, test_name, log_fh, timeout = None, suite_path = None):
+def d4j_run_mutation(git_home, test_name, log_fh, timeout = None, suite_path = None, exclude_path = None):
     test_name = test_name.replace("$", "\\$")
     cmds = [_D4J_BIN, "mutation", "-w", git_home, "-t", test_name]
     if suite_path is not None:
         cmds.append("-s")
         cmds.append(suite_path)
+    if exclude_path is not None:
+        cmds.append("-e")
+        cmds.append(exclude_path)
     _shell(*cmds, timeout=timeout, stdout=log_fh)
 
 
+def d4j_run_mutation_batch(git_home, cls_name, method_names, log_fh, timeout = None, test_dir = None):
+    # Runs the already generated mutants (see d4j_run_mutation) against several test methods in a single JVM.
+    for name in ("killMap.csv", "testMap.csv", "summary.csv"):
+        p = os.path.join(git_home, name)
+        if os.path.exists(p):
+            os.unlink(p)
+
+    cmds = [_MAJOR_ANT_BIN, "-f", _BUILD_XML,
+            "-Dd4j.home=" + _D4J_HOME,
+            "-Dd4j.dir.projects=" + _PROJECTS_DIR_PATH,
+            "-Dbasedir=" + git_home,
+            "-Dmajor.kill.log=" + os.path.join(git_home, "kill.csv"),
+            "-Dtest.entry.class=" + cls_name,
+            "-Dtest.entry.method=" + ",".join(method_names)]
+    if test_dir is None:
+        cmds.append("compile.tests")
+    else:
+        cmds.append("-Dd4j.test.dir=" + test_dir)
+        cmds.append("compile.gen.tests")
+    cmds.append("mutation.batch")
+    _shell(*cmds, timeout=timeout, stdout=log_fh, cwd=git_home)
+
+    return os.path.join(git_home, "killMap.csv"), os.path.join(git_home, "testMap.csv"), os.path.join(git_home, "summary.csv"),
+
+
+def d4j_run_coverage(git_home, log_fh, timeout = None, test_dir = None):
+    # Runs the whole suite once against the generated mutants (see d4j_run_mutation).
+    # Every mutant is excluded from the analysis, so only the coverage map is recorded.
+    for name in ("covMap.csv", "testMap.csv"):
+        p = os.path.join(git_home, name)
+        if os.path.exists(p):
+            os.unlink(p)
+
+    with tempfile.NamedTemporaryFile("w") as exclude_fh:
+        with open(os.path.join(git_home, "mutants.log"), "r") as fh:
+            for line in fh:
+                exclude_fh.write(line.split(":", 1)[0] + "\n")
+        exclude_fh.flush()
+
+        cmds = [_MAJOR_ANT_BIN, "-f", _BUILD_XML,
+                "-Dd4j.home=" + _D4J_HOME,
+                "-Dd4j.dir.projects=" + _PROJECTS_DIR_PATH,
+                "-Dbasedir=" + git_home,
+                "-Dmajor.exclude=" + exclude_fh.name]
+        if test_dir is None:
+            cmds.append("compile.tests")
+        else:
+            cmds.append("-Dd4j.test.dir=" + test_dir)
+            cmds.append("compile.gen.tests")
+        cmds.append("mutation.coverage")
+        _shell(*cmds, timeout=timeout, stdout=log_fh, cwd=git_home)
+
+    return os.path.join(git_home, "covMap.csv"), os.path.join(git_home, "testMap.csv"),
+
+
 def d4j_run_tests(git_home, suite_path):
     if suite_path is None:
         _shell(_D4J_BIN, "test", "-w", git_home, "-r")
@@ -9,24 +9,180 @@ from datetime import datetime
 from collections import defaultdict
 from d4jconstants import *
 from patch import load_changes
-from contextlib import AbstractContextManager
+import d4j
+from contextlib import AbstractContextManager, contextmanager
 import multiprocessing
 import time
 import json
 import tarfile
+import hashlib
+import fcntl
+import numpy as np
 import testsuite as ts
 
 
+BATCH_SIZE = 50
+DEFAULT_COST = 60.0
+WRITE_INTERVAL = 60
+CHECKPOINT_BYTES = 1 << 24
+# the directory of the scheduling process that workers hand over their mutants and coverage maps in.
+_scratch_dir = None
+
+
 class MutantsUnknownException(Exception):
     pass
 
 
+class PackedKillmap:
+    # code 0 is an empty cell (the mutant was not covered by the test).
+    OUTCOMES = (None, "LIVE", "FAIL", "EXC", "TIME",)
+    KILLED = {"FAIL", "EXC"}
+    OUTCOME_DTYPE = np.dtype([("test", "<u4"), ("mutant", "<u4"), ("code", "u1")])
+    _CODES = {v: idx for idx, v in enumerate(OUTCOMES)}
+    _CODES[""] = 0
+    _FAIL = _CODES["FAIL"]
+
+
+    def __init__(self, names, bits, outcomes, mutant_count):
+        self.names = names
+        self.bits = bits
+        self.outcomes = outcomes
+        self.mutant_count = mutant_count
+
+
+    def __len__(self):
+        return len(self.names)
+
+
+    @staticmethod
+    def get_paths(prefix):
+        return prefix + ".killmap.npy", prefix + ".outcomes.npy", prefix + ".killmap.names",
+
+
+    @staticmethod
+    def _encode(cells, mutant_count):
+        codes = PackedKillmap._CODES
+        try:
+            return np.fromiter((codes[v] for v in cells), dtype=np.uint8, count=mutant_count)
+        except KeyError as e:
+            raise Exception("Unknown outcome", e.args[0])
+
+
+    @staticmethod
+    def from_rows(rows, mutant_count):
+        names = []
+        bits = []
+        outcomes = []
+        killed = [PackedKillmap._CODES[v] for v in PackedKillmap.KILLED]
+        for row in rows:
+            if len(row) - 1 != mutant_count:
+                raise Exception("Inconsistent row", row[0], len(row) - 1, mutant_count)
+
+            codes = PackedKillmap._encode(row[1:], mutant_count)
+            bits.append(np.packbits(np.isin(codes, killed)))
+
+            # FAIL is implied by the kill bit, so only the other outcomes need the side table.
+            cols = np.flatnonzero((codes != 0) & (codes != PackedKillmap._FAIL))
+            side = np.empty(len(cols), dtype=PackedKillmap.OUTCOME_DTYPE)
+            side["test"] = len(names)
+            side["mutant"] = cols
+            side["code"] = codes[cols]
+            outcomes.append(side)
+            names.append(row[0])
+
+        nbytes = (mutant_count + 7) // 8
+        bits = np.stack(bits) if len(bits) > 0 else np.zeros((0, nbytes), dtype=np.uint8)
+        outcomes = np.concatenate(outcomes) if len(outcomes) > 0 else np.empty(0, dtype=PackedKillmap.OUTCOME_DTYPE)
+        return PackedKillmap(names, bits, outcomes, mutant_count)
+
+
+    def save(self, prefix):
+        bits_path, outcomes_path, names_path = PackedKillmap.get_paths(prefix)
+        # the bit matrix is written last so that its mtime marks a complete artifact.
+        with open(names_path, "w") as fh:
+            for name in self.names:
+                fh.write(name)
+                fh.write("\n")
+
+        np.save(outcomes_path, self.outcomes)
+        np.save(bits_path + ".tmp.npy", self.bits)
+        os.replace(bits_path + ".tmp.npy", bits_path)
+
+
+    @staticmethod
+    def is_available(prefix):
+        bits_path, outcomes_path, names_path = PackedKillmap.get_paths(prefix)
+        if not all(os.path.exists(p) for p in (bits_path, outcomes_path, names_path)):
+            return False
+
+        csv_path = prefix + ".killmap.csv"
+        return not os.path.exists(csv_path) or os.path.getmtime(csv_path) <= os.path.getmtime(bits_path)
+
+
+    @staticmethod
+    def load(prefix, mutant_count, mmap_mode="r"):
+        if not PackedKillmap.is_available(prefix):
+            return None
+
+        bits_path, outcomes_path, names_path = PackedKillmap.get_paths(prefix)
+        bits = np.load(bits_path, mmap_mode=mmap_mode)
+        if bits.shape[1] != (mutant_count + 7) // 8:
+            return None
+
+        with open(names_path, "r") as fh:
+            names = [l.rstrip("\n") for l in fh]
+
+        if len(names) != bits.shape[0]:
+            return None
+
+        outcomes = np.load(outcomes_path, mmap_mode=mmap_mode)
+        return PackedKillmap(names, bits, outcomes, mutant_count)
+
+
+    def killed(self, rows = None):
+        bits = self.bits if rows is None else self.bits[rows]
+        return np.unpackbits(bits, axis=1, count=self.mutant_count).view(bool)
+
+
+    def iterate_rows(self):
+        outcomes = self.outcomes
+        offsets = np.searchsorted(outcomes["test"], np.arange(len(self.names) + 1))
+        for idx, name in enumerate(self.names):
+            row = [None] * self.mutant_count
+            for col in np.flatnonzero(self.killed([idx])[0]):
+                row[col] = "FAIL"
+
+            side = outcomes[offsets[idx]:offsets[idx + 1]]
+            for col, code in zip(side["mutant"], side["code"]):
+                row[col] = PackedKillmap.OUTCOMES[code]
+
+            yield [name, *row]
+
+
+def convert_killmap(suite):
+    p = Killmap._get_killmap_path(suite)
+    mutant_count = Killmap._count_mutants(suite)
+    if mutant_count is None or not os.path.exists(p):
+        return False
+
+    rows = (row for row in Killmap._iterate_killmap(suite) if len(row) - 1 == mutant_count)
+    PackedKillmap.from_rows(rows, mutant_count).save(Killmap._get_packed_prefix(suite))
+    return True
+
+
 class Killmap(AbstractContextManager):
     COVERED = "covered"
     TIMEOUT = "timeout"
     ERROR = "error"
     UNKNOWN = "unknown"
+    # the row lacks the cells of mutants added after it was computed.
+    PARTIAL = "partial"
+    # the test reaches no mutant, so its row is known to be empty without analysis.
+    PRUNED = "pruned"
     ROOT_DIR = "suites"
+    # every mode keeps less than the previous one: outcomes of all cells, killed cells only,
+    # and killed cells of mutants that no earlier test killed.
+    MODES = ("full", "kill", "kill-pruned",)
 
 
     def __str__(self):
@@ -39,7 +195,7 @@ class Killmap(AbstractContextManager):
             if v == Killmap.TIMEOUT:
                 return False
 
-            has_unknown |= v == Killmap.UNKNOWN
+            has_unknown |= v == Killmap.UNKNOWN or v == Killmap.PARTIAL
 
         return None if has_unknown else True
 
@@ -55,11 +211,31 @@ class Killmap(AbstractContextManager):
 
 
     @staticmethod
-    def _iterate_killmap(suite):
+    def _count_mutants(suite):
+        index = d4j.MutantIndex.load(Killmap._get_mutants_path(suite))
+        return None if index is None else index.count
+
+
+    @staticmethod
+    def _index_mutants(mutants):
+        # a mutant is identified by its description without the id, and repeated descriptions by their order.
+        index = {}
+        seen = defaultdict(int)
+        for idx, line in enumerate(mutants):
+            key = line.split(":", 1)[1]
+            index[(key, seen[key],)] = idx
+            seen[key] += 1
+
+        return index
+
+
+    @staticmethod
+    def _iterate_killmap(suite, size = None):
+        # rows past size were appended after the last checkpoint, and the journal holds them.
         p = Killmap._get_killmap_path(suite)
         if os.path.exists(p):
-            with open(p, "r") as fh:
-                for row in csv.reader(fh):
+            with open(p, "rb") as fh:
+                for row in csv.reader(_read_lines(fh, size)):
                     yield row
 
 
@@ -83,22 +259,20 @@ class Killmap(AbstractContextManager):
     
     def remove(self, m):
         if m in self._methods:
-            try:
-                del self._methods[m]
-                self._dirty = True
-                del self._killmap[m]
-                return True
-            except:
-                pass
+            del self._methods[m]
+            self._rows.pop(m, None)
+            if self._killmap_cache is not None:
+                self._killmap_cache.pop(m, None)
+            self._journal.append({"m": m, "t": None})
+            return True
 
         return False
-            
 
 
     def _update(self, m, t):
         if self._methods.get(m) != t:
             self._methods[m] = t
-            self._dirty = True
+            self._journal.append({"m": m, "t": t})
 
 
     @staticmethod
@@ -127,6 +301,60 @@ class Killmap(AbstractContextManager):
         return suite.get_filepath("killmap.csv")
 
 
+    @staticmethod
+    def _get_compacted_path(suite, generation):
+        return suite.get_filepath("killmap.csv.{}".format(generation))
+
+
+    @staticmethod
+    def _get_journal_path(suite):
+        return suite.get_filepath("journal")
+
+
+    @staticmethod
+    def _get_lock_path(suite):
+        return suite.get_filepath("lock")
+
+
+    @staticmethod
+    def _get_runtimes_path(suite):
+        return suite.get_filepath("times")
+
+
+    @staticmethod
+    def _get_mode_path(suite):
+        return suite.get_filepath("mode")
+
+
+    @staticmethod
+    def read_mode(prefix):
+        p = prefix + ".mode"
+        if not os.path.exists(p):
+            return "full"
+
+        with open(p, "r") as fh:
+            return fh.read().strip()
+
+
+    @staticmethod
+    def _get_coverage_path(suite):
+        return suite.get_filepath("coverage")
+
+
+    @staticmethod
+    def _get_packed_prefix(suite):
+        return os.path.join(suite.suite_root, suite.suite_name)
+
+
+    @staticmethod
+    def load_packed(suite, mmap_mode="r"):
+        mutant_count = Killmap._count_mutants(suite)
+        if mutant_count is None:
+            return None
+
+        return PackedKillmap.load(Killmap._get_packed_prefix(suite), mutant_count, mmap_mode=mmap_mode)
+
+
     @staticmethod
     def parse_all_tests(p):
         names = set()
@@ -152,6 +380,24 @@ class Killmap(AbstractContextManager):
         return names
 
 
+    @staticmethod
+    def parse_major_testname(name):
+        if name.endswith("]"):
+            # cls[method]
+            cls_name, method_name = name[:-1].split("[", 1)
+        else:
+            # method(cls)
+            method_name, cls_name = name[:-1].split("(", 1)
+
+        try:
+            #parameterized testcases.
+            method_name = method_name[:method_name.index("[")]
+        except ValueError:
+            pass
+
+        return cls_name + "::" + method_name
+
+
     @staticmethod
     def initialize(suite, all_tests):
         names = Killmap.parse_all_tests(all_tests)
@@ -164,18 +410,14 @@ class Killmap(AbstractContextManager):
             removes = set(name for name in km._methods if name not in names)
             for name in removes:
                 print("Remove", name)
-                try:
-                    del km._methods[name]
-                    force_write = True
-                    del km._killmap[name]
-                except:
-                    pass
+                force_write |= km.remove(name)
 
             for name in (name for name in names if km.get_status(name) is None):
                 print("Add", name)
                 km.add(name)
 
             km.write(force_write=force_write)
+            km.close()
         else:
             print("Initialize killmap for", suite)
             with open(p, "w") as fh:
@@ -183,41 +425,211 @@ class Killmap(AbstractContextManager):
 
 
     def __init__(self, suite):
-        self._dirty = False
-        self._updated_killmap = set()
+        self._journal = []
+        self._rows = {}
+        self._killmap_cache = None
+        self._runtimes = None
+        self._runtimes_dirty = False
+        self._mutant_maps = {}
+        self._mutant_index = None
+        self._killed = None
+        # journal records that are not in the csv and json yet, and the csv size they were written on.
+        self._pending = 0
+        self._csv_size = None
         self.suite = suite
+        self.mutants = Killmap._load_mutants(suite)
+        self.mode = Killmap.read_mode(Killmap._get_packed_prefix(suite))
+
+        if os.path.exists(Killmap._get_journal_path(suite)):
+            # replaying the journal restores everything since the last checkpoint, without touching the files.
+            self._replay()
+        else:
+            self._recover()
+
 
-        mutants = self.mutants = Killmap._load_mutants(suite)
-        methods = self._methods = {m: t for m, t in Killmap._iterate_methods(suite)}
-        killmap = self._killmap = {}
+    def _recover(self):
+        # Killmaps written before the journal existed are checked against the csv once.
+        mutants = self.mutants
+        methods = self._methods = {m: t for m, t in Killmap._iterate_methods(self.suite)}
+        killmap = self._killmap_cache = {}
 
-        need_rewrite_killmap = False
-        for row in Killmap._iterate_killmap(suite):
-            if mutants is not None and len(row) - 1 != len(mutants):
-                need_rewrite_killmap = True
+        for row in Killmap._iterate_killmap(self.suite):
+            if mutants is not None and len(row) - 1 > len(mutants):
                 continue
 
             name = row[0]
             t = methods.get(name)
             if t is None:
-                need_rewrite_killmap = True
                 continue
 
             killmap[name] = row
-            if t == Killmap.UNKNOWN:
+            if mutants is not None and len(row) - 1 < len(mutants):
+                if t == Killmap.COVERED or t == Killmap.PRUNED or t == Killmap.UNKNOWN:
+                    self._update(name, Killmap.PARTIAL)
+            elif t == Killmap.UNKNOWN:
                 self._update(name, Killmap.COVERED)
 
         unknowns = set()
         for m, t in methods.items():
-            if m not in killmap and t == Killmap.COVERED:
+            if m not in killmap and (t == Killmap.COVERED or t == Killmap.PRUNED):
                 unknowns.add(m)
 
         if len(unknowns) > 0:
-            print("Found inconsistency between killmap and json in", suite)
+            print("Found inconsistency between killmap and json in", self.suite)
             for m in unknowns:
                 self._update(m, Killmap.UNKNOWN)
 
-        self.write(force_write=need_rewrite_killmap)
+        self.checkpoint()
+
+
+    def _replay(self):
+        with self._lock():
+            checkpoint, generation, records = Killmap._read_journal(Killmap._get_journal_path(self.suite))
+            self._finish_compaction(generation)
+            methods = {m: t for m, t in Killmap._iterate_methods(self.suite)}
+
+        for record in records:
+            name = record["m"]
+            if "r" in record:
+                self._rows[name] = [name, *record["r"]]
+            elif record["t"] is None:
+                methods.pop(name, None)
+                self._rows.pop(name, None)
+            else:
+                methods[name] = record["t"]
+
+        self._methods = methods
+        self._rows = {name: row for name, row in self._rows.items() if name in methods}
+        self._pending = len(records)
+        self._csv_size = checkpoint
+
+
+    @contextmanager
+    def _lock(self):
+        with open(Killmap._get_lock_path(self.suite), "w") as fh:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+    def _flush_journal(self):
+        if len(self._journal) == 0:
+            return
+
+        buf = "".join(json.dumps(record) + "\n" for record in self._journal)
+        with open(Killmap._get_journal_path(self.suite), "a") as fh:
+            fh.write(buf)
+            fh.flush()
+            os.fsync(fh.fileno())
+
+        self._pending += len(self._journal)
+        self._journal = []
+
+
+    def _finish_compaction(self, generation):
+        # a compacted csv is committed by the checkpoint of its generation, and only moved into place after it.
+        p = Killmap._get_compacted_path(self.suite, generation)
+        if os.path.exists(p):
+            os.replace(p, Killmap._get_killmap_path(self.suite))
+
+
+    @staticmethod
+    def _read_journal(p):
+        checkpoint = None
+        generation = 0
+        records = []
+        if os.path.exists(p):
+            with open(p, "r") as fh:
+                for line in fh:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # a torn record at the tail of a crashed run.
+                        break
+
+                    if "checkpoint" in record:
+                        checkpoint = record["checkpoint"]
+                        generation = record.get("generation", 0)
+                    else:
+                        records.append(record)
+
+        return checkpoint, generation, records,
+
+
+    def checkpoint(self):
+        suite = self.suite
+        csv_path = Killmap._get_killmap_path(suite)
+        journal_path = Killmap._get_journal_path(suite)
+
+        with self._lock():
+            self._flush_journal()
+            checkpoint, generation, records = Killmap._read_journal(journal_path)
+            self._finish_compaction(generation)
+
+            # csv rows appended after the last checkpoint are replayed from the journal.
+            if checkpoint is not None and os.path.exists(csv_path) and os.path.getsize(csv_path) > checkpoint:
+                os.truncate(csv_path, checkpoint)
+
+            methods = {m: t for m, t in Killmap._iterate_methods(suite)}
+            rows = {}
+            replaced = False
+            for record in records:
+                name = record["m"]
+                if "r" in record:
+                    rows[name] = [name, *record["r"]]
+                    replaced |= record.get("replace", False)
+                elif record["t"] is None:
+                    methods.pop(name, None)
+                    rows.pop(name, None)
+                else:
+                    methods[name] = record["t"]
+
+            rows = {name: row for name, row in rows.items() if name in methods}
+            compacted = None
+            if replaced:
+                # the stale copy of a replaced row would shadow it for readers of the csv, so compact it.
+                generation += 1
+                compacted = Killmap._get_compacted_path(suite, generation)
+                kept = [row for row in Killmap._iterate_killmap(suite) if row[0] in methods and row[0] not in rows]
+                _atomic_write(compacted, lambda fh: csv.writer(fh).writerows(itertools.chain(kept, rows.values())))
+                size = os.path.getsize(compacted)
+            else:
+                with open(csv_path, "a") as fh:
+                    writer = csv.writer(fh)
+                    for row in rows.values():
+                        writer.writerow(row)
+                    fh.flush()
+                    os.fsync(fh.fileno())
+                    size = fh.tell()
+
+            self._methods = methods
+            result = defaultdict(list)
+            for name, status in methods.items():
+                result[status].append(name)
+
+            _atomic_write(Killmap._get_list_path(suite), lambda fh: json.dump(result, fh, indent=2))
+            _atomic_write(journal_path, lambda fh: fh.write(json.dumps({"checkpoint": size, "generation": generation}) + "\n"))
+            if compacted is not None:
+                self._finish_compaction(generation)
+
+        self._rows = {}
+        self._pending = 0
+        self._csv_size = size
+        if self._killmap_cache is not None:
+            self._killmap_cache.update(rows)
+
+
+    @property
+    def _killmap(self):
+        if self._killmap_cache is None:
+            methods = self._methods
+            self._killmap_cache = {row[0]: row for row in Killmap._iterate_killmap(self.suite, self._csv_size) if row[0] in methods}
+
+        cache = self._killmap_cache
+        cache.update(self._rows)
+        return cache
 
 
     def __enter__(self):
@@ -270,111 +682,641 @@ class Killmap(AbstractContextManager):
         return self._methods.get(name)
 
 
-    def append_d4j_killmap(self, name, killmap_path, mutants_path):
-        if not os.path.exists(mutants_path) or not os.path.exists(killmap_path):
-            return
+    @property
+    def runtimes(self):
+        if self._runtimes is None:
+            p = Killmap._get_runtimes_path(self.suite)
+            self._runtimes = {}
+            if os.path.exists(p):
+                with open(p, "r") as fh:
+                    self._runtimes = json.load(fh)
+
+        return self._runtimes
+
+
+    def record_runtime(self, name, seconds):
+        self.runtimes[name] = seconds
+        self._runtimes_dirty = True
+
+
+    def set_mode(self, mode):
+        # the file records the weakest mode any row was produced with.
+        if Killmap.MODES.index(mode) > Killmap.MODES.index(self.mode):
+            self.mode = mode
+            _atomic_write(Killmap._get_mode_path(self.suite), lambda fh: fh.write(mode + "\n"))
+
+
+    def killed_mutants(self):
+        if self._killed is None:
+            self._killed = set()
+            for row in self._killmap.values():
+                self._killed.update(idx for idx, v in enumerate(row[1:]) if v in PackedKillmap.KILLED)
+
+        return self._killed
+
 
+    def get_exclude(self, name):
+        indices = set()
+        # the cells of a partial row are kept, so only the mutants after them need to be analyzed.
+        if self._methods.get(name) == Killmap.PARTIAL:
+            row = self._killmap.get(name)
+            if row is not None:
+                indices.update(range(len(row) - 1))
+
+        if self.mode == "kill-pruned":
+            indices.update(self.killed_mutants())
+
+        if len(indices) == 0:
+            return None
+
+        return Killmap._get_mutants_path(self.suite), sorted(indices),
+
+
+    def _extend_mutants(self, lines):
+        for name, t in list(self._methods.items()):
+            if t == Killmap.COVERED or t == Killmap.PRUNED:
+                self._update(name, Killmap.PARTIAL)
+
+        # statuses are durable before the mutants file grows, so a crash never leaves a short covered row.
+        with self._lock():
+            self._flush_journal()
+            with open(Killmap._get_mutants_path(self.suite), "a") as fh:
+                for line in lines:
+                    fh.write(line + "\n")
+                fh.flush()
+                os.fsync(fh.fileno())
+
+        self.mutants.extend(lines)
+
+
+    def _check_mutants(self, mutants_path):
         p = Killmap._get_mutants_path(self.suite)
         if self.mutants is None:
             shutil.copy(mutants_path, p)
             self.mutants = Killmap._load_mutants(self.suite)
-        else:
-            with open(mutants_path, "r") as fh:
-                for idx, line in enumerate(fh):
-                    if self.mutants[idx] != line.strip():
-                        shutil.copy(mutants_path, p + ".different")
-                        raise Exception("Inconsistent mutants")
+            return None
+
+        with open(mutants_path, "r") as fh:
+            lines = [l.strip() for l in fh]
+
+        if lines == self.mutants[:len(lines)]:
+            return None
+
+        if self._mutant_index is None:
+            self._mutant_index = Killmap._index_mutants(self.mutants)
+
+        index = self._mutant_index
+        remap = []
+        added = []
+        for key, idx in sorted(Killmap._index_mutants(lines).items(), key=lambda x: x[1]):
+            mid = index.get(key)
+            if mid is None:
+                mid = index[key] = len(self.mutants) + len(added)
+                added.append("{}:{}".format(mid + 1, key[0]))
+            remap.append(mid)
+
+        if len(added) > 0:
+            print("Add", len(added), "mutants to", self.suite)
+            self._extend_mutants(added)
+
+        return remap
+
+
+    def _append_row(self, name, results, remap = None, status = COVERED):
+        row = [name] + [None] * len(self.mutants)
+        replace = False
+        if self._methods.get(name) == Killmap.PARTIAL:
+            base = self._killmap.get(name)
+            if base is not None:
+                row[1:len(base)] = base[1:]
+                replace = True
+
+        kill_only = self.mode != "full"
+        for idx, result in results:
+            if remap is not None:
+                idx = remap[idx - 1] + 1
+            if idx < 1 or idx > len(self.mutants):
+                raise Exception("Unknown mutant", idx)
+            if kill_only and result not in PackedKillmap.KILLED:
+                continue
+            row[idx] = result
+            if self._killed is not None and result in PackedKillmap.KILLED:
+                self._killed.add(idx - 1)
+
+        self._rows[name] = row
+        if self._killmap_cache is not None:
+            self._killmap_cache[name] = row
+        self._journal.append({"m": name, "r": row[1:], "replace": True} if replace else {"m": name, "r": row[1:]})
+        self._update(name, status)
+
+
+    def has_coverage(self):
+        p = Killmap._get_coverage_path(self.suite)
+        if self.mutants is None or not os.path.exists(p):
+            return False
+
+        with open(p, "r") as fh:
+            return json.load(fh).get("mutants") == len(self.mutants)
+
+
+    def prune(self, covmap_path, testmap_path):
+        if not os.path.exists(covmap_path) or not os.path.exists(testmap_path):
+            return 0
+
+        tests = {}
+        with open(testmap_path, "r") as fh:
+            fh.readline()
+            for line in fh:
+                test_no, test_name = line.strip().split(",", 1)
+                tests[test_no] = Killmap.parse_major_testname(test_name)
+
+        covered = set()
+        with open(covmap_path, "r") as fh:
+            fh.readline()
+            for line in fh:
+                covered.add(tests.get(line.split(",", 1)[0]))
+
+        # an empty or cut short coverage run would prune tests that do reach mutants.
+        if len(covered - {None}) == 0:
+            print("Empty coverage map, do not prune", self.suite)
+            return 0
+
+        missing = len(self._methods) - len(set(tests.values()) & set(self._methods))
+        if missing > 0:
+            print("Coverage map misses", missing, "of", len(self._methods), "tests, do not prune", self.suite)
+            return 0
+
+        # tests missing from the test map were not executed, so nothing is known about them.
+        pruned = 0
+        for name in set(tests.values()) - covered:
+            if self.get_status(name) == Killmap.UNKNOWN:
+                self._append_row(name, [], status=Killmap.PRUNED)
+                pruned += 1
+
+        print("Pruned", pruned, "of", len(self._methods), "tests in", self.suite)
+        _atomic_write(Killmap._get_coverage_path(self.suite), lambda fh: json.dump({"mutants": len(self.mutants), "covered": sorted(filter(None, covered))}, fh))
+        return pruned
 
-        row = [name]
+
+    def append_d4j_killmap(self, name, killmap_path, mutants_path):
+        if not os.path.exists(mutants_path) or not os.path.exists(killmap_path):
+            return
+
+        remap = self._check_mutants(mutants_path)
+        results = []
         with open(killmap_path, "r") as fh:
             fh.readline()
             for line in fh:
                 idx, result = line.strip().split(",")
-                idx = int(idx)
-                empties = idx - len(row)
-                row.extend([None] * empties)
-                row.append(result)
+                results.append((int(idx), result,))
 
-        empties = len(self.mutants) - len(row) + 1
-        row.extend([None] * empties)
+        self._append_row(name, results, remap)
 
-        if len(row) - 1 != len(self.mutants):
-            raise Exception()
 
-        self._update(name, Killmap.COVERED)
-        self._killmap[name] = row
-        self._updated_killmap.add(name)
+    def append_major_killmap(self, killmap_path, testmap_path, mutants_path):
+        if not all(os.path.exists(p) for p in (mutants_path, killmap_path, testmap_path)):
+            return set()
+
+        remap = self._check_mutants(mutants_path)
+        tests = {}
+        with open(testmap_path, "r") as fh:
+            fh.readline()
+            for line in fh:
+                test_no, test_name = line.strip().split(",", 1)
+                tests[test_no] = Killmap.parse_major_testname(test_name)
+
+        results = defaultdict(list)
+        with open(killmap_path, "r") as fh:
+            fh.readline()
+            for line in fh:
+                elems = line.strip().split(",")
+                # Major omits the outcome column when it only records failures.
+                results[elems[0]].append((int(elems[1]), elems[2] if len(elems) > 2 else "FAIL",))
+
+        done = set()
+        for test_no, name in tests.items():
+            if self.get_status(name) is not None:
+                self._append_row(name, results[test_no], remap)
+                done.add(name)
+
+        return done
 
 
     def write(self, force_write = False):
-        if not (force_write or self._dirty):
+        if self._runtimes_dirty:
+            _atomic_write(Killmap._get_runtimes_path(self.suite), lambda fh: json.dump(self._runtimes, fh))
+            self._runtimes_dirty = False
+
+        if force_write:
+            self.checkpoint()
             return
 
-        if len(self._updated_killmap) > 0:
-            km = self._killmap
-            with open(Killmap._get_killmap_path(self.suite), "a") as fh:
-                writer = csv.writer(fh)
-                for name in self._updated_killmap:
-                    writer.writerow(km[name])
+        with self._lock():
+            self._flush_journal()
 
-        with open(Killmap._get_list_path(self.suite), "w") as fh:
-            json.dump(self.snapshot(), fh, indent=2)
+        if os.path.getsize(Killmap._get_journal_path(self.suite)) > CHECKPOINT_BYTES:
+            self.checkpoint()
 
-        self._updated_killmap = set()
+
+    def write_packed(self):
+        if self.mutants is None:
+            return
+
+        self.write(force_write=True)
+        killmap = self._killmap
+        size = len(self.mutants) + 1
+        rows = (killmap[name] for name in self._methods if name in killmap and len(killmap[name]) == size)
+        PackedKillmap.from_rows(rows, len(self.mutants)).save(Killmap._get_packed_prefix(self.suite))
+
+
+    def close(self):
+        # readers of the csv and json do not replay the journal, so a finished run brings them up to date.
+        self.write()
+        if self._pending > 0:
+            self.checkpoint()
 
 
     def __exit__(self, exc_type, exc_value, traceback):
-        # isinstance seems not working as expected within the forked thread.
-        if (exc_type is None or exc_type.__name__ == "KeyboardInterrupt"):
-            self.write()
+        # journal records are valid whenever they were appended, so flush them even on errors.
+        self.close()
+        return False
+
+
+def _read_lines(fh, size):
+    for line in fh:
+        if size is not None:
+            size -= len(line)
+            if size < 0:
+                break
+        yield line.decode("utf8")
+
 
+def _atomic_write(p, dump):
+    tmp = p + ".tmp"
+    with open(tmp, "w") as fh:
+        dump(fh)
+        fh.flush()
+        os.fsync(fh.fileno())
+
+    os.replace(tmp, p)
+
+
+def _write_exclude(mutants_log_path, exclude, fh):
+    # mutant ids are stable within a checkout, so the previous mutants.log tells the ids of excluded mutants.
+    if exclude is None or not os.path.exists(mutants_log_path):
         return False
 
+    mutants_path, indices = exclude
+    with open(mutants_path, "r") as f:
+        mutants = [l.strip() for l in itertools.islice(f, indices[-1] + 1)]
+    indices = set(indices)
+    keys = set(key for key, idx in Killmap._index_mutants(mutants).items() if idx in indices)
+    with open(mutants_log_path, "r") as f:
+        lines = [l.strip() for l in f]
+
+    excluded = 0
+    for key, idx in Killmap._index_mutants(lines).items():
+        if key in keys:
+            fh.write(lines[idx].split(":", 1)[0] + "\n")
+            excluded += 1
 
-def _analyze(git_home, killmap, candidates, timeout):
+    fh.flush()
+    return excluded > 0
+
+
+def _analyze_test(git_home, killmap, m, timeout):
     mutants_log_path = os.path.join(git_home, "mutants.log")
     kill_csv = os.path.join(git_home, "kill.csv")
 
+    print(multiprocessing.current_process(), ":", datetime.now(),":", m)
+    with tempfile.TemporaryFile() as fh, tempfile.NamedTemporaryFile("w") as exclude_fh:
+        try:
+            exclude_path = exclude_fh.name if _write_exclude(mutants_log_path, killmap.get_exclude(m), exclude_fh) else None
+            d4j_run_mutation(git_home, m, fh, suite_path=killmap.suite.suite_path, timeout=timeout, exclude_path=exclude_path)
+            killmap.append_d4j_killmap(m, kill_csv, mutants_log_path)
+        except subprocess.TimeoutExpired:
+            print(datetime.now(), "Mutation timeout from {} in {} with timeout {:.2f}".format(m, killmap.suite, timeout))
+            killmap.add_timeout(m)
+            return False
+        except subprocess.CalledProcessError:
+            print(m)
+            # This method causes exception in defects4j.mutation.
+            fh.seek(0)
+            for line in fh:
+                print(line)
+
+            killmap.add_error(m)
+
+    return True
+
+
+def _analyze_batch(git_home, killmap, candidates, timeout, test_dir):
+    mutants_log_path = os.path.join(git_home, "mutants.log")
+    by_class = defaultdict(list)
+    for m in candidates:
+        cls_name, method_name = m.split("::")
+        by_class[cls_name].append(method_name)
+
+    remains = []
+    for cls_name, method_names in by_class.items():
+        for idx in range(0, len(method_names), BATCH_SIZE):
+            names = method_names[idx:idx + BATCH_SIZE]
+            print(multiprocessing.current_process(), ":", datetime.now(),":", cls_name, len(names))
+            with tempfile.TemporaryFile() as fh:
+                try:
+                    killmap_path, testmap_path, summary_path = d4j_run_mutation_batch(git_home, cls_name, names, fh, timeout=timeout, test_dir=test_dir)
+                    if _batch_ran(killmap_path, summary_path):
+                        done = killmap.append_major_killmap(killmap_path, testmap_path, mutants_log_path)
+                    else:
+                        # the tests stay unknown, and the runs per test analyze them.
+                        print(datetime.now(), "Batch mutation ran no mutants for {} in {}".format(cls_name, killmap.suite))
+                        done = set()
+                except (subprocess.TimeoutExpired, subprocess.CalledProcessError) as e:
+                    # isolate the failing test by falling back to one run per test.
+                    print(datetime.now(), "Batch mutation failed for {} in {}: {}".format(cls_name, killmap.suite, type(e).__name__))
+                    done = set()
+
+            remains.extend(m for m in (cls_name + "::" + n for n in names) if m not in done)
+            killmap.write()
+
+    return remains
+
+
+def _batch_ran(killmap_path, summary_path):
+    # A batch without mutated classes on its classpath lists the tests with no kills, which would look like
+    # tests that kill nothing. Major's summary tells whether any mutant was executed at all.
+    if not os.path.exists(summary_path):
+        return False
+
+    with open(summary_path, "r") as fh:
+        summary = next(csv.DictReader(fh), None)
+    if summary is None:
+        return False
+
+    if int(summary.get("MutantsCovered") or 0) == 0:
+        return False
+
+    if int(summary.get("MutantsKilled") or 0) == 0:
+        return True
+
+    # kills in the summary need rows below the header of the kill map.
+    if not os.path.exists(killmap_path):
+        return False
+    with open(killmap_path, "r") as fh:
+        return len(list(itertools.islice(fh, 2))) > 1
+
+
+@contextmanager
+def _test_dir(suite_path):
+    if suite_path is None:
+        yield None
+        return
+
+    with tempfile.TemporaryDirectory() as test_dir:
+        with tarfile.open(suite_path, "r:bz2") as tar:
+            tar.extractall(test_dir)
+        yield test_dir
+
+
+def _run_coverage(git_home, killmap, timeout):
+    print(multiprocessing.current_process(), ":", datetime.now(),":", "coverage of", killmap.suite)
+    with tempfile.TemporaryFile() as fh, _test_dir(killmap.suite.suite_path) as test_dir:
+        try:
+            paths = d4j_run_coverage(git_home, fh, timeout=timeout, test_dir=test_dir)
+        except (subprocess.TimeoutExpired, subprocess.CalledProcessError) as e:
+            # without coverage every test is simply analyzed.
+            print(datetime.now(), "Coverage failed for {}: {}".format(killmap.suite, type(e).__name__))
+            return
+
+    killmap.prune(*paths)
+
+
+def _analyze(git_home, killmap, candidates, timeout, batch = False, prune = False):
     with killmap:
+        candidates = [m for m in candidates if killmap.get_status(m) != Killmap.COVERED]
+        if killmap.mode == "kill-pruned":
+            # cheap tests first, so that the expensive ones skip the mutants already killed.
+            candidates.sort(key=_cost_model(killmap))
+        if (batch or prune) and len(candidates) > 0:
+            # The first run generates and compiles the mutants that the coverage and the batch reuse.
+            if not _analyze_test(git_home, killmap, candidates[0], timeout):
+                return
+
+            candidates = candidates[1:]
+            if prune and not killmap.has_coverage():
+                _run_coverage(git_home, killmap, timeout)
+                candidates = [m for m in candidates if killmap.get_status(m) != Killmap.PRUNED]
+
+        if batch and len(candidates) > 0:
+            with _test_dir(killmap.suite.suite_path) as test_dir:
+                candidates = _analyze_batch(git_home, killmap, candidates, timeout, test_dir)
+
         for m in candidates:
             if killmap.get_status(m) == Killmap.COVERED:
                 continue
-        
-            print(multiprocessing.current_process(), ":", datetime.now(),":", m)
-            with tempfile.TemporaryFile() as fh:
-                try:
-                    d4j_run_mutation(git_home, m, fh, suite_path=killmap.suite.suite_path, timeout=timeout)
-                    killmap.append_d4j_killmap(m, kill_csv, mutants_log_path)
-                except subprocess.TimeoutExpired:
-                    print(datetime.now(), "Mutation timeout from {} in {} with timeout {:.2f}".format(m, killmap.suite, timeout))
-                    killmap.add_timeout(m)
-                    break
-                except subprocess.CalledProcessError:
-                    print(m)
-                    # This method causes exception in defects4j.mutation.
-                    fh.seek(0)
-                    for line in fh:
-                        print(line)
-
-                    killmap.add_error(m)
-                    continue
+
+            if not _analyze_test(git_home, killmap, m, timeout):
+                break
 
 
 def _generate_map(args):
-    timeout, suites, killmaps = args
+    timeout, batch, prune, mode, suites, killmaps = args
     devsuite = suites[0]
     proj_name = devsuite.proj_name
     bug_id = devsuite.bug_id
 
     with d4j_checkout(proj_name, bug_id) as git_home:
         for idx, km in enumerate(killmaps):
+            km.set_mode(mode)
+            if batch:
+                # Major records kills only in a batch, so the rows of a batch are kill-only whatever the mode.
+                km.set_mode("kill")
             snapshot = km.snapshot()
             print(multiprocessing.current_process(), ":", datetime.now(),":", km)
-            _analyze(git_home, km, snapshot[Killmap.ERROR], timeout)
-            _analyze(git_home, km, snapshot[Killmap.UNKNOWN], timeout)
-            _analyze(git_home, km, snapshot[Killmap.TIMEOUT], timeout)
+            _analyze(git_home, km, snapshot[Killmap.ERROR], timeout, batch)
+            _analyze(git_home, km, snapshot[Killmap.UNKNOWN], timeout, batch, prune)
+            _analyze(git_home, km, snapshot[Killmap.PARTIAL], timeout, batch)
+            _analyze(git_home, km, snapshot[Killmap.TIMEOUT], timeout, batch)
+            km.write_packed()
             
 
+def _run_unit(unit):
+    proj_name, bug_id, suite_path, m, timeout, exclude = unit
+    git_home = d4j_worker_checkout(proj_name, bug_id)
+    mutants_log_path = os.path.join(git_home, "mutants.log")
+    kill_csv = os.path.join(git_home, "kill.csv")
+
+    print(multiprocessing.current_process(), ":", datetime.now(),":", m)
+    start = time.time()
+    with tempfile.TemporaryFile() as fh, tempfile.NamedTemporaryFile("w") as exclude_fh:
+        try:
+            exclude_path = exclude_fh.name if _write_exclude(mutants_log_path, exclude, exclude_fh) else None
+            d4j_run_mutation(git_home, m, fh, suite_path=suite_path, timeout=timeout, exclude_path=exclude_path)
+        except subprocess.TimeoutExpired:
+            print(datetime.now(), "Mutation timeout from {} with timeout {:.2f}".format(m, timeout))
+            return unit, Killmap.TIMEOUT, None, None, time.time() - start,
+        except subprocess.CalledProcessError:
+            print(m)
+            # This method causes exception in defects4j.mutation.
+            fh.seek(0)
+            for line in fh:
+                print(line)
+
+            return unit, Killmap.ERROR, None, None, time.time() - start,
+
+    elapsed = time.time() - start
+    if not os.path.exists(mutants_log_path) or not os.path.exists(kill_csv):
+        return unit, None, None, None, elapsed,
+
+    results = []
+    with open(kill_csv, "r") as fh:
+        fh.readline()
+        for line in fh:
+            idx, result = line.strip().split(",")
+            results.append((int(idx), result,))
+
+    # mutants.log is overwritten by the next unit, so hand over a copy, and its digest to reuse the remap.
+    with open(mutants_log_path, "rb") as fh:
+        digest = hashlib.sha1(fh.read()).hexdigest()
+
+    return unit, Killmap.COVERED, results, (digest, _scratch_copy(mutants_log_path),), elapsed,
+
+
+def _init_scratch(scratch_dir):
+    global _scratch_dir
+    _scratch_dir = scratch_dir
+
+
+def _scratch_copy(p):
+    # copies live in a directory of the scheduling process, outside of the checkout pool.
+    fd, copy = tempfile.mkstemp(dir=_scratch_dir)
+    os.close(fd)
+    shutil.copy(p, copy)
+    return copy
+
+
+def _cost_model(km):
+    runtimes = km.runtimes
+    by_class = defaultdict(list)
+    for name, t in runtimes.items():
+        by_class[name.split("::")[0]].append(t)
+
+    by_class = {k: sum(v) / len(v) for k, v in by_class.items()}
+    default = sum(runtimes.values()) / len(runtimes) if len(runtimes) > 0 else DEFAULT_COST
+
+    def _predict(m):
+        t = runtimes.get(m)
+        if t is None:
+            t = by_class.get(m.split("::")[0], default)
+        return t
+
+    return _predict
+
+
+def _run_coverage_unit(unit):
+    result = _run_unit(unit)
+    if result[1] != Killmap.COVERED:
+        return result, None,
+
+    proj_name, bug_id, suite_path = unit[:3]
+    git_home = d4j_worker_checkout(proj_name, bug_id)
+    print(multiprocessing.current_process(), ":", datetime.now(),":", "coverage of", suite_path)
+    with tempfile.TemporaryFile() as fh, _test_dir(suite_path) as test_dir:
+        try:
+            paths = d4j_run_coverage(git_home, fh, timeout=unit[4], test_dir=test_dir)
+        except (subprocess.TimeoutExpired, subprocess.CalledProcessError) as e:
+            print(datetime.now(), "Coverage failed for {}: {}".format(suite_path, type(e).__name__))
+            return result, None,
+
+    # the next unit of this worker reuses the checkout, so hand over copies of the maps.
+    if not all(os.path.exists(p) for p in paths):
+        return result, None,
+
+    return result, [_scratch_copy(p) for p in paths],
+
+
+def _apply_unit(killmaps, result):
+    unit, status, results, mutants, elapsed = result
+    proj_name, bug_id, suite_path, m, _, _ = unit
+    km = killmaps[(proj_name, bug_id, suite_path,)]
+    km.record_runtime(m, elapsed)
+    if status == Killmap.COVERED:
+        digest, mutants_path = mutants
+        try:
+            if digest not in km._mutant_maps:
+                km._mutant_maps[digest] = km._check_mutants(mutants_path)
+        finally:
+            os.unlink(mutants_path)
+        km._append_row(m, results, km._mutant_maps[digest])
+    elif status == Killmap.TIMEOUT:
+        km.add_timeout(m)
+    elif status == Killmap.ERROR:
+        km.add_error(m)
+
+    return km
+
+
+def schedule(tasks, thread, timeout, prune = False, mode = "full"):
+    killmaps = {}
+    for suites, kms in tasks:
+        for km in kms:
+            suite = km.suite
+            km.set_mode(mode)
+            killmaps[(suite.proj_name, suite.bug_id, suite.suite_path,)] = km
+
+    last_write = defaultdict(float)
+    with tempfile.TemporaryDirectory() as scratch_dir, multiprocessing.Pool(thread, initializer=_init_scratch, initargs=(scratch_dir,)) as p:
+        if prune:
+            # one test per suite generates the mutants, then the whole suite is run once for coverage.
+            units = []
+            for key, km in killmaps.items():
+                unknowns = km.snapshot()[Killmap.UNKNOWN]
+                if len(unknowns) > 1 and not km.has_coverage():
+                    units.append((*key, unknowns[0], timeout, None,))
+
+            print(datetime.now(), ": coverage of", len(units), "killmaps")
+            for result, paths in p.imap_unordered(_run_coverage_unit, units, chunksize=1):
+                km = _apply_unit(killmaps, result)
+                if paths is not None:
+                    km.prune(*paths)
+                    for path in paths:
+                        os.unlink(path)
+                km.write()
+
+        units = []
+        for key, km in killmaps.items():
+            snapshot = km.snapshot()
+            predict = _cost_model(km)
+            for m in itertools.chain(snapshot[Killmap.ERROR], snapshot[Killmap.UNKNOWN], snapshot[Killmap.PARTIAL], snapshot[Killmap.TIMEOUT]):
+                units.append((predict(m), key, m,))
+
+        print(datetime.now(), ": schedule", len(units), "units over", len(killmaps), "killmaps")
+        if mode == "kill-pruned":
+            # Cheapest units first in waves, so that every wave skips the mutants the previous ones killed.
+            units.sort(key=lambda x: x[0])
+            waves = [units[idx:idx + thread] for idx in range(0, len(units), thread)]
+        else:
+            # Longest units first, and every idle worker takes the next unit from the shared queue.
+            units.sort(key=lambda x: x[0], reverse=True)
+            waves = [units]
+
+        for wave in waves:
+            wave = [(*key, m, timeout, killmaps[key].get_exclude(m),) for _, key, m in wave]
+            for result in p.imap_unordered(_run_unit, wave, chunksize=1):
+                km = _apply_unit(killmaps, result)
+                now = time.time()
+                if now - last_write[km] > WRITE_INTERVAL:
+                    km.write()
+                    last_write[km] = now
+
+        # leaving the block terminates the workers, so let them exit first and return their checkouts.
+        p.close()
+        p.join()
+
+    for km in killmaps.values():
+        km.write_packed()
+
+
 def _hastask(suites):
     killmaps = []
     cnt = 0
@@ -386,7 +1328,7 @@ def _hastask(suites):
         km = Killmap(suite)
 
         snapshot = km.snapshot()
-        cnt += len(snapshot[Killmap.UNKNOWN]) + len(snapshot[Killmap.ERROR]) +  + len(snapshot[Killmap.TIMEOUT])
+        cnt += len(snapshot[Killmap.UNKNOWN]) + len(snapshot[Killmap.PARTIAL]) + len(snapshot[Killmap.ERROR]) +  + len(snapshot[Killmap.TIMEOUT])
         killmaps.append(km)
 
     if cnt == 0:
@@ -408,12 +1350,30 @@ def _main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--thread", type=int, default=1)
     parser.add_argument("--timeout", type=int, default=18000)
+    parser.add_argument("--per-bug", action="store_true", help="schedule a whole bug per worker instead of single tests")
+    parser.add_argument("--batch", action="store_true", help="run mutation analysis for several tests per JVM (implies --per-bug and at least --mode kill)")
+    parser.add_argument("--prune", action="store_true", help="skip tests that reach no mutant according to a coverage run")
+    # kill-pruned rows miss the mutants earlier tests killed, and correlation.py refuses them, so it is not offered yet.
+    parser.add_argument("--mode", choices=Killmap.MODES[:2], default="full", help="kill: record killed cells only")
+    parser.add_argument("--pack", action="store_true", help="convert existing killmap.csv files into the packed format")
     args = parser.parse_args(sys.argv[1:])
+    if args.pack:
+        for suites in itertools.chain.from_iterable(ts.iterate_suites(name) for name in ["Math", "Closure", "Chart", "Lang", "Time"]):
+            for suite in suites:
+                if convert_killmap(suite):
+                    print("Packed", suite)
+        return
+
     tasks = itertools.chain.from_iterable(ts.iterate_suites(name) for name in ["Math", "Closure", "Chart", "Lang", "Time"])
     tasks = filter(None, map(_hastask, tasks))
+    if not (args.per_bug or args.batch):
+        schedule(tasks, args.thread, args.timeout, args.prune, args.mode)
+        return
 
     with multiprocessing.Pool(args.thread) as p:
-        p.map(_generate_map, ((args.timeout, *task) for task in tasks))
+        p.map(_generate_map, ((args.timeout, args.batch, args.prune, args.mode, *task) for task in tasks))
+        p.close()
+        p.join()
 
 
 if __name__ == "__main__":
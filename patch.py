@@ -3,6 +3,9 @@ import tempfile
 import json
 import os
 import subprocess
+import bisect
+import fcntl
+import multiprocessing.util
 from collections import defaultdict
 
 _ROOT = os.path.join("changes")
@@ -46,7 +49,8 @@ def iterate_changes(proj_name):
             continue
 
         total += 1
-        lines, methods = load_changes(proj_name, id)
+        entry, _ = _lookup(proj_name, id)
+        lines, methods = _from_entry(entry)
         if lines is None or methods is None:
             print(proj_name, id)
             print("XXX")
@@ -54,6 +58,7 @@ def iterate_changes(proj_name):
 
         result.append([int(id_raw), lines, methods])
 
+    _save_index()
     print("{}: Total {} instances".format(proj_name, total))
     result.sort(key=lambda x: x[0])
     for item in result:
@@ -61,9 +66,97 @@ def iterate_changes(proj_name):
         yield item
 
 
+_INDEX_PATH = os.path.join(_ROOT, "index.json")
+_index = None
+_dirty = set()
+
+
+def _load_index():
+    global _index
+    if _index is None:
+        _index = _read_index()
+
+    return _index
+
+
+def _read_index():
+    if not os.path.exists(_INDEX_PATH):
+        return {}
+
+    with open(_INDEX_PATH, "r") as fh:
+        return json.load(fh)
+
+
+def _save_index():
+    if len(_dirty) == 0:
+        return
+
+    # other processes may have written their entries since the index was read, so they are merged under the lock.
+    with open(_INDEX_PATH + ".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            index = _read_index()
+            for proj_name, bug_id in _dirty:
+                index.setdefault(proj_name, {})[bug_id] = _index[proj_name][bug_id]
+
+            fd, tmp_path = tempfile.mkstemp(dir=_ROOT, suffix=".tmp")
+            with os.fdopen(fd, "w") as fh:
+                json.dump(index, fh)
+            os.replace(tmp_path, _INDEX_PATH)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+    _dirty.clear()
+
+
+def _sources(root_dir):
+    result = []
+    for name in ["info.json", "defs.json"]:
+        p = os.path.join(root_dir, name)
+        result.append(os.stat(p).st_mtime_ns if os.path.exists(p) else None)
+
+    return result
+
+
+def _lookup(proj_name, bug_id):
+    root_dir = os.path.join(_ROOT, proj_name, bug_id)
+    sources = _sources(root_dir)
+    bugs = _load_index().setdefault(proj_name, {})
+    entry = bugs.get(bug_id)
+    if entry is not None and entry["sources"] == sources:
+        return entry, False
+
+    lines, methods = _compile_changes(proj_name, bug_id)
+    entry = {"sources": sources, "lines": None, "methods": None}
+    if lines is not None:
+        entry["lines"] = {k: sorted(v) for k, v in lines.items()}
+        entry["methods"] = sorted(methods)
+    bugs[bug_id] = entry
+    if len(_dirty) == 0:
+        # runs at exit of pool workers as well, unlike atexit.
+        multiprocessing.util.Finalize(None, _save_index, exitpriority=10)
+    _dirty.add((proj_name, bug_id,))
+    return entry, True
+
+
+def _from_entry(entry):
+    if entry["lines"] is None:
+        return None, None
+
+    # callers may modify the result, so every call gets its own copy.
+    lines = defaultdict(set)
+    for k, v in entry["lines"].items():
+        lines[k] = set(v)
+    return lines, set(entry["methods"])
+
+
 def load_changes(proj_name, bug_id):
-    global _ROOT
+    # new entries are written once at exit rather than on every miss.
+    entry, _ = _lookup(proj_name, bug_id)
+    return _from_entry(entry)
 
+
+def _compile_changes(proj_name, bug_id):
     root_dir = os.path.join(_ROOT, proj_name, bug_id)
     info_path = os.path.join(root_dir, "info.json")
     if not os.path.exists(info_path):
@@ -86,6 +179,7 @@ def load_changes(proj_name, bug_id):
         meta = defs[fid]
         exceptions = {int(k): v for k, v in info[fid].items()}
         positions = {int(k): v for k, v in meta["positions"].items()}
+        keys = sorted(k for k, v in positions.items() if k > 0 and v is not None)
         for line_no in meta["lines"]:
             replaced = exceptions.get(line_no)
             if replaced is not None:
@@ -106,13 +200,9 @@ def load_changes(proj_name, bug_id):
                         raise Exception(proj_name, bug_id, replaced)
                     # items = [items]
 
-            pos = line_no
-            desc = None
-            while pos > 0:
-                desc = positions.get(pos)
-                if desc is not None:
-                    break
-                pos -= 1
+            # the nearest position at or before the line starts the enclosing method.
+            idx = bisect.bisect_right(keys, line_no)
+            desc = positions[keys[idx - 1]] if idx > 0 else None
 
             if desc is None:
                 # print(line_no)
@@ -128,4 +218,11 @@ def load_changes(proj_name, bug_id):
         print("no lines", proj_name, bug_id)
         return None, None
 
-    return lines, methods
\ No newline at end of file
+    return lines, methods
+
+
+if __name__ == "__main__":
+    # compiles the index for every project at once.
+    for proj_name in sorted(_BANNED):
+        for _ in iterate_changes(proj_name):
+            pass
@@ -2,11 +2,29 @@ from d4jconstants import d4j_checkout
 import os
 from subprocess import check_output, CalledProcessError, PIPE, STDOUT
 import tarfile
+import io
 import shutil
 import tempfile
 from config import d4j_check_output
 import d4j
 import time
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
+import fcntl
+from contextlib import contextmanager
+
+_PIT_JARS = tuple(os.path.join("/home/mingwan/suitesize/pit", name) for name in ("pitest-1.5.1.jar","pitest-entry-1.5.1.jar","pitest-command-line-1.5.1.jar", "xmlpull-1.1.3.1.jar",))
+BUILD_CACHE_DIR = os.path.abspath("pit_builds")
+PIT_HISTORY = os.path.abspath("pit_history.json")
+# one PIT thread per SECONDS_PER_THREAD of estimated cpu time.
+SECONDS_PER_THREAD = 600
+COST_PER_TEST_CLASS = 2.0
+MAX_THREADS = 8
+MAIN_HEAP_MB = 1024
+MINION_HEAP_MB = 512
+_budget = None
+_GIT_ROOT = "${git_root}"
 
 # def get_classpath():
 #     cwd = os.getcwd()
@@ -62,8 +80,7 @@ def _write(out, lines):
         out.write("\n")
 
 
-def _change_scaffolding_class(out_dir, level_suffix, class_path):
-    lines = _read_all_lines(class_path, False)
+def _rename_scaffolding(lines, level_suffix):
     idx = 0
     new_name = None
     original_name = None
@@ -85,55 +102,74 @@ def _change_scaffolding_class(out_dir, level_suffix, class_path):
         lines[idx] = l.replace(original_name, new_name)
         idx += 1
 
-    with open(os.path.join(out_dir, new_name + ".java"), 'w') as fh:
-        for line in lines:
-            fh.write(line)
+    return new_name, lines,
 
-    os.unlink(class_path)
 
-
-def _separate_tests(out_dir, level_suffix, class_path):
+def _split_tests(lines, level_suffix):
     headers = []
     def_line = None
-    with open(class_path, 'r') as fh:
-        for line in fh:
-            line = line.strip()
-            if "{" in line:
-                def_line = line.split(" ")
-                def_line[2] += level_suffix
-                def_line[4] += level_suffix
-                annot = headers[-1]
-                headers[-1] = annot[:-1] + ", separateClassLoader = true)"
-                break
-
-            headers.append(line)
-
-        methods = None
-        def _create_new(methods):
-            if _is_valid_method(methods):
-                elems = def_line.copy()
-                method_name = methods[1].split(" ")[2][:-2]
-                new_class_name = "_".join([elems[2], method_name])
-                elems[2] = new_class_name
-                with open(os.path.join(out_dir, new_class_name + ".java"), "w") as out:
-                    _write(out, headers)
-                    _write(out, [" ".join(elems)])
-                    _write(out, methods)
-
-        for line in fh:
-            line = line.strip()
-            if "@Test" == line:
-                if methods is not None:
-                    methods.append("}") # end of class
-                    _create_new(methods)
-                methods = []
+    lines = iter(lines)
+    for line in lines:
+        line = line.strip()
+        if "{" in line:
+            def_line = line.split(" ")
+            def_line[2] += level_suffix
+            def_line[4] += level_suffix
+            annot = headers[-1]
+            headers[-1] = annot[:-1] + ", separateClassLoader = true)"
+            break
+
+        headers.append(line)
 
+    classes = []
+    methods = None
+    def _create_new(methods):
+        if _is_valid_method(methods):
+            elems = def_line.copy()
+            method_name = methods[1].split(" ")[2][:-2]
+            new_class_name = "_".join([elems[2], method_name])
+            elems[2] = new_class_name
+            classes.append((new_class_name, headers + [" ".join(elems)] + methods,))
+
+    for line in lines:
+        line = line.strip()
+        if "@Test" == line:
             if methods is not None:
-                methods.append(line)
+                methods.append("}") # end of class
+                _create_new(methods)
+            methods = []
 
-        _create_new(methods)
+        if methods is not None:
+            methods.append(line)
 
-    os.unlink(class_path)
+    _create_new(methods)
+    return classes
+
+
+def _transform_suite(tarbz, level_suffix):
+    # The members are rewritten while the archive is streamed, so only the final sources reach the disk.
+    sources = []
+    with tarfile.open(tarbz, "r|bz2") as tar:
+        for member in tar:
+            if not member.isfile():
+                continue
+
+            path = os.path.normpath(member.name)
+            root, file_name = os.path.split(path)
+            fh = tar.extractfile(member)
+            if "_evosuite_" in file_name or not file_name.endswith(".java"):
+                # This suite was already parsed.
+                sources.append((path, fh.read(),))
+            elif "scaffolding" in file_name:
+                new_name, lines = _rename_scaffolding(list(io.TextIOWrapper(io.BytesIO(fh.read()))), level_suffix)
+                sources.append((os.path.join(root, new_name + ".java"), "".join(lines),))
+            elif "ESTest" in file_name:
+                for new_name, lines in _split_tests(io.TextIOWrapper(io.BytesIO(fh.read())), level_suffix):
+                    sources.append((os.path.join(root, new_name + ".java"), "".join(line + "\n" for line in lines),))
+            else:
+                sources.append((path, fh.read(),))
+
+    return sources
 
 
 def _parse_cp(st):
@@ -202,6 +238,92 @@ def _compile_dev(git_root, proj_root, bug_id):
     return a, b, tests,
 
 
+def _iterate_gen_tarballs(artifact_root):
+    for name in filter(lambda x: x.endswith(".tar.bz2"), os.listdir(artifact_root)):
+        tarbz = os.path.join(artifact_root, name)
+        if "evosuite" in name:
+            candidate = tarbz + ".origin"
+            if os.path.exists(tarbz):
+                tarbz = candidate
+
+        yield tarbz, "_" + _parse_tarbz_level(name),
+
+
+def _get_build_key(name, bug_id, kind, git_root, paths):
+    h = hashlib.sha1()
+    h.update("{}-{}-{}".format(name, bug_id, kind).encode("utf8"))
+    # blob ids of the index stay the same across checkouts, unlike commit ids.
+    h.update(check_output(["git", "ls-files", "-s"], cwd=git_root))
+    for p in sorted(paths):
+        h.update(os.path.basename(p).encode("utf8"))
+        with open(p, "rb") as fh:
+            for chunk in iter(lambda: fh.read(1 << 20), b""):
+                h.update(chunk)
+
+    return h.hexdigest()
+
+
+def _load_build(cache_dir, git_root):
+    p = os.path.join(cache_dir, "meta.json")
+    if not os.path.exists(p):
+        return None
+
+    with open(p, "r") as fh:
+        meta = json.load(fh)
+
+    for rel in meta["dirs"]:
+        dst = os.path.join(git_root, rel)
+        if os.path.exists(dst):
+            shutil.rmtree(dst)
+        shutil.copytree(os.path.join(cache_dir, "build", rel), dst)
+
+    source_dir = meta["source"].replace(_GIT_ROOT, git_root)
+    cp_str = meta["classpath"].replace(_GIT_ROOT, git_root)
+    return source_dir, cp_str, set(meta["tests"]),
+
+
+def _save_build(cache_dir, git_root, ctx):
+    source_dir, cp_str, tests = ctx
+    dirs = set()
+    for elem in cp_str.split(":"):
+        if elem.startswith(git_root + os.sep) and os.path.isdir(elem):
+            dirs.add(os.path.relpath(elem, git_root))
+
+    tmp_dir = "{}.{}.tmp".format(cache_dir, os.getpid())
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    for rel in dirs:
+        shutil.copytree(os.path.join(git_root, rel), os.path.join(tmp_dir, "build", rel))
+
+    meta = {"source": source_dir.replace(git_root, _GIT_ROOT),
+            "classpath": cp_str.replace(git_root, _GIT_ROOT),
+            "tests": sorted(tests),
+            "dirs": sorted(dirs)}
+    os.makedirs(tmp_dir, exist_ok=True)
+    with open(os.path.join(tmp_dir, "meta.json"), "w") as fh:
+        json.dump(meta, fh)
+
+    try:
+        os.makedirs(os.path.dirname(cache_dir), exist_ok=True)
+        os.rename(tmp_dir, cache_dir)
+    except OSError:
+        # another run stored the same build first.
+        shutil.rmtree(tmp_dir)
+
+
+def _cached_compile(name, bug_id, kind, git_root, paths, compile_fn):
+    key = _get_build_key(name, bug_id, kind, git_root, paths)
+    cache_dir = os.path.join(BUILD_CACHE_DIR, name, bug_id, key)
+    ctx = _load_build(cache_dir, git_root)
+    if ctx is not None:
+        print(name, bug_id, kind, "cached build", key)
+        return ctx
+
+    ctx = compile_fn()
+    _save_build(cache_dir, git_root, ctx)
+    return ctx
+
+
 def _compile_gen(git_root, artifact_root):
     tests = set()
     if os.path.basename(git_root) == "Lang":
@@ -210,32 +332,16 @@ def _compile_gen(git_root, artifact_root):
             os.remove(p)
 
     with tempfile.TemporaryDirectory() as tmp_dir:
-        for name in filter(lambda x: x.endswith(".tar.bz2"), os.listdir(artifact_root)):
-            tarbz = os.path.join(artifact_root, name)
-            if "evosuite" in name:
-                candidate = tarbz + ".origin"
-                if os.path.exists(tarbz):
-                    tarbz = candidate
-
-            tar = tarfile.open(tarbz, "r:bz2")
-            try:
-                tar.extractall(tmp_dir)
-            finally:
-                tar.close()
-
-            level_suffix = "_" + _parse_tarbz_level(name)
-            for root, dirs, files in os.walk(tmp_dir):
-                for file_name in files:
-                    if "_evosuite_" in file_name:
-                        # This suite was already parsed.
-                        continue
-
-                    if file_name.endswith(".java"):
-                        if "scaffolding" in file_name:
-                            _change_scaffolding_class(root, level_suffix, os.path.join(root, file_name))
-                        elif "ESTest" in file_name:
-                            _separate_tests(root, level_suffix, os.path.join(root, file_name))
+        jobs = list(_iterate_gen_tarballs(artifact_root))
 
+        # bz2 releases the GIL while decompressing, so the suites are read in parallel.
+        with ThreadPoolExecutor(max(1, len(jobs))) as executor:
+            for sources in executor.map(lambda job: _transform_suite(*job), jobs):
+                for path, buf in sources:
+                    out = os.path.join(tmp_dir, path)
+                    os.makedirs(os.path.dirname(out), exist_ok=True)
+                    with open(out, "wb" if isinstance(buf, bytes) else "w") as fh:
+                        fh.write(buf)
 
         for root, dirs, files in os.walk(tmp_dir):
             for file in files:
@@ -256,10 +362,147 @@ def _compile_gen(git_root, artifact_root):
         return a, b, tests,
 
 
+def _machine():
+    cores = os.cpu_count() or 1
+    mem_mb = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // (1 << 20)
+    return cores, mem_mb
+
+
+def _init_budget(cond, cores, mem_mb):
+    global _budget
+    _budget = cond, cores, mem_mb
+
+
+@contextmanager
+def _reserve(threads, mem_mb):
+    # runs of the pool share the cores and memory of the machine.
+    if _budget is None:
+        yield
+        return
+
+    cond, cores, mem = _budget
+    with cond:
+        cond.wait_for(lambda: cores.value >= threads and mem.value >= mem_mb)
+        cores.value -= threads
+        mem.value -= mem_mb
+
+    try:
+        yield
+    finally:
+        with cond:
+            cores.value += threads
+            mem.value += mem_mb
+            cond.notify_all()
+
+
+def _load_history():
+    if not os.path.exists(PIT_HISTORY):
+        return {}
+
+    with open(PIT_HISTORY, "r") as fh:
+        return json.load(fh)
+
+
+def _record_history(key, entry):
+    with open(PIT_HISTORY + ".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            history = _load_history()
+            history[key] = entry
+            with open(PIT_HISTORY + ".tmp", "w") as fh:
+                json.dump(history, fh, indent=2)
+            os.replace(PIT_HISTORY + ".tmp", PIT_HISTORY)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _plan(key, classes, tests):
+    cores, mem_mb = _machine()
+    entry = _load_history().get(key)
+    if entry is None:
+        cost = len(classes) * len(tests) * COST_PER_TEST_CLASS
+        main_mb, minion_mb = MAIN_HEAP_MB, MINION_HEAP_MB
+    else:
+        cost = entry["elapsed"] * entry["threads"]
+        main_mb, minion_mb = entry["main_mb"], entry["minion_mb"]
+        if entry["oom"]:
+            main_mb *= 2
+            minion_mb *= 2
+
+    threads = int(max(1, min(MAX_THREADS, cores, cost // SECONDS_PER_THREAD)))
+    # the main JVM and every minion hold their own heap.
+    while threads > 1 and main_mb + threads * minion_mb > mem_mb:
+        threads -= 1
+    main_mb = min(main_mb, mem_mb // 2)
+    minion_mb = min(minion_mb, (mem_mb - main_mb) // threads)
+    return threads, main_mb, minion_mb,
+
+
+def _get_input_hash(kind, classes, paths):
+    h = hashlib.sha1()
+    h.update(kind.encode("utf8"))
+    for name in sorted(classes):
+        h.update(name.encode("utf8") + b"\n")
+    for p in sorted(paths):
+        h.update(os.path.basename(p).encode("utf8"))
+        # a missing input fails the run later, where the error is logged.
+        if not os.path.exists(p):
+            h.update(b"\0missing")
+            continue
+        with open(p, "rb") as fh:
+            for chunk in iter(lambda: fh.read(1 << 20), b""):
+                h.update(chunk)
+    # the version of PIT is part of the jar names.
+    for p in sorted(_PIT_JARS):
+        h.update(os.path.basename(p).encode("utf8"))
+
+    return h.hexdigest()
+
+
+def _read_inputs(dest):
+    p = dest + ".inputs"
+    if not os.path.exists(p):
+        return None
+
+    with open(p, "r") as fh:
+        return fh.read().strip()
+
+
+def _write_inputs(dest, digest):
+    with open(dest + ".inputs", "w") as fh:
+        fh.write(digest + "\n")
+
+
+def _get_history(bug_out_root, kind, dest, inputs):
+    # PIT replays the killed mutants of a history with their old killing tests, which leaves kills of
+    # new tests out of the full matrix. So a history is only kept for the inputs it was written with.
+    p = os.path.abspath(os.path.join(bug_out_root, "pit_history_{}.bin".format(kind)))
+    if _read_inputs(dest) != inputs and os.path.exists(p):
+        os.unlink(p)
+
+    return p
+
+
+def _run_planned(key, git_root, classes, ctx, dest, ignore_failing, history = None):
+    threads, main_mb, minion_mb = _plan(key, classes, ctx[2])
+    oom = False
+    start = time.time()
+    try:
+        with _reserve(threads, main_mb + threads * minion_mb):
+            start = time.time()
+            _run_pit(git_root, classes, ctx, dest, ignore_failing, threads, main_mb, minion_mb, history)
+    except Exception as e:
+        oom = "OutOfMemoryError" in str(e)
+        raise e
+    finally:
+        _record_history(key, {"elapsed": time.time() - start, "threads": threads,
+                              "main_mb": main_mb, "minion_mb": minion_mb, "oom": oom})
+
+
 import gzip
-def _run_pit(git_root, classes, ctx, dest, ignore_failing):
+def _run_pit(git_root, classes, ctx, dest, ignore_failing, threads = 3, main_mb = None, minion_mb = None, history = None):
     source_dir, cp_str, tests = ctx
-    pitpath = {os.path.join("/home/mingwan/suitesize/pit", name) for name in ("pitest-1.5.1.jar","pitest-entry-1.5.1.jar","pitest-command-line-1.5.1.jar", "xmlpull-1.1.3.1.jar",)}
+    pitpath = set(_PIT_JARS)
     cp = {"/home/mingwan/suitesize/defects4j/framework/projects/lib/junit-4.13.jar"}
     if source_dir == "${source.home}":
         source_dir = "src"
@@ -271,19 +514,29 @@ def _run_pit(git_root, classes, ctx, dest, ignore_failing):
 
         cp.add(elem)
 
-    cmd = ["java",
-           "-cp", ":".join(pitpath),
+    cmd = ["java"]
+    if main_mb is not None:
+        cmd.append("-Xmx{}m".format(main_mb))
+    cmd += ["-cp", ":".join(pitpath),
            "org.pitest.mutationtest.commandline.MutationCoverageReport",
            "--classPath", ",".join(cp),
            "--sourceDirs", source_dir,
            "--targetTests", ",".join(tests),
            "--targetClasses", ",".join(classes),
            "--reportDir", "matrix",
-           "--threads", "3",
+           "--threads", str(threads),
            "--fullMutationMatrix", "true",
            "--outputFormats", "XML"
            ]
 
+    if history is not None:
+        # mutants of unchanged classes are not analyzed again (see _get_history).
+        cmd += ["--historyInputLocation", history, "--historyOutputLocation", history]
+
+    if minion_mb is not None:
+        cmd.append("--jvmArgs")
+        cmd.append("-Xmx{}m".format(minion_mb))
+
     if ignore_failing:
         cmd.append("--skipFailingTests")
         cmd.append("true")
@@ -311,7 +564,10 @@ def _run_pit(git_root, classes, ctx, dest, ignore_failing):
 def _main():
     import multiprocessing
     r = []
-    with multiprocessing.Pool(4) as pool:
+    cores, mem_mb = _machine()
+    budget = multiprocessing.Condition(), multiprocessing.Value("i", cores, lock=False), multiprocessing.Value("i", mem_mb, lock=False),
+    # more workers than runs that fit at once, the budget decides which of them proceed.
+    with multiprocessing.Pool(cores, initializer=_init_budget, initargs=budget) as pool:
         for name in d4j.NAMES:
             for x in d4j.iterate_instance(name):
                 bug_id = x[0]
@@ -343,21 +599,27 @@ def _run(name, bug_id):
     err_dev = os.path.join(bug_out_root, "pit_error_dev.log")
     err_gen = os.path.join(bug_out_root, "pit_error_gen.log")
 
-    dev_exist = os.path.exists(dest_dev)
-    gen_exist = os.path.exists(dest_gen)
-    # if dev_exist and gen_exist:
-    #     if os.path.exists(err_dev):
-    #         os.unlink(err_dev)
-    #     if os.path.exists(err_gen):
-    #         os.unlink(err_gen)
-    #     return
+    dev_inputs = _get_input_hash("dev", classes, [os.path.join(proj_root, "relevant_tests", bug_id)])
+    gen_inputs = _get_input_hash("gen", classes, [tarbz for tarbz, _ in _iterate_gen_tarballs(bug_out_root)])
+    # dev matrices from before the input hashes are kept as they are.
+    dev_exist = os.path.exists(dest_dev) and _read_inputs(dest_dev) in (None, dev_inputs)
+    gen_exist = os.path.exists(dest_gen) and _read_inputs(dest_gen) == gen_inputs
+    if dev_exist and gen_exist:
+        if os.path.exists(err_dev):
+            os.unlink(err_dev)
+        if os.path.exists(err_gen):
+            os.unlink(err_gen)
+        return
 
     with d4j_checkout(name, bug_id + 'f') as git_root:
         if not dev_exist:
             try:
                 start = time.time()
-                ctx = _compile_dev(git_root, proj_root, bug_id)
-                _run_pit(git_root, classes, ctx, dest_dev, False)
+                # ant runs in one JVM, the pool has more workers than the budget allows.
+                with _reserve(1, MAIN_HEAP_MB):
+                    ctx = _cached_compile(name, bug_id, "dev", git_root, [os.path.join(proj_root, "relevant_tests", bug_id)], lambda: _compile_dev(git_root, proj_root, bug_id))
+                _run_planned("{}-{}-dev".format(name, bug_id), git_root, classes, ctx, dest_dev, False, _get_history(bug_out_root, "dev", dest_dev, dev_inputs))
+                _write_inputs(dest_dev, dev_inputs)
                 if os.path.exists(err_dev):
                     os.unlink(err_dev)
                 print(name, bug_id, "dev", time.time() - start)
@@ -366,18 +628,21 @@ def _run(name, bug_id):
                 with open(err_dev, "w") as fh:
                     fh.write(str(e))
 
-        # if not gen_exist:
-        try:
-            start = time.time()
-            ctx = _compile_gen(git_root, bug_out_root)
-            _run_pit(git_root, classes, ctx, dest_gen, True)
-            if os.path.exists(err_gen):
-                os.unlink(err_gen)
-            print(name, bug_id, "gen", time.time() - start)
-        except Exception as e:
-            print("Error(gen):", name, bug_id)
-            with open(err_gen, "w") as fh:
-                fh.write(str(e))
+        if not gen_exist:
+            try:
+                start = time.time()
+                tarballs = [tarbz for tarbz, _ in _iterate_gen_tarballs(bug_out_root)]
+                with _reserve(1, MAIN_HEAP_MB):
+                    ctx = _cached_compile(name, bug_id, "gen", git_root, tarballs, lambda: _compile_gen(git_root, bug_out_root))
+                _run_planned("{}-{}-gen".format(name, bug_id), git_root, classes, ctx, dest_gen, True, _get_history(bug_out_root, "gen", dest_gen, gen_inputs))
+                _write_inputs(dest_gen, gen_inputs)
+                if os.path.exists(err_gen):
+                    os.unlink(err_gen)
+                print(name, bug_id, "gen", time.time() - start)
+            except Exception as e:
+                print("Error(gen):", name, bug_id)
+                with open(err_gen, "w") as fh:
+                    fh.write(str(e))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,284 @@
+import numpy as np
+
+SAMPLE_COUNT = 10000
+# the ratios of the stored curves, in the order the runners write them.
+RATIOS = ["max20", "max50"] + [r / 1000 for r in range(25, 525, 25)]
+_BLOCK_BYTES = 1 << 25
+
+
+def pack(killmap):
+    return np.packbits(killmap, axis=1)
+
+
+class SparseKillmap:
+    # CSR rows of killed mutants per test.
+    def __init__(self, indptr, indices, shape):
+        self.indptr = indptr
+        self.indices = indices
+        self.shape = shape
+
+
+    @staticmethod
+    def from_pairs(tests, mutants, shape):
+        keys = np.unique(np.asarray(tests, dtype=np.int64) * shape[1] + np.asarray(mutants, dtype=np.int64))
+        rows, cols = np.divmod(keys, shape[1])
+        indptr = np.zeros(shape[0] + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=shape[0]), out=indptr[1:])
+        return SparseKillmap(indptr, cols.astype(np.int32), shape)
+
+
+    @property
+    def nnz(self):
+        return len(self.indices)
+
+
+    def pays_off(self):
+        # gathering a row costs about 16 bytes per kill, OR-ing a packed row mutant_count / 8 bytes.
+        return 16 * self.nnz < self.shape[0] * self.shape[1] / 8
+
+
+    def padded(self):
+        return SparseKillmap(np.append(self.indptr, self.indptr[-1]), self.indices, (self.shape[0] + 1, self.shape[1],))
+
+
+    def pack(self):
+        packed = np.zeros((self.shape[0], (self.shape[1] + 7) // 8), dtype=np.uint8)
+        rows = np.repeat(np.arange(self.shape[0]), np.diff(self.indptr))
+        cols = self.indices.astype(np.int64)
+        np.bitwise_or.at(packed, (rows, cols >> 3), (128 >> (cols & 7)).astype(np.uint8))
+        return packed
+
+
+    def killed(self):
+        killed = np.zeros(self.shape, dtype=bool)
+        killed[np.repeat(np.arange(self.shape[0]), np.diff(self.indptr)), self.indices] = True
+        return killed
+
+
+    def column_counts(self):
+        return np.bincount(self.indices, minlength=self.shape[1])
+
+
+    def cover(self, testsets):
+        # the kills of every sampled row are gathered at once and scattered into one row per sample.
+        lengths = np.diff(self.indptr)[testsets].ravel()
+        total = int(lengths.sum())
+        starts = self.indptr[testsets].ravel() - (np.cumsum(lengths) - lengths)
+        positions = np.repeat(starts, lengths) + np.arange(total)
+        samples = np.repeat(np.arange(len(testsets)), lengths.reshape(testsets.shape).sum(axis=1))
+        covered = np.zeros((len(testsets), self.shape[1]), dtype=bool)
+        covered[samples, self.indices[positions]] = True
+        return covered
+
+
+def _padded(packed):
+    # the extra all-zero row stands for the unused slots of a smaller sample.
+    return np.concatenate([packed, np.zeros((1, packed.shape[1]), dtype=np.uint8)])
+
+
+def _weights(masks, mutant_count):
+    weights = np.zeros((mutant_count, len(masks)), dtype=np.float32)
+    for idx, mask in enumerate(masks):
+        # mutants may appear more than once in a mask, as they did with covers[mask].
+        weights[:, idx] = np.bincount(np.asarray(mask, dtype=int), minlength=mutant_count)
+
+    return weights
+
+
+def _max_size(test_size, ratio):
+    if ratio == "max20":
+        return int(test_size * 0.2)
+    elif ratio == "max50":
+        return int(test_size * 0.5)
+    elif ratio is None:
+        return test_size
+
+    return int(ratio * test_size)
+
+
+def _draw(test_size, pad, ratio, count):
+    if ratio is None or isinstance(ratio, str):
+        max_size = _max_size(test_size, ratio)
+        sizes = np.random.randint(1, max_size + 1, size=count)
+        testsets = np.random.randint(0, test_size, size=(count, max_size))
+        testsets[np.arange(max_size) >= sizes[:, None]] = pad
+        return sizes / test_size, testsets
+
+    size = _max_size(test_size, ratio)
+    return np.full(count, size), np.random.randint(0, test_size, size=(count, size))
+
+
+def _cover(padded, testsets, mutant_count):
+    covered = np.zeros((len(testsets), padded.shape[1]), dtype=np.uint8)
+    for column in testsets.T:
+        covered |= padded[column]
+
+    return np.unpackbits(covered, axis=1, count=mutant_count)
+
+
+def _score(cover, triggers, weights, lengths, testsets):
+    counts = np.dot(cover(testsets).astype(np.float32), weights)
+    with np.errstate(all="ignore"):
+        scores = counts.astype(float) / lengths
+
+    scores[:, lengths == 0] = np.nan
+    return scores, triggers[testsets].any(axis=1)
+
+
+def _column_counts(killmap, mutant_count, rows):
+    if isinstance(killmap, SparseKillmap):
+        return np.bincount(killmap.indices[:killmap.indptr[rows]], minlength=mutant_count)
+
+    counts = np.zeros(mutant_count, dtype=np.int64)
+    step = max(1, _BLOCK_BYTES // max(mutant_count, 1))
+    for start in range(0, rows, step):
+        counts += np.unpackbits(killmap[start:min(rows, start + step)], axis=1, count=mutant_count).sum(axis=0, dtype=np.int64)
+
+    return counts
+
+
+def _miss(q, ratio, test_size):
+    # chance that none of the drawn tests hits, averaged over the uniform sizes of the max ratios.
+    if ratio is None or isinstance(ratio, str):
+        max_size = _max_size(test_size, ratio)
+        with np.errstate(all="ignore"):
+            mean = q * (1 - q ** max_size) / ((1 - q) * max_size)
+        return np.where(q == 1, 1.0, mean)
+
+    with np.errstate(all="ignore"):
+        return q ** _max_size(test_size, ratio)
+
+
+def make_exact(proj_name, bug_id, killmap, mutant_count, trigger_tests, masks, test_size = None):
+    # draws are uniform with replacement, so a mutant killed by c of n tests survives k draws with (1 - c / n) ** k.
+    pad = killmap.shape[0]
+    if test_size is None:
+        test_size = pad
+
+    rows = min(pad, test_size)
+    kill_rate = _column_counts(killmap, mutant_count, rows) / test_size
+    triggers = np.zeros(pad + 1, dtype=bool)
+    triggers[trigger_tests] = True
+    trigger_rate = np.array([triggers[:rows].sum() / test_size])
+    weights = _weights(masks, mutant_count).astype(float)
+    lengths = np.array([len(mask) for mask in masks], dtype=float)
+
+    def _exact(ratio):
+        counts = np.dot(1 - _miss(1 - kill_rate, ratio, test_size), weights)
+        with np.errstate(all="ignore"):
+            scores = counts / lengths
+
+        p_bug = 1 - _miss(1 - trigger_rate, ratio, test_size)[0]
+        return [proj_name, bug_id, ratio, *(None if l == 0 else v for v, l in zip(scores.tolist(), lengths.tolist())), float(p_bug)]
+
+    return _exact
+
+
+def make_generator(proj_name, bug_id, killmap, mutant_count, trigger_tests, masks, test_size = None, count = SAMPLE_COUNT, padded = False):
+    # a padded killmap already ends with the empty row of the unused sample slots.
+    if isinstance(killmap, SparseKillmap) and not killmap.pays_off():
+        killmap = killmap.pack()
+
+    pad = killmap.shape[0] - 1 if padded else killmap.shape[0]
+    if test_size is None:
+        test_size = pad
+
+    if isinstance(killmap, SparseKillmap):
+        padded = killmap if padded else killmap.padded()
+        cover = padded.cover
+        gather_bytes = 16 * killmap.nnz // max(pad, 1)
+    else:
+        padded = killmap if padded else _padded(killmap)
+        cover = lambda testsets: _cover(padded, testsets, mutant_count)
+        gather_bytes = 0
+
+    triggers = np.zeros(pad + 1, dtype=bool)
+    triggers[trigger_tests] = True
+    weights = _weights(masks, mutant_count)
+    lengths = np.array([len(mask) for mask in masks], dtype=float)
+
+    def _generator(ratio):
+        # bound both the sampled indices and the unpacked cover rows of one block.
+        row_bytes = max((8 + gather_bytes) * _max_size(test_size, ratio), 5 * mutant_count, 1)
+        block = max(1, _BLOCK_BYTES // row_bytes)
+        remained = count
+        while remained > 0:
+            size = min(block, remained)
+            remained -= size
+            ratios, testsets = _draw(test_size, pad, ratio, size)
+            scores, is_bug = _score(cover, triggers, weights, lengths, testsets)
+            for r, levels, bug in zip(ratios.tolist(), scores.tolist(), is_bug.tolist()):
+                # an empty mask has no score, as the per-sample loop reported.
+                yield [proj_name, bug_id, r, *(None if v != v else v for v in levels), bug]
+
+    return _generator
+
+
+class SharedKillmap:
+    # copies a padded killmap once into shared memory, workers attach to it through spec.
+    def __init__(self, proj_name, bug_id, killmap, mutant_count, trigger_tests, masks, test_size = None):
+        from multiprocessing import shared_memory
+        if isinstance(killmap, SparseKillmap) and not killmap.pays_off():
+            killmap = killmap.pack()
+
+        if isinstance(killmap, SparseKillmap):
+            padded = killmap.padded()
+            arrays = {"indptr": padded.indptr, "indices": padded.indices}
+        else:
+            arrays = {"packed": killmap}
+
+        self._blocks = []
+        shared = {}
+        for key, values in arrays.items():
+            shape = values.shape if key != "packed" else (values.shape[0] + 1, values.shape[1],)
+            size = int(np.prod(shape)) * values.dtype.itemsize
+            block = shared_memory.SharedMemory(create=True, size=max(size, 1))
+            self._blocks.append(block)
+            target = np.ndarray(shape, dtype=values.dtype, buffer=block.buf)
+            target[:len(values)] = values
+            target[len(values):] = 0
+            del target
+            shared[key] = (block.name, shape, values.dtype.str,)
+
+        self.spec = {
+            "arrays": shared,
+            "shape": (killmap.shape[0] + 1, mutant_count,),
+            "args": (proj_name, bug_id, mutant_count, list(trigger_tests), masks, test_size,),
+        }
+
+
+    def close(self):
+        for block in self._blocks:
+            block.close()
+            block.unlink()
+        self._blocks = []
+
+
+def _sample_shared(spec, buffers, ratio):
+    arrays = {key: np.ndarray(shape, dtype=dtype, buffer=buffers[key]) for key, (_, shape, dtype) in spec["arrays"].items()}
+    if "packed" in arrays:
+        killmap = arrays["packed"]
+    else:
+        killmap = SparseKillmap(arrays["indptr"], arrays["indices"], spec["shape"])
+
+    proj_name, bug_id, mutant_count, trigger_tests, masks, test_size = spec["args"]
+    generator = make_generator(proj_name, bug_id, killmap, mutant_count, trigger_tests, masks, test_size=test_size, padded=True)
+    return list(generator(ratio))
+
+
+def start_sharing():
+    # workers forked before the resource tracker runs start their own, which unlink the blocks when they exit.
+    from multiprocessing import resource_tracker
+    resource_tracker.ensure_running()
+
+
+def sample_shared(spec, ratio):
+    from multiprocessing import shared_memory
+    blocks = {key: shared_memory.SharedMemory(name=name) for key, (name, _, _) in spec["arrays"].items()}
+    try:
+        # forked workers share one random state, so every ratio job draws from its own seed.
+        np.random.seed()
+        return _sample_shared(spec, {key: block.buf for key, block in blocks.items()}, ratio)
+    finally:
+        for block in blocks.values():
+            block.close()
@@ -0,0 +1,151 @@
+import os
+import sys
+import csv
+import numpy as np
+
+COLUMNS = ["name", "bug_id", "ratio", "cls_level", "method_level", "stmt_level", "is_bug"]
+
+
+def _parse_ratio(key):
+    try:
+        return float(key) / 1000.0
+    except ValueError:
+        return key
+
+
+def _parse_level(value):
+    if value is None or value == "":
+        return np.nan
+    return float(value)
+
+
+def get_partition_path(root, proj_name, bug_id, ratio_key):
+    return os.path.join(root, proj_name, bug_id, "{}.npz".format(ratio_key))
+
+
+def has_partition(root, proj_name, bug_id, ratio_key):
+    path = get_partition_path(root, proj_name, bug_id, ratio_key)
+    return os.path.exists(path) or os.path.exists(path[:-len(".npz")] + ".csv")
+
+
+def write_partition(path, proj_name, bug_id, rows):
+    ratios = []
+    levels = []
+    is_bug = []
+    for row in rows:
+        ratios.append(row[2])
+        levels.append([_parse_level(v) for v in row[3:6]])
+        is_bug.append(row[6])
+
+    levels = np.array(levels, dtype=np.float64).reshape(-1, 3)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp.npz"
+    try:
+        np.savez(tmp_path,
+                name=np.array(proj_name), bug_id=np.array(bug_id),
+                ratio=np.array(ratios, dtype=np.float64),
+                cls_level=levels[:, 0], method_level=levels[:, 1], stmt_level=levels[:, 2],
+                is_bug=np.array(is_bug, dtype=bool))
+        os.replace(tmp_path, path)
+    finally:
+        # a failed write leaves no partial partition behind.
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+
+
+def get_exact_path(root, proj_name, bug_id):
+    return os.path.join(root, proj_name, "{}.csv".format(bug_id))
+
+
+def write_exact(path, rows):
+    # one row per ratio: name, bug_id, ratio, expected levels and the bug detection probability.
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    try:
+        with open(tmp_path, "w", newline="") as fh:
+            writer = csv.writer(fh)
+            for row in rows:
+                writer.writerow(["" if v is None else v for v in row])
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+
+
+def _read_csv(path):
+    rows = []
+    with open(path, "r") as fh:
+        lines = [line.strip() for line in fh]
+    for row in csv.reader(filter(None, lines)):
+        rows.append(row)
+
+    return {
+        "name": np.array([row[0] for row in rows], dtype=object),
+        "bug_id": np.array([row[1] for row in rows], dtype=object),
+        "ratio": np.array([float(row[2]) for row in rows], dtype=np.float64),
+        "cls_level": np.array([_parse_level(row[3]) for row in rows], dtype=np.float64),
+        "method_level": np.array([_parse_level(row[4]) for row in rows], dtype=np.float64),
+        "stmt_level": np.array([_parse_level(row[5]) for row in rows], dtype=np.float64),
+        "is_bug": np.array([row[6] == "True" for row in rows], dtype=bool),
+    }
+
+
+def read_partition(path):
+    if path.endswith(".csv"):
+        return _read_csv(path)
+
+    with np.load(path) as data:
+        size = len(data["ratio"])
+        columns = {name: data[name] for name in COLUMNS[2:]}
+        columns["name"] = np.full(size, str(data["name"]), dtype=object)
+        columns["bug_id"] = np.full(size, str(data["bug_id"]), dtype=object)
+
+    return columns
+
+
+def find_partitions(root, proj_name, bug_id = None, ratio = None):
+    target_dir = os.path.join(root, proj_name)
+    if bug_id is not None:
+        target_dir = os.path.join(target_dir, bug_id)
+
+    for cur_root, dirs, files in os.walk(target_dir):
+        if os.path.split(cur_root)[1].startswith("."):
+            continue
+
+        partitions = {}
+        for filename in sorted(files):
+            key, ext = os.path.splitext(filename)
+            if ext not in (".npz", ".csv") or "." in key:
+                continue
+            # a converted partition shadows the csv it was made from.
+            if ext == ".csv" and key in partitions:
+                continue
+            if ratio is not None and ratio != _parse_ratio(key):
+                continue
+            partitions[key] = os.path.join(cur_root, filename)
+
+        for key in sorted(partitions):
+            yield partitions[key]
+
+
+def convert(root):
+    for cur_root, dirs, files in os.walk(root):
+        for filename in files:
+            if not filename.endswith(".csv"):
+                continue
+
+            path = os.path.join(cur_root, filename)
+            columns = _read_csv(path)
+            if len(columns["ratio"]) == 0:
+                continue
+
+            rows = zip(columns["name"], columns["bug_id"], columns["ratio"],
+                    columns["cls_level"], columns["method_level"], columns["stmt_level"], columns["is_bug"])
+            write_partition(path[:-len(".csv")] + ".npz", columns["name"][0], columns["bug_id"][0], rows)
+            os.unlink(path)
+            print(path)
+
+
+if __name__ == "__main__":
+    for root in sys.argv[1:]:
+        convert(root)
@@ -0,0 +1,145 @@
+import gzip
+import io
+import os
+import random
+import xml.sax as sax
+
+import numpy as np
+
+import corr_pit
+
+
+class _SaxParser(sax.handler.ContentHandler):
+    # the handler the streaming parser replaced, without the change filters.
+    def __init__(self, test_size):
+        self.killmap = {}
+        self.mutants = {}
+        self._test_size = test_size
+        self._content = ""
+
+
+    def endDocument(self):
+        for i in range(self._test_size - len(self.killmap)):
+            self.killmap[str(i)] = []
+
+
+    def endElement(self, name):
+        content = self._content
+        self._content = ""
+        if name == "mutatedClass":
+            self._class_name = content
+        elif name == "mutatedMethod":
+            self._method_name = content.replace("$", ".")
+        elif name == "methodDescription":
+            self._method_desc = corr_pit._parse_desc(content.replace("$", "."))
+        elif name == "lineNumber":
+            self._line = int(content)
+        elif name == "mutator":
+            self._mutator = content
+        elif name == "index":
+            self._index = int(content)
+        elif name == "block":
+            self._block = int(content)
+        elif name == "killingTests":
+            idx = len(self.mutants)
+            for name in content.split("|"):
+                if len(name) > 0:
+                    self.killmap.setdefault(name, []).append(idx)
+        elif name == "mutation":
+            mutant_key = (self._class_name, self._method_name, self._line, self._mutator, self._method_desc, self._block, self._index,)
+            if mutant_key not in self.mutants:
+                self.mutants[mutant_key] = len(self.mutants)
+
+
+    def characters(self, content):
+        self._content += content
+
+
+def _xml(seed, count=60):
+    rng = random.Random(seed)
+    tests = ["a.BTest.t{}(a.BTest)".format(i) for i in range(8)]
+    buf = ["<?xml version=\"1.0\" encoding=\"UTF-8\"?>\n<mutations>\n"]
+    for _ in range(count):
+        kills = "|".join(rng.sample(tests, rng.randint(0, 3)))
+        buf.append("<mutation detected='{}' status='KILLED' numberOfTestsRun='1'>"
+                "<sourceFile>B.java</sourceFile><mutatedClass>a.B{}</mutatedClass><mutatedMethod>m{}$x</mutatedMethod>"
+                "<methodDescription>(I[Ljava/lang/String;)V</methodDescription><lineNumber>{}</lineNumber>"
+                "<mutator>org.pitest.M{}</mutator><indexes><index>{}</index></indexes><blocks><block>{}</block></blocks>"
+                "<killingTests>{}</killingTests><succeedingTests></succeedingTests><description>d &amp; e</description></mutation>\n".format(
+                "true" if kills else "false", rng.randint(0, 1), rng.randint(0, 2), rng.randint(1, 9), rng.randint(0, 1),
+                rng.randint(0, 1), rng.randint(0, 2), kills))
+    buf.append("</mutations>\n")
+    return "".join(buf).encode("utf8")
+
+
+def test_parser_matches_sax_parser():
+    docs = [_xml(0), _xml(1)]
+    expected = _SaxParser(12)
+    for doc in docs:
+        sax.parse(io.BytesIO(doc), expected)
+
+    parser = corr_pit.PitParser(12)
+    for doc in docs:
+        parser.parse(io.BytesIO(doc))
+        parser.freeze()
+
+    assert list(parser.mutants.items()) == list(expected.mutants.items())
+    assert parser.tests == list(expected.killmap)
+    killed = parser.sparse(len(parser.mutants) + 1).killed()
+    for idx, name in enumerate(parser.tests):
+        assert np.flatnonzero(killed[idx]).tolist() == sorted(set(expected.killmap[name]))
+
+
+def _write_suite(suite_dir):
+    suite_dir.mkdir()
+    paths = []
+    for seed, name in enumerate(["matrix_dev.xml.gz", "matrix_gen.xml.gz"]):
+        p = str(suite_dir / name)
+        with gzip.open(p, "wb") as fh:
+            fh.write(_xml(seed))
+        paths.append(p)
+
+    return paths
+
+
+def test_matrix_cache_is_reused(tmp_path):
+    suite_dir = tmp_path / "Lang-1f"
+    paths = _write_suite(suite_dir)
+    built = corr_pit._load_xml(str(suite_dir), 12)
+    cache_dir = str(suite_dir / corr_pit.CACHE_DIR)
+
+    cached = corr_pit.PitMatrix.load(cache_dir, paths, 12)
+    assert cached is not None
+    assert cached.tests == built.tests
+    assert cached.mutants == built.mutants
+    np.testing.assert_array_equal(cached.killed(), built.killed())
+    assert corr_pit.PitMatrix.load(cache_dir, paths, 13) is None
+
+
+def test_matrix_cache_is_invalidated(tmp_path):
+    suite_dir = tmp_path / "Lang-1f"
+    paths = _write_suite(suite_dir)
+    corr_pit._load_xml(str(suite_dir), 12)
+    cache_dir = str(suite_dir / corr_pit.CACHE_DIR)
+
+    # the same size with another mtime.
+    st = os.stat(paths[0])
+    os.utime(paths[0], ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+    assert corr_pit.PitMatrix.load(cache_dir, paths, 12) is None
+    corr_pit._load_xml(str(suite_dir), 12)
+    assert corr_pit.PitMatrix.load(cache_dir, paths, 12) is not None
+
+    # another size with the same mtime.
+    st = os.stat(paths[1])
+    with gzip.open(paths[1], "wb") as fh:
+        fh.write(_xml(5, count=80))
+    os.utime(paths[1], ns=(st.st_atime_ns, st.st_mtime_ns))
+    assert corr_pit.PitMatrix.load(cache_dir, paths, 12) is None
+    matrix = corr_pit._load_xml(str(suite_dir), 12)
+
+    # the changed file was parsed again.
+    parser = corr_pit.PitParser(12)
+    for p in paths:
+        with gzip.open(p, "rb") as fh:
+            parser.parse(fh)
+    assert sorted(matrix.mutants) == sorted(parser.mutants)
@@ -0,0 +1,104 @@
+import os
+import random
+from collections import defaultdict
+
+import numpy as np
+
+import d4j
+from d4j import MutantIndex
+
+
+def _write_mutants(path, count, seed=0):
+    rng = random.Random(seed)
+    methods = ["a.B@m(int)", "a.B@n()", "a.B$C@k(java.lang.String)", "a.D@<init>()"]
+    with open(path, "w") as fh:
+        for mid in range(1, count + 1):
+            fh.write("{}:AOR:+:-:{}:{}:a + b |==> a - b\n".format(mid, rng.choice(methods), rng.randint(1, 20)))
+    # Major writes the time literal of a mutated string as is.
+    with open(path, "a") as fh:
+        fh.write("{}:LVR:\"24:00\":\"\":a.B@m(int):7:\"24:00\" |==> \"\"\n".format(count + 1))
+
+
+def _baseline(mutant_file):
+    # the dict of sets the index replaced.
+    l2m = defaultdict(set)
+    l2l = defaultdict(lambda: defaultdict(set))
+    with open(mutant_file, "r") as fh:
+        for line in fh:
+            line = line.strip()
+            if line.count(":") != 6:
+                if "24:00" in line:
+                    line = line.replace("24:00", "24\\00")
+
+            arguments = line.split(":")
+            mid = int(arguments[0]) - 1
+            l2m[arguments[4]].add(mid)
+            l2l[arguments[4].split("@")[0]][int(arguments[5])].add(mid)
+
+    return l2m, l2l
+
+
+def test_lookups_match_baseline(tmp_path):
+    path = str(tmp_path / "mutants.log")
+    _write_mutants(path, 200)
+    l2m, l2l = _baseline(path)
+    index = MutantIndex.load(path)
+
+    assert index.count == 201
+    for method, ids in l2m.items():
+        assert index.method(method).tolist() == sorted(ids)
+    assert index.method("a.B@missing()") is None
+
+    for cls, lines in l2l.items():
+        line_nos = [1, 7, 13, 20, 99]
+        expected = sorted(mid for line_no in line_nos for mid in lines.get(line_no, ()))
+        assert sorted(index.lines(cls, line_nos).tolist()) == expected
+    assert index.lines("a.Missing", [1]) is None
+    assert len(index.lines("a.B", [99])) == 0
+
+
+def test_index_is_rebuilt_when_mutants_grow(tmp_path):
+    path = str(tmp_path / "mutants.log")
+    _write_mutants(path, 20)
+    assert MutantIndex.load(path).count == 21
+    assert os.path.exists(path + ".index.npz")
+
+    with open(path, "a") as fh:
+        fh.write("22:AOR:+:-:a.E@x():3:a + b |==> a - b\n")
+    index = MutantIndex.load(path)
+    assert index.count == 22
+    assert index.method("a.E@x()").tolist() == [21]
+
+
+def test_index_is_read_from_disk(tmp_path):
+    path = str(tmp_path / "mutants.log")
+    _write_mutants(path, 50, seed=1)
+    built = MutantIndex.load(path)
+    MutantIndex.clear_cache()
+    loaded = MutantIndex.load(path)
+
+    assert loaded is not built
+    np.testing.assert_array_equal(loaded.method_ids, built.method_ids)
+    np.testing.assert_array_equal(loaded.line_ids, built.line_ids)
+
+
+def test_cache_evicts_least_recently_used(tmp_path, monkeypatch):
+    MutantIndex.clear_cache()
+    paths = []
+    for i in range(3):
+        path = str(tmp_path / "mutants{}.log".format(i))
+        _write_mutants(path, 20, seed=i)
+        paths.append(path)
+
+    sizes = [MutantIndex.build(path).nbytes() for path in paths]
+    # room for any two of the indexes, not all three.
+    monkeypatch.setattr(d4j, "INDEX_CACHE_BYTES", sum(sizes) - 1)
+    first = MutantIndex.load(paths[0])
+    MutantIndex.load(paths[1])
+    assert MutantIndex.load(paths[0]) is first
+    MutantIndex.load(paths[2])
+
+    assert list(MutantIndex._cache) == [paths[0], paths[2]]
+    assert MutantIndex._cache_bytes == sum(entry[2] for entry in MutantIndex._cache.values())
+    assert MutantIndex.load(paths[1]) is not None
+    MutantIndex.clear_cache()
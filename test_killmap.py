@@ -0,0 +1,383 @@
+import csv
+import json
+import os
+
+import numpy as np
+import pytest
+
+from killmap import Killmap, PackedKillmap, _batch_ran
+
+
+def _rows():
+    return [
+        ["t1", "FAIL", None, "LIVE", "EXC", None, None, None, None, "TIME"],
+        ["t2", None, None, None, None, None, None, None, None, None],
+        ["t3", "LIVE", "FAIL", "", "TIME", "FAIL", "EXC", "LIVE", "FAIL", "FAIL"],
+    ]
+
+
+def test_round_trip(tmp_path):
+    prefix = str(tmp_path / "suite")
+    PackedKillmap.from_rows(_rows(), 9).save(prefix)
+    assert PackedKillmap.is_available(prefix)
+
+    km = PackedKillmap.load(prefix, 9)
+    assert km.names == ["t1", "t2", "t3"]
+    expected = [[name, *(None if v == "" else v for v in cells)] for name, *cells in _rows()]
+    assert list(km.iterate_rows()) == expected
+    np.testing.assert_array_equal(km.killed(), [[v in PackedKillmap.KILLED for v in row[1:]] for row in _rows()])
+
+
+def test_load_rejects_other_mutant_count(tmp_path):
+    prefix = str(tmp_path / "suite")
+    PackedKillmap.from_rows(_rows(), 9).save(prefix)
+
+    assert PackedKillmap.load(prefix, 17) is None
+
+
+def test_stale_when_csv_is_newer(tmp_path):
+    prefix = str(tmp_path / "suite")
+    PackedKillmap.from_rows(_rows(), 9).save(prefix)
+    csv_path = prefix + ".killmap.csv"
+    with open(csv_path, "w") as fh:
+        fh.write("")
+    mtime = os.path.getmtime(prefix + ".killmap.npy")
+    os.utime(csv_path, (mtime + 10, mtime + 10))
+
+    assert not PackedKillmap.is_available(prefix)
+    assert PackedKillmap.load(prefix, 9) is None
+
+
+def _write(path, text):
+    with open(path, "w") as fh:
+        fh.write(text)
+    return str(path)
+
+
+def test_batch_without_mutants_is_not_applied(tmp_path):
+    header = "MutantsGenerated,MutantsCovered,MutantsKilled,MutantsLive,RuntimePreprocSeconds,RuntimeAnalysisSeconds\n"
+    killmap_path = _write(tmp_path / "killMap.csv", "TestNo,MutantNo\n")
+
+    assert not _batch_ran(killmap_path, str(tmp_path / "summary.csv"))
+    assert not _batch_ran(killmap_path, _write(tmp_path / "summary.csv", header + "0,0,0,0,1,1\n"))
+    assert _batch_ran(killmap_path, _write(tmp_path / "summary.csv", header + "10,4,0,10,1,1\n"))
+    # kills in the summary, but not in the kill map.
+    assert not _batch_ran(killmap_path, _write(tmp_path / "summary.csv", header + "10,4,2,8,1,1\n"))
+    assert _batch_ran(_write(tmp_path / "killMap.csv", "TestNo,MutantNo\n1,3\n"), str(tmp_path / "summary.csv"))
+
+
+class _Suite:
+    def __init__(self, root):
+        self.proj_name = "Lang"
+        self.bug_id = "1"
+        self.suite_path = None
+        self.suite_name = "Lang-1-dev"
+        self.suite_root = str(root)
+
+
+    def get_filepath(self, ext):
+        return os.path.join(self.suite_root, self.suite_name + "." + ext)
+
+
+_MUTANTS = ["1:AOR:+:-:a.B@m():5:a + b |==> a - b", "2:ROR:<:<=:a.B@m():6:a < b |==> a <= b", "3:LVR:0:1:a.C@n():9:0 |==> 1"]
+_TESTS = ["a.B::t1", "a.B::t2", "a.C::t3"]
+
+
+def _suite(tmp_path, mutants = _MUTANTS, tests = _TESTS):
+    suite = _Suite(tmp_path)
+    _write(tmp_path / "mutants", "".join(line + "\n" for line in mutants))
+    with open(suite.get_filepath("json"), "w") as fh:
+        json.dump({Killmap.UNKNOWN: list(tests)}, fh)
+    return suite
+
+
+def _csv_rows(suite):
+    with open(Killmap._get_killmap_path(suite), "r") as fh:
+        return list(csv.reader(fh))
+
+
+def _read(path):
+    with open(path, "rb") as fh:
+        return fh.read()
+
+
+def test_replay_after_crash(tmp_path):
+    suite = _suite(tmp_path)
+    km = Killmap(suite)
+    km._append_row("a.B::t1", [(1, "FAIL"), (2, "LIVE")])
+    km.add_timeout("a.C::t3")
+    km.write()
+    # the process dies here, the records are in the journal only.
+    files = {p: _read(p) for p in (Killmap._get_killmap_path(suite), suite.get_filepath("json"))}
+
+    km = Killmap(suite)
+    assert km.get_status("a.B::t1") == Killmap.COVERED
+    assert km.get_status("a.C::t3") == Killmap.TIMEOUT
+    assert km._killmap["a.B::t1"] == ["a.B::t1", "FAIL", "LIVE", None]
+    # replaying does not touch the files.
+    assert {p: _read(p) for p in files} == files
+    assert km._pending == 3
+
+
+def test_replay_ignores_torn_tails(tmp_path):
+    suite = _suite(tmp_path)
+    with Killmap(suite) as km:
+        km._append_row("a.B::t1", [(1, "FAIL")])
+
+    km = Killmap(suite)
+    km._append_row("a.B::t2", [(3, "EXC")])
+    km.write()
+    with open(Killmap._get_killmap_path(suite), "a") as fh:
+        fh.write("a.C::t3,FA")
+    with open(Killmap._get_journal_path(suite), "a") as fh:
+        fh.write('{"m": "a.C::t3", "r": [')
+
+    km = Killmap(suite)
+    assert set(km._killmap) == {"a.B::t1", "a.B::t2"}
+    assert km.get_status("a.C::t3") == Killmap.UNKNOWN
+    km.checkpoint()
+    assert [row[0] for row in _csv_rows(suite)] == ["a.B::t1", "a.B::t2"]
+
+
+def test_checkpoint(tmp_path):
+    suite = _suite(tmp_path)
+    km = Killmap(suite)
+    km._append_row("a.B::t1", [(1, "FAIL"), (3, "TIME")])
+    km.add_error("a.B::t2")
+    km.checkpoint()
+
+    assert _csv_rows(suite) == [["a.B::t1", "FAIL", "", "TIME"]]
+    with open(suite.get_filepath("json"), "r") as fh:
+        assert json.load(fh) == {Killmap.COVERED: ["a.B::t1"], Killmap.ERROR: ["a.B::t2"], Killmap.UNKNOWN: ["a.C::t3"]}
+    checkpoint, generation, records = Killmap._read_journal(Killmap._get_journal_path(suite))
+    assert checkpoint == os.path.getsize(Killmap._get_killmap_path(suite))
+    assert records == []
+    assert km._pending == 0
+
+
+def test_close_checkpoints_pending_records(tmp_path):
+    suite = _suite(tmp_path)
+    km = Killmap(suite)
+    km._append_row("a.B::t1", [(2, "EXC")])
+    km.write()
+    assert _csv_rows(suite) == []
+
+    km = Killmap(suite)
+    km.close()
+    assert _csv_rows(suite) == [["a.B::t1", "", "EXC", ""]]
+    assert Killmap._read_journal(Killmap._get_journal_path(suite))[2] == []
+
+    km = Killmap(suite)
+    assert km._pending == 0
+    assert km.get_status("a.B::t1") == Killmap.COVERED
+
+
+def _partial(suite):
+    # t1 is covered, then a fourth mutant turns its row partial.
+    with Killmap(suite) as km:
+        km._append_row("a.B::t1", [(1, "FAIL"), (2, "LIVE"), (3, "LIVE")])
+        km._append_row("a.B::t2", [(3, "FAIL")])
+
+    km = Killmap(suite)
+    log = _write(os.path.join(suite.suite_root, "mutants.log"), "".join(line + "\n" for line in _MUTANTS + ["4:COR:&&:||:a.C@n():10:a && b |==> a || b"]))
+    km._check_mutants(log)
+    return km
+
+
+def test_compaction_survives_crash_before_rename(tmp_path, monkeypatch):
+    suite = _suite(tmp_path)
+    km = _partial(suite)
+    km._append_row("a.B::t1", [(4, "EXC")])
+    with monkeypatch.context() as m:
+        # the checkpoint is committed in the journal, but the compacted csv is not moved into place.
+        m.setattr(Killmap, "_finish_compaction", lambda self, generation: None)
+        km.checkpoint()
+    assert [row[0] for row in _csv_rows(suite)] == ["a.B::t1", "a.B::t2"]
+
+    km = Killmap(suite)
+    assert km._killmap["a.B::t1"] == ["a.B::t1", "FAIL", "LIVE", "LIVE", "EXC"]
+    km.close()
+    assert _csv_rows(suite) == [["a.B::t2", "", "", "FAIL"], ["a.B::t1", "FAIL", "LIVE", "LIVE", "EXC"]]
+
+
+def test_partial_row_is_replaced(tmp_path):
+    suite = _suite(tmp_path)
+    km = _partial(suite)
+    assert km.get_status("a.B::t1") == Killmap.PARTIAL
+    assert km.get_status("a.C::t3") == Killmap.UNKNOWN
+    assert km.available() is None
+
+    km._append_row("a.B::t1", [(4, "EXC")])
+    assert km.get_status("a.B::t1") == Killmap.COVERED
+    km.close()
+    # the stale copy of the row is compacted away.
+    assert _csv_rows(suite) == [["a.B::t2", "", "", "FAIL"], ["a.B::t1", "FAIL", "LIVE", "LIVE", "EXC"]]
+
+
+def test_partial_replace_survives_crash_before_journal_update(tmp_path, monkeypatch):
+    import killmap
+    suite = _suite(tmp_path)
+    km = _partial(suite)
+    km._append_row("a.B::t1", [(4, "EXC")])
+    km.write()
+    before = _read(Killmap._get_killmap_path(suite))
+
+    atomic_write = killmap._atomic_write
+    def _crash(p, dump):
+        if p == Killmap._get_journal_path(suite):
+            raise KeyboardInterrupt()
+        atomic_write(p, dump)
+
+    with monkeypatch.context() as m:
+        m.setattr(killmap, "_atomic_write", _crash)
+        try:
+            km.checkpoint()
+        except KeyboardInterrupt:
+            pass
+    # the compacted csv waits for its checkpoint, the csv in place is untouched.
+    assert _read(Killmap._get_killmap_path(suite)) == before
+
+    km = Killmap(suite)
+    assert km._killmap["a.B::t1"] == ["a.B::t1", "FAIL", "LIVE", "LIVE", "EXC"]
+    assert km._killmap["a.B::t2"] == ["a.B::t2", "", "", "FAIL"]
+    km.close()
+    assert _csv_rows(suite) == [["a.B::t2", "", "", "FAIL"], ["a.B::t1", "FAIL", "LIVE", "LIVE", "EXC"]]
+
+
+def test_mutants_are_remapped_by_signature(tmp_path):
+    suite = _suite(tmp_path)
+    km = Killmap(suite)
+    # another checkout numbers the same mutants differently, and adds one.
+    lines = [_MUTANTS[2], "2:COR:&&:||:a.C@n():10:a && b |==> a || b", _MUTANTS[0], _MUTANTS[1]]
+    lines = ["{}:{}".format(idx + 1, line.split(":", 1)[1]) for idx, line in enumerate(lines)]
+    remap = km._check_mutants(_write(tmp_path / "mutants.log", "".join(line + "\n" for line in lines)))
+
+    assert remap == [2, 3, 0, 1]
+    assert km.mutants[3] == "4:COR:&&:||:a.C@n():10:a && b |==> a || b"
+    km._append_row("a.B::t1", [(1, "FAIL"), (2, "EXC"), (3, "LIVE")], remap)
+    assert km._killmap["a.B::t1"] == ["a.B::t1", "LIVE", None, "FAIL", "EXC"]
+    km.close()
+
+    with open(os.path.join(suite.suite_root, "mutants"), "r") as fh:
+        assert [line.strip() for line in fh] == _MUTANTS + ["4:COR:&&:||:a.C@n():10:a && b |==> a || b"]
+    # the same file maps onto itself from now on.
+    assert Killmap(suite)._check_mutants(str(tmp_path / "mutants.log")) == [2, 3, 0, 1]
+
+
+def test_get_exclude(tmp_path):
+    suite = _suite(tmp_path)
+    km = _partial(suite)
+    mutants_path = Killmap._get_mutants_path(suite)
+
+    assert km.get_exclude("a.B::t1") == (mutants_path, [0, 1, 2],)
+    assert km.get_exclude("a.C::t3") is None
+
+    km._append_row("a.C::t3", [(4, "FAIL")])
+    km.set_mode("kill-pruned")
+    # mutants killed by any test are skipped as well.
+    assert km.get_exclude("a.C::t3") == (mutants_path, [0, 2, 3],)
+    assert km.get_exclude("a.B::t1") == (mutants_path, [0, 1, 2, 3],)
+
+
+def _maps(tmp_path, covered):
+    testmap = _write(tmp_path / "testMap.csv", "TestNo,TestName\n1,t1(a.B)\n2,t2(a.B)\n3,t3(a.C)\n")
+    covmap = _write(tmp_path / "covMap.csv", "TestNo,MutantNo\n" + "".join("{},1\n".format(no) for no in covered))
+    return covmap, testmap
+
+
+def test_prune(tmp_path):
+    suite = _suite(tmp_path)
+    km = Killmap(suite)
+    assert not km.has_coverage()
+
+    assert km.prune(*_maps(tmp_path, [1, 3])) == 1
+    assert km.get_status("a.B::t2") == Killmap.PRUNED
+    assert km._killmap["a.B::t2"] == ["a.B::t2", None, None, None]
+    assert km.get_status("a.B::t1") == Killmap.UNKNOWN
+    assert km.has_coverage()
+    km.close()
+
+    km = Killmap(suite)
+    assert km.get_status("a.B::t2") == Killmap.PRUNED
+    # a new mutant makes the coverage stale.
+    km._check_mutants(_write(tmp_path / "mutants.log", "".join(line + "\n" for line in _MUTANTS + ["4:COR:&&:||:a.C@n():10:a && b |==> a || b"])))
+    assert not km.has_coverage()
+    assert km.get_status("a.B::t2") == Killmap.PARTIAL
+
+
+def test_prune_skips_empty_coverage(tmp_path):
+    km = Killmap(_suite(tmp_path))
+
+    assert km.prune(*_maps(tmp_path, [])) == 0
+    assert all(t == Killmap.UNKNOWN for _, t in km.items())
+    assert not km.has_coverage()
+
+
+def test_prune_skips_coverage_of_other_tests(tmp_path):
+    km = Killmap(_suite(tmp_path, tests=_TESTS + ["a.C::t4"]))
+
+    assert km.prune(*_maps(tmp_path, [1])) == 0
+    assert all(t == Killmap.UNKNOWN for _, t in km.items())
+    assert not km.has_coverage()
+
+
+def test_prune_without_maps(tmp_path):
+    km = Killmap(_suite(tmp_path))
+
+    assert km.prune(str(tmp_path / "covMap.csv"), str(tmp_path / "testMap.csv")) == 0
+
+
+def test_cost_model(tmp_path):
+    from killmap import DEFAULT_COST, _cost_model
+    km = Killmap(_suite(tmp_path))
+    assert _cost_model(km)("a.B::t1") == DEFAULT_COST
+
+    km.record_runtime("a.B::t1", 4.0)
+    km.record_runtime("a.B::t2", 2.0)
+    km.record_runtime("a.C::t3", 9.0)
+    predict = _cost_model(km)
+    assert predict("a.B::t1") == 4.0
+    # unseen tests cost as much as the tests of their class, or of the suite.
+    assert predict("a.B::t9") == 3.0
+    assert predict("a.D::t1") == 5.0
+
+
+_schedule_log = None
+
+
+def _fake_run_unit(unit):
+    import hashlib
+    import killmap
+    proj_name, bug_id, suite_path, m, timeout, exclude = unit
+    with open(_schedule_log, "a") as fh:
+        fh.write("{},{}\n".format(m, killmap._scratch_dir))
+    mutants_log = os.path.join(os.path.dirname(_schedule_log), "mutants.log")
+    with open(mutants_log, "rb") as fh:
+        digest = hashlib.sha1(fh.read()).hexdigest()
+    return unit, Killmap.COVERED, [(int(m[-1]), "FAIL",)], (digest, killmap._scratch_copy(mutants_log),), 1.0,
+
+
+@pytest.mark.parametrize("mode, order", [("full", ["a.B::t1", "a.C::t3", "a.B::t2"]), ("kill-pruned", ["a.B::t2", "a.C::t3", "a.B::t1"])])
+def test_schedule(tmp_path, monkeypatch, mode, order):
+    import killmap
+    global _schedule_log
+    _schedule_log = str(tmp_path / "schedule.log")
+    _write(tmp_path / "mutants.log", "".join(line + "\n" for line in _MUTANTS))
+    suite = _suite(tmp_path)
+    km = Killmap(suite)
+    km.record_runtime("a.B::t1", 5.0)
+    km.record_runtime("a.B::t2", 1.0)
+    km.write()
+    monkeypatch.setattr(killmap, "_run_unit", _fake_run_unit)
+
+    killmap.schedule([([suite], [km],)], 1, 10, mode=mode)
+
+    with open(_schedule_log, "r") as fh:
+        runs = [line.strip().split(",") for line in fh]
+    # one worker takes the units in the order they were scheduled.
+    assert [m for m, _ in runs] == order
+    assert all(t == Killmap.COVERED for _, t in km.items())
+    assert km._killmap["a.C::t3"] == ["a.C::t3", None, None, "FAIL"]
+    # the scratch files of the workers are gone with the directory of the schedule.
+    assert not os.path.exists(runs[0][1])
+    assert PackedKillmap.is_available(Killmap._get_packed_prefix(suite))
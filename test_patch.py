@@ -0,0 +1,116 @@
+import json
+import os
+import random
+
+import pytest
+
+import patch
+
+
+@pytest.fixture
+def changes(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(patch, "_index", None)
+    monkeypatch.setattr(patch, "_dirty", set())
+    return tmp_path / patch._ROOT
+
+
+def _write_bug(root, proj_name, bug_id, info, defs):
+    bug_dir = root / proj_name / bug_id
+    bug_dir.mkdir(parents=True)
+    (bug_dir / "info.json").write_text(json.dumps(info))
+    (bug_dir / "defs.json").write_text(json.dumps(defs))
+
+
+def _walk(positions, line_no):
+    # the backward walk the bisect replaced.
+    pos = line_no
+    desc = None
+    while pos > 0:
+        desc = positions.get(pos)
+        if desc is not None:
+            break
+        pos -= 1
+
+    return desc
+
+
+def _random_bug(rng):
+    positions = {}
+    for line_no in rng.sample(range(0, 200), 15):
+        positions[str(line_no)] = [["a.B<T>", "m{}(int...)".format(line_no)]]
+    # a null position does not start a method.
+    positions[str(rng.randint(1, 199))] = None
+    lines = rng.sample(range(1, 220), 30)
+    info = {"0": {str(lines[0]): ["replaced", rng.randint(1, 220)], str(lines[1]): ["no_method"]}}
+    return info, {"0": {"lines": lines, "positions": positions}}
+
+
+def test_bisect_matches_backward_walk(changes):
+    rng = random.Random(0)
+    for bug in range(50):
+        info, defs = _random_bug(rng)
+        bug_id = "{}f".format(bug)
+        _write_bug(changes, "Lang", bug_id, info, defs)
+
+        positions = {int(k): v for k, v in defs["0"]["positions"].items()}
+        exceptions = {int(k): v for k, v in info["0"].items()}
+        expected_lines = {}
+        expected_methods = set()
+        missing = False
+        for line_no in defs["0"]["lines"]:
+            replaced = exceptions.get(line_no)
+            if replaced is not None and replaced[0] == "no_method":
+                expected_lines.setdefault("no_method", set()).add(line_no)
+                expected_methods.add("no_method")
+                continue
+            elif replaced is not None:
+                line_no = replaced[1]
+
+            desc = _walk(positions, line_no)
+            if desc is None:
+                missing = True
+                break
+            for cls, method in desc:
+                cls = cls.replace("<T>", "")
+                expected_methods.add(cls + "@" + method.replace("...", "[]"))
+                expected_lines.setdefault(cls, set()).add(line_no)
+
+        lines, methods = patch._compile_changes("Lang", bug_id)
+        if missing:
+            assert lines is None and methods is None
+        else:
+            assert dict(lines) == expected_lines
+            assert methods == expected_methods
+
+
+def test_index_is_saved_and_reused(changes):
+    defs = {"0": {"lines": [5], "positions": {"3": [["a.B", "m()"]]}}}
+    _write_bug(changes, "Lang", "1f", {"0": {}}, defs)
+    _write_bug(changes, "Lang", "3f", {"0": {}}, defs)
+
+    items = list(patch.iterate_changes("Lang"))
+    assert [item[0] for item in items] == ["1", "3"]
+    with open(patch._INDEX_PATH, "r") as fh:
+        assert sorted(json.load(fh)["Lang"]) == ["1f", "3f"]
+
+    lines, methods = patch.load_changes("Lang", "1f")
+    assert len(patch._dirty) == 0
+    # callers get their own copy.
+    lines["a.B"].add(99)
+    assert patch.load_changes("Lang", "1f")[0]["a.B"] == {5}
+
+
+def test_save_merges_entries_of_other_writers(changes):
+    defs = {"0": {"lines": [5], "positions": {"3": [["a.B", "m()"]]}}}
+    _write_bug(changes, "Lang", "1f", {"0": {}}, defs)
+    _write_bug(changes, "Lang", "2f", {"0": {}}, defs)
+
+    patch.load_changes("Lang", "1f")
+    with open(patch._INDEX_PATH, "w") as fh:
+        json.dump({"Lang": {"2f": {"sources": None, "lines": None, "methods": None}}}, fh)
+    patch._save_index()
+
+    with open(patch._INDEX_PATH, "r") as fh:
+        assert sorted(json.load(fh)["Lang"]) == ["1f", "2f"]
+    assert len(patch._dirty) == 0
@@ -0,0 +1,211 @@
+import io
+import os
+import tarfile
+
+import pit
+
+
+_TEST = """/*
+ * This file was automatically generated by EvoSuite
+ */
+
+package org.apache.commons.lang3;
+
+import org.junit.Test;
+import static org.junit.Assert.*;
+import org.evosuite.runtime.EvoRunner;
+import org.evosuite.runtime.EvoRunnerParameters;
+import org.junit.runner.RunWith;
+
+@RunWith(EvoRunner.class) @EvoRunnerParameters(mockJVMNonDeterminism = true, useVFS = true)
+public class CharRange_ESTest extends CharRange_ESTest_scaffolding {
+
+  @Test
+  public void test0() throws Throwable {
+      CharRange charRange0 = CharRange.isNot('a');
+      assertTrue(charRange0.isNegated());
+  }
+
+  @Test
+  public void test1() throws Throwable {
+      CharRange charRange0 = CharRange.is('a');
+      try { charRange0.contains(null); } catch (Exception e) {}
+  }
+
+  @Test
+  public void test2() throws Throwable {
+      CharRange charRange0 = CharRange.isIn('a', 'e');
+      assertEquals('e', charRange0.getEnd());
+  }
+}
+"""
+
+_SCAFFOLDING = """package org.apache.commons.lang3;
+
+@EvoSuiteClassExclude
+public class CharRange_ESTest_scaffolding {
+  private static final String CLASS = "CharRange_ESTest_scaffolding";
+
+  @BeforeClass
+  public static void initEvoSuiteFramework() {
+    org.evosuite.runtime.classhandling.ClassResetter.getInstance().setClassLoader(CharRange_ESTest_scaffolding.class.getClassLoader());
+  }
+}
+"""
+
+_PARSED = "package org.apache.commons.lang3;\npublic class CharRange_ESTest_evosuite_1 {}\n"
+
+
+def _tarball(path):
+    members = {
+        "org/apache/commons/lang3/CharRange_ESTest.java": _TEST,
+        "org/apache/commons/lang3/CharRange_ESTest_scaffolding.java": _SCAFFOLDING,
+        "org/apache/commons/lang3/CharRange_ESTest_evosuite_1.java": _PARSED,
+        "org/apache/commons/lang3/README.txt": "not a source\n",
+    }
+    with tarfile.open(path, "w:bz2") as tar:
+        for name, text in members.items():
+            buf = text.encode("utf8")
+            info = tarfile.TarInfo("./" + name)
+            info.size = len(buf)
+            tar.addfile(info, io.BytesIO(buf))
+
+
+def _change_scaffolding_class(out_dir, level_suffix, class_path):
+    # the transform on extracted files that streaming replaced.
+    with open(class_path, "r") as fh:
+        lines = [line for line in fh]
+    idx = 0
+    new_name = None
+    original_name = None
+    while idx < len(lines):
+        l = lines[idx]
+        if "{" in l:
+            class_name_elems = l.split(" ")
+            original_name = class_name_elems[2]
+            new_name = original_name + level_suffix
+            class_name_elems[2] = new_name
+            lines[idx] = " ".join(class_name_elems)
+            idx += 1
+            break
+
+        idx += 1
+
+    while idx < len(lines):
+        lines[idx] = lines[idx].replace(original_name, new_name)
+        idx += 1
+
+    with open(os.path.join(out_dir, new_name + ".java"), "w") as fh:
+        for line in lines:
+            fh.write(line)
+
+    os.unlink(class_path)
+
+
+def _separate_tests(out_dir, level_suffix, class_path):
+    headers = []
+    def_line = None
+    with open(class_path, "r") as fh:
+        for line in fh:
+            line = line.strip()
+            if "{" in line:
+                def_line = line.split(" ")
+                def_line[2] += level_suffix
+                def_line[4] += level_suffix
+                annot = headers[-1]
+                headers[-1] = annot[:-1] + ", separateClassLoader = true)"
+                break
+
+            headers.append(line)
+
+        methods = None
+        def _create_new(methods):
+            if pit._is_valid_method(methods):
+                elems = def_line.copy()
+                method_name = methods[1].split(" ")[2][:-2]
+                new_class_name = "_".join([elems[2], method_name])
+                elems[2] = new_class_name
+                with open(os.path.join(out_dir, new_class_name + ".java"), "w") as out:
+                    for line in headers + [" ".join(elems)] + methods:
+                        out.write(line + "\n")
+
+        for line in fh:
+            line = line.strip()
+            if "@Test" == line:
+                if methods is not None:
+                    methods.append("}")
+                    _create_new(methods)
+                methods = []
+
+            if methods is not None:
+                methods.append(line)
+
+        _create_new(methods)
+
+    os.unlink(class_path)
+
+
+def _baseline(tarbz, out_dir, level_suffix):
+    with tarfile.open(tarbz, "r:bz2") as tar:
+        tar.extractall(out_dir)
+
+    for root, dirs, files in os.walk(out_dir):
+        for file_name in files:
+            if "_evosuite_" in file_name:
+                continue
+
+            if file_name.endswith(".java"):
+                if "scaffolding" in file_name:
+                    _change_scaffolding_class(root, level_suffix, os.path.join(root, file_name))
+                elif "ESTest" in file_name:
+                    _separate_tests(root, level_suffix, os.path.join(root, file_name))
+
+    result = {}
+    for root, dirs, files in os.walk(out_dir):
+        for file_name in files:
+            with open(os.path.join(root, file_name), "r") as fh:
+                result[os.path.relpath(os.path.join(root, file_name), out_dir)] = fh.read()
+
+    return result
+
+
+def test_transform_suite_matches_extracted_transform(tmp_path):
+    tarbz = str(tmp_path / "Lang-1f-evosuite-branch.1.tar.bz2")
+    _tarball(tarbz)
+    level_suffix = "_" + pit._parse_tarbz_level(os.path.basename(tarbz))
+    expected = _baseline(tarbz, str(tmp_path / "extracted"), level_suffix)
+
+    actual = {}
+    for path, buf in pit._transform_suite(tarbz, level_suffix):
+        actual[path] = buf.decode("utf8") if isinstance(buf, bytes) else buf
+
+    assert actual == expected
+    # test1 swallows an exception in an empty block, so it has no class of its own.
+    names = sorted(os.path.basename(path) for path in actual)
+    assert names == ["CharRange_ESTest_evosuite_1.java", "CharRange_ESTest_evosuite_branch_test0.java",
+            "CharRange_ESTest_evosuite_branch_test2.java", "CharRange_ESTest_scaffolding_evosuite_branch.java", "README.txt"]
+
+
+def test_split_tests_without_tests():
+    lines = ["package p;", "", "@RunWith(EvoRunner.class)", "public class A_ESTest extends A_ESTest_scaffolding {", "}"]
+
+    assert pit._split_tests(lines, "_branch") == []
+
+
+def test_history_is_dropped_when_inputs_change(tmp_path):
+    dest = str(tmp_path / "matrix_dev.xml.gz")
+    history = str(tmp_path / "pit_history_dev.bin")
+    with open(history, "wb") as fh:
+        fh.write(b"history")
+
+    # a history without the inputs it was written with is not trusted.
+    assert pit._get_history(str(tmp_path), "dev", dest, "a") == history
+    assert not os.path.exists(history)
+
+    pit._write_inputs(dest, "a")
+    with open(history, "wb") as fh:
+        fh.write(b"history")
+    pit._get_history(str(tmp_path), "dev", dest, "a")
+    assert os.path.exists(history)
+    pit._get_history(str(tmp_path), "dev", dest, "b")
+    assert not os.path.exists(history)
@@ -0,0 +1,138 @@
+import numpy as np
+import pytest
+
+import sampling
+
+
+def _killmap(tests, mutants, seed=0):
+    rng = np.random.RandomState(seed)
+    return rng.rand(tests, mutants) < 0.2
+
+
+def _baseline(killmap, trigger_tests, masks, test_size, ratio, count):
+    # the per-sample loop the batch engine replaced.
+    def _level(mask, covered):
+        covers = covered[mask]
+        return np.sum(covers) / len(covers)
+
+    max_size = sampling._max_size(test_size, ratio)
+    for _ in range(count):
+        size = max_size
+        testset = np.random.choice(test_size, size=size)
+        is_bug = len(np.intersect1d(testset, trigger_tests)) > 0
+        covered = np.any(killmap[testset, :], axis=0)
+        yield [size, *(_level(mask, covered) for mask in masks), is_bug]
+
+
+def _masks(mutant_count):
+    return [np.arange(mutant_count), np.array([0, 2, 2, 5]), np.array([mutant_count - 1])]
+
+
+@pytest.mark.parametrize("ratio", [0.1, 0.25, 0.5])
+def test_make_generator_matches_baseline(ratio):
+    killmap = _killmap(40, 30)
+    masks = _masks(30)
+    trigger_tests = [3, 17]
+
+    np.random.seed(7)
+    expected = list(_baseline(killmap, trigger_tests, masks, 40, ratio, 200))
+    np.random.seed(7)
+    generator = sampling.make_generator("Lang", "1", sampling.pack(killmap), 30, trigger_tests, masks, count=200)
+    actual = [row[2:] for row in generator(ratio)]
+
+    assert len(actual) == len(expected)
+    for a, e in zip(actual, expected):
+        assert a[0] == e[0]
+        assert a[-1] == e[-1]
+        np.testing.assert_allclose(a[1:-1], e[1:-1])
+
+
+@pytest.mark.parametrize("ratio", ["max20", "max50", None])
+def test_make_generator_max_ratios(ratio):
+    killmap = _killmap(40, 30, seed=1)
+    masks = _masks(30)
+    trigger_tests = [5]
+
+    np.random.seed(3)
+    generator = sampling.make_generator("Lang", "1", sampling.pack(killmap), 30, trigger_tests, masks, count=100)
+    rows = list(generator(ratio))
+
+    # the same draws, replayed one sample at a time.
+    np.random.seed(3)
+    ratios, testsets = sampling._draw(40, 40, ratio, 100)
+    for row, r, testset in zip(rows, ratios.tolist(), testsets):
+        testset = testset[testset < 40]
+        covered = np.any(killmap[testset, :], axis=0)
+        assert row[2] == r
+        assert len(testset) == round(r * 40)
+        np.testing.assert_allclose(row[3:-1], [covered[mask].sum() / len(mask) for mask in masks])
+        assert row[-1] == (5 in testset)
+
+
+def test_make_generator_sparse_matches_packed():
+    killmap = _killmap(50, 2000, seed=2) & (np.random.RandomState(5).rand(50, 2000) < 0.01)
+    tests, mutants = np.nonzero(killmap)
+    sparse = sampling.SparseKillmap.from_pairs(tests, mutants, killmap.shape)
+    assert sparse.pays_off()
+    masks = _masks(2000)
+
+    np.random.seed(11)
+    expected = list(sampling.make_generator("Lang", "1", sampling.pack(killmap), 2000, [1], masks, count=50)(0.2))
+    np.random.seed(11)
+    actual = list(sampling.make_generator("Lang", "1", sparse, 2000, [1], masks, count=50)(0.2))
+    assert actual == expected
+
+
+def test_sparse_cover_matches_packed_cover():
+    killmap = _killmap(30, 45, seed=6)
+    tests, mutants = np.nonzero(killmap)
+    sparse = sampling.SparseKillmap.from_pairs(tests, mutants, killmap.shape).padded()
+    padded = sampling._padded(sampling.pack(killmap))
+
+    ratios, testsets = sampling._draw(30, 30, "max50", 64)
+    np.testing.assert_array_equal(sparse.cover(testsets), sampling._cover(padded, testsets, 45).astype(bool))
+
+
+def test_sparse_killmap_round_trip():
+    killmap = _killmap(12, 20, seed=8)
+    tests, mutants = np.nonzero(killmap)
+    sparse = sampling.SparseKillmap.from_pairs(np.append(tests, tests[:3]), np.append(mutants, mutants[:3]), killmap.shape)
+
+    np.testing.assert_array_equal(sparse.killed(), killmap)
+    np.testing.assert_array_equal(sparse.pack(), sampling.pack(killmap))
+    np.testing.assert_array_equal(sparse.column_counts(), killmap.sum(axis=0))
+def test_make_exact_matches_brute_force():
+    import itertools
+    killmap = np.array([
+        [1, 0, 0, 1],
+        [0, 1, 0, 0],
+        [1, 1, 0, 0],
+    ], dtype=bool)
+    masks = [np.arange(4), np.array([0, 1]), np.array([3])]
+    trigger_tests = [1]
+    exact = sampling.make_exact("Lang", "1", sampling.pack(killmap), 4, trigger_tests, masks)
+
+    for size in [1, 2]:
+        # every ordered draw with replacement is equally likely.
+        draws = list(itertools.product(range(3), repeat=size))
+        levels = np.zeros(len(masks))
+        p_bug = 0.0
+        for draw in draws:
+            covered = np.any(killmap[list(draw)], axis=0)
+            levels += [covered[mask].sum() / len(mask) for mask in masks]
+            p_bug += any(t in trigger_tests for t in draw)
+
+        row = exact(size / 3)
+        assert row[:3] == ["Lang", "1", size / 3]
+        np.testing.assert_allclose(row[3:-1], levels / len(draws))
+        assert row[-1] == pytest.approx(p_bug / len(draws))
+
+
+def test_make_exact_max_ratio_averages_sizes():
+    killmap = _killmap(10, 8, seed=4)
+    masks = _masks(8)
+    exact = sampling.make_exact("Lang", "1", sampling.pack(killmap), 8, [2], masks)
+    max_size = sampling._max_size(10, "max50")
+
+    expected = np.mean([exact(size / 10)[3:] for size in range(1, max_size + 1)], axis=0)
+    np.testing.assert_allclose(exact("max50")[3:], expected)
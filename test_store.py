@@ -0,0 +1,67 @@
+import os
+
+import numpy as np
+import pytest
+
+import store
+
+
+def test_partition_round_trip(tmp_path):
+    rows = [
+        ["Lang", "1", 0.1, 0.5, None, 0.25, True],
+        ["Lang", "1", 0.2, 1.0, 0.75, "", False],
+    ]
+    path = store.get_partition_path(str(tmp_path), "Lang", "1", "100")
+    store.write_partition(path, "Lang", "1", rows)
+    columns = store.read_partition(path)
+
+    assert columns["name"].tolist() == ["Lang", "Lang"]
+    assert columns["bug_id"].tolist() == ["1", "1"]
+    np.testing.assert_array_equal(columns["ratio"], [0.1, 0.2])
+    np.testing.assert_array_equal(columns["cls_level"], [0.5, 1.0])
+    np.testing.assert_array_equal(columns["method_level"], [np.nan, 0.75])
+    np.testing.assert_array_equal(columns["stmt_level"], [0.25, np.nan])
+    np.testing.assert_array_equal(columns["is_bug"], [True, False])
+
+
+def test_empty_partition(tmp_path):
+    path = store.get_partition_path(str(tmp_path), "Lang", "1", "max20")
+    store.write_partition(path, "Lang", "1", [])
+    columns = store.read_partition(path)
+
+    assert len(columns["ratio"]) == 0
+    assert len(columns["name"]) == 0
+
+
+def test_partition_matches_csv(tmp_path):
+    csv_path = tmp_path / "Lang" / "1" / "max50.csv"
+    csv_path.parent.mkdir(parents=True)
+    csv_path.write_text("Lang,1,0.3,0.5,,0.25,True\nLang,1,0.4,1.0,0.75,0.5,False\n")
+    expected = store.read_partition(str(csv_path))
+
+    path = store.get_partition_path(str(tmp_path), "Lang", "1", "max50")
+    rows = [[expected["name"][i], expected["bug_id"][i], expected["ratio"][i], expected["cls_level"][i],
+            expected["method_level"][i], expected["stmt_level"][i], expected["is_bug"][i]] for i in range(2)]
+    store.write_partition(path, "Lang", "1", rows)
+    actual = store.read_partition(path)
+
+    for key in store.COLUMNS:
+        np.testing.assert_array_equal(actual[key], expected[key])
+    # the partition shadows the csv it was made from.
+    assert list(store.find_partitions(str(tmp_path), "Lang", "1")) == [path]
+
+
+def test_failed_writes_leave_no_temp_files(tmp_path):
+    path = store.get_partition_path(str(tmp_path), "Lang", "1", "100")
+    with pytest.raises(Exception):
+        store.write_partition(path, "Lang", "1", [["Lang", "1", "x", 0.5, 0.5, 0.5, True]])
+    assert os.listdir(os.path.dirname(path)) == []
+
+    def _rows():
+        yield ["Lang", "1", 0.1, 0.5, None, 0.25, 0.9]
+        raise ValueError()
+
+    path = store.get_exact_path(str(tmp_path / "exact"), "Lang", "1")
+    with pytest.raises(ValueError):
+        store.write_exact(path, _rows())
+    assert os.listdir(os.path.dirname(path)) == []
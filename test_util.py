@@ -0,0 +1,44 @@
+import os
+
+import store
+import util
+
+
+def _partition(root, bug_id, ratio_key, count):
+    path = store.get_partition_path(str(root), "Lang", bug_id, ratio_key)
+    store.write_partition(path, "Lang", bug_id, [["Lang", bug_id, 0.1, 0.5, 0.5, 0.5, i % 2 == 0] for i in range(count)])
+    return path
+
+
+def test_frame_cache_evicts_least_recently_used(tmp_path, monkeypatch):
+    util.clear_cache()
+    paths = [_partition(tmp_path, str(bug), "100", 100) for bug in range(3)]
+    frame = util._read_frame(str(tmp_path), paths[0])
+    size = util._frame_cache_bytes
+    # strings are counted with their contents.
+    assert size == int(frame.memory_usage(index=True, deep=True).sum())
+    assert size > int(frame.memory_usage(index=True).sum())
+
+    monkeypatch.setattr(util, "CACHE_BYTES", 2 * size)
+    util._read_frame(str(tmp_path), paths[1])
+    assert util._read_frame(str(tmp_path), paths[0]) is frame
+    util._read_frame(str(tmp_path), paths[2])
+
+    keys = [key[-2] for key in util._frame_cache]
+    assert keys == ["0", "2"]
+    assert util._frame_cache_bytes == 2 * size
+    util.clear_cache()
+
+
+def test_frame_cache_reloads_changed_partitions(tmp_path):
+    util.clear_cache()
+    path = _partition(tmp_path, "1", "100", 10)
+    frame = util._read_frame(str(tmp_path), path)
+    assert util._read_frame(str(tmp_path), path) is frame
+
+    _partition(tmp_path, "1", "100", 20)
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+    assert len(util._read_frame(str(tmp_path), path)) == 20
+    assert len(util._frame_cache) == 1
+    util.clear_cache()
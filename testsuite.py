@@ -2,17 +2,38 @@ import os
 from datetime import datetime
 import shutil
 from d4jconstants import *
-from collections import defaultdict
+from collections import defaultdict, deque
 from contextlib import contextmanager, AbstractContextManager
 from subprocess import CalledProcessError, run, DEVNULL, TimeoutExpired
-import tempfile
 import json
 import shutil
 import tarfile
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 import javalang
 import patch
 
 
+def _iterate_java_sources(tar):
+    # members of a streamed archive can only be read in order, so the sources are handed out as bytes.
+    for member in tar:
+        if member.isfile() and member.name.endswith(".java"):
+            yield tar.extractfile(member).read()
+
+
+def _parse_empty_methods(buf):
+    removed = defaultdict(list)
+    tree = javalang.parse.parse(buf.decode("utf8"))
+    package_name = tree.package.name + "." if tree.package else ""
+    for path, node in tree.filter(javalang.tree.MethodDeclaration):
+        class_name = package_name + path[2].name
+        if len(node.body) == 0:
+            removed[class_name].append(node.name)
+
+    return dict(removed)
+
+
 class ListNotFoundException(Exception):
     pass
 
@@ -180,28 +201,75 @@ class GenTestSuite(TestSuite):
 
 
 
+    def _get_index_path(self):
+        return self.get_filepath("index")
+
+
+    def _load_index(self, digest):
+        p = self._get_index_path()
+        if os.path.exists(p):
+            try:
+                with open(p, "r") as fh:
+                    index = json.load(fh)
+            except json.JSONDecodeError:
+                return None
+
+            if index.get("sha1") == digest:
+                return index["removed"]
+
+        return None
+
+
+    def _build_index(self):
+        removed = defaultdict(set)
+        # daemonic pool workers cannot start processes of their own, so they parse in place.
+        if multiprocessing.current_process().daemon:
+            with tarfile.open(self.suite_path, "r|bz2") as tar:
+                for buf in _iterate_java_sources(tar):
+                    for class_name, names in _parse_empty_methods(buf).items():
+                        removed[class_name].update(names)
+            return removed
+
+        def _merge(future):
+            for class_name, names in future.result().items():
+                removed[class_name].update(names)
+
+        workers = os.cpu_count() or 1
+        futures = deque()
+        with ProcessPoolExecutor(workers) as executor:
+            with tarfile.open(self.suite_path, "r|bz2") as tar:
+                for buf in _iterate_java_sources(tar):
+                    # a few sources per worker are in flight, so a large suite is not held in memory at once.
+                    if len(futures) >= 2 * workers:
+                        _merge(futures.popleft())
+                    futures.append(executor.submit(_parse_empty_methods, buf))
+
+            while len(futures) > 0:
+                _merge(futures.popleft())
+
+        return removed
+
+
     def _is_relevant_testcases(self, cls_name, method_name):
         if self._removed is None:
-            self._removed = defaultdict(set)
-            with tempfile.TemporaryDirectory() as tmp_dir:
-                tar = tarfile.open(self.suite_path)
-                tar.extractall(tmp_dir)
-                tar.close()
-
-                for root, dirs, files in os.walk(tmp_dir):
-                    for name in files:
-                        if not name.endswith(".java"):
-                            continue
+            h = hashlib.sha1()
+            with open(self.suite_path, "rb") as fh:
+                for chunk in iter(lambda: fh.read(1 << 20), b""):
+                    h.update(chunk)
+            digest = h.hexdigest()
+
+            removed = self._load_index(digest)
+            if removed is None:
+                removed = self._build_index()
+                index = {"sha1": digest, "removed": {k: sorted(v) for k, v in removed.items()}}
+                p = self._get_index_path()
+                with open(p + ".tmp", "w") as fh:
+                    json.dump(index, fh)
+                os.replace(p + ".tmp", p)
 
-                        with open(os.path.join(root, name)) as fh:
-                            buf = fh.read()
-
-                        tree = javalang.parse.parse(buf)
-                        package_name = tree.package.name + "." if tree.package else ""
-                        for path, node in tree.filter(javalang.tree.MethodDeclaration):
-                            class_name = package_name + path[2].name
-                            if len(node.body) == 0:
-                                self._removed[class_name].add(node.name)
+            self._removed = defaultdict(set)
+            for class_name, names in removed.items():
+                self._removed[class_name].update(names)
 
         return method_name not in self._removed[cls_name]
 
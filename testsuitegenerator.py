@@ -1,5 +1,7 @@
 import os
 import tempfile
+import queue
+from collections import defaultdict
 from testsuite import iterate_suites, GenTestSuite, EvoSuite
 from killmap import Killmap
 from d4jconstants import *
@@ -8,17 +10,16 @@ from subprocess import CalledProcessError, TimeoutExpired
 
 
 def generate_devsuite(suite):
-    proj_name = suite.proj_name
-    bug_id = suite.bug_id
-
-    with d4j_opposed_checkout(proj_name, bug_id) as git_home:
-        all_tests_path, failing_tests_path = d4j_run_tests(git_home, None)
-        Killmap.initialize(suite, all_tests_path)
+    run_bug_suites(suite.proj_name, suite.bug_id, [("dev", None,)], initialize=True)
 
 
 class SuiteGenerator:
     OUTPUT_DIR = "raw_tests"
     TIMEOUT = 15 * 60
+    # checkpoints of the pipeline stages, next to the raw tarball and the registered suite.
+    FIXED = "fixed"
+    ALL_TESTS = "all_tests"
+    INITIALIZED = "initialized"
     def __init__(self, suite_type):
         self.suite_type = suite_type
 
@@ -76,6 +77,77 @@ class SuiteGenerator:
         return dest if os.path.exists(dest) else None
 
 
+    def fix(self, suite, generated_path):
+        marker = generated_path + "." + SuiteGenerator.FIXED
+        if os.path.exists(marker):
+            return generated_path
+
+        print(datetime.now(), ": remove broken test cases")
+        try:
+            d4j_fix_suites(suite.proj_name, suite.bug_id, self.suite_type, os.path.split(generated_path)[0])
+        except (subprocess.CalledProcessError, TimeoutExpired):
+            print("Could not fix", suite)
+            return None
+
+        with open(marker, "w"):
+            pass
+        return generated_path
+
+
+    def run_tests(self, suite, generated_path, git_home):
+        print(datetime.now(), ": identify failing tests")
+        try:
+            all_tests_path, failing_tests_path = d4j_run_tests(git_home, generated_path)
+        except subprocess.CalledProcessError:
+            print("Identification failed.")
+            return None
+
+        # the checkout is reused by the next suite, so its lists are kept with the suite.
+        dest = suite.get_filepath(SuiteGenerator.ALL_TESTS)
+        shutil.copy(all_tests_path, dest)
+        suite.register_trigger_tests(failing_tests_path)
+        suite.register_suite(generated_path)
+        if os.path.exists(generated_path + "." + SuiteGenerator.FIXED):
+            os.unlink(generated_path + "." + SuiteGenerator.FIXED)
+        return dest
+
+
+    @staticmethod
+    def initialize(suite, all_tests_path):
+        Killmap.initialize(suite, all_tests_path)
+        with open(suite.get_filepath(SuiteGenerator.INITIALIZED), "w"):
+            pass
+
+
+    @staticmethod
+    def run_dev_tests(suite, git_home):
+        print(datetime.now(), ": run developer tests")
+        try:
+            all_tests_path, failing_tests_path = d4j_run_tests(git_home, None)
+        except subprocess.CalledProcessError:
+            print("Developer tests failed.")
+            return None
+
+        dest = suite.get_filepath(SuiteGenerator.ALL_TESTS)
+        shutil.copy(all_tests_path, dest)
+        # failures of the developer tests are not trigger tests, so they stay out of the .fails lists.
+        shutil.copy(failing_tests_path, suite.get_filepath("failing_tests"))
+        return dest
+
+
+    @staticmethod
+    def get_stage(suite):
+        # the first stage that has not completed, or None if the suite is done.
+        if not suite.is_suite_available():
+            return "generate"
+        if os.path.exists(suite.get_filepath(SuiteGenerator.ALL_TESTS)) and not os.path.exists(suite.get_filepath(SuiteGenerator.INITIALIZED)):
+            return "initialize"
+        if suite.suite_type == "dev" and not os.path.exists(suite.get_filepath("json")):
+            return "run_tests"
+
+        return None
+
+
     def generate(self, suite):
         proj_name = suite.proj_name
         bug_id = suite.bug_id
@@ -87,24 +159,10 @@ class SuiteGenerator:
         if generated_path is None:
             return
 
-        print(datetime.now(), ": remove broken test cases")
-        try:
-            d4j_fix_suites(proj_name, bug_id, self.suite_type, os.path.split(generated_path)[0])
-        except (subprocess.CalledProcessError, TimeoutExpired):
-            print("Could not fix", suite)
+        if self.fix(suite, generated_path) is None:
             return
 
-
-        print(datetime.now(), ": identify failing tests")
-        try:
-            with d4j_opposed_checkout(proj_name, bug_id) as git_home:
-                all_tests_path, failing_tests_path = d4j_run_tests(git_home, generated_path)
-                suite.register_trigger_tests(failing_tests_path)
-                suite.register_suite(generated_path)
-                Killmap.initialize(suite, all_tests_path)
-        except subprocess.CalledProcessError:
-            print("Identification failed.") 
-            return        
+        run_bug_suites(proj_name, bug_id, [(self.suite_type, generated_path,)], initialize=True)
 
 
 class EvoSuiteGenerator(SuiteGenerator):
@@ -135,41 +193,176 @@ class RandoopGenerator(SuiteGenerator):
 
 
 from testsuite import DevTestSuite, RanSuite
-def _generate(proj_name, bug_id, suite_type):
+def _get_generator(proj_name, bug_id, suite_type):
     if "evosuite" in suite_type:
-        suite_type = suite_type[9:]
-        EvoSuiteGenerator(suite_type).generate(EvoSuite(proj_name, bug_id, suite_type))
+        criterion = suite_type[9:]
+        return EvoSuiteGenerator(criterion), EvoSuite(proj_name, bug_id, criterion),
     elif suite_type == "randoop":
-        RandoopGenerator().generate(RanSuite(proj_name, bug_id))
-    elif suite_type == "dev":
-        generate_devsuite(DevTestSuite(proj_name, bug_id))
+        return RandoopGenerator(), RanSuite(proj_name, bug_id),
+
+    return None, DevTestSuite(proj_name, bug_id),
+
+
+def _generate(proj_name, bug_id, suite_type):
+    generator, suite = _get_generator(proj_name, bug_id, suite_type)
+    if generator is None:
+        generate_devsuite(suite)
+    else:
+        generator.generate(suite)
+
+
+def _stage_generate(proj_name, bug_id, suite_type):
+    generator, suite = _get_generator(proj_name, bug_id, suite_type)
+    return generator._generate_raw(proj_name, bug_id)
+
+
+def _stage_fix(proj_name, bug_id, suite_type, generated_path):
+    generator, suite = _get_generator(proj_name, bug_id, suite_type)
+    return generator.fix(suite, generated_path)
+
+
+def run_bug_suites(proj_name, bug_id, items, initialize = False):
+    # one checkout and one compile of the opposed version serve every suite of the bug.
+    results = []
+    with d4j_opposed_checkout(proj_name, bug_id) as git_home:
+        d4j_compile(git_home)
+        # developer tests run first, before generated suites add their classes to the checkout.
+        for suite_type, generated_path in sorted(items, key=lambda x: x[0] != "dev"):
+            generator, suite = _get_generator(proj_name, bug_id, suite_type)
+            if generator is None:
+                all_tests_path = SuiteGenerator.run_dev_tests(suite, git_home)
+            else:
+                all_tests_path = generator.run_tests(suite, generated_path, git_home)
+
+            if initialize and all_tests_path is not None:
+                SuiteGenerator.initialize(suite, all_tests_path)
+            results.append((suite_type, all_tests_path,))
+
+    return results
+
+
+def _stage_run_tests(proj_name, bug_id, items):
+    return run_bug_suites(proj_name, bug_id, items)
+
+
+def _stage_initialize(proj_name, bug_id, suite_type, all_tests_path):
+    generator, suite = _get_generator(proj_name, bug_id, suite_type)
+    SuiteGenerator.initialize(suite, all_tests_path)
+    return True
+
+
+_STAGES = ("generate", "fix", "run_tests", "initialize",)
+
+
+def _pipeline(tasks, workers):
+    # every stage has its own pool, so EvoSuite runs overlap with the test runs of finished suites.
+    import multiprocessing
+    functions = {"generate": _stage_generate, "fix": _stage_fix, "run_tests": _stage_run_tests, "initialize": _stage_initialize}
+    pools = {stage: multiprocessing.Pool(workers[stage]) for stage in _STAGES}
+    results = queue.Queue()
+    stats = {stage: 0 for stage in _STAGES}
+    # suites wait for the other suites of their bug before the tests run, so that each bug is checked out once.
+    upstream = defaultdict(int)
+    ready = defaultdict(list)
+
+    def _submit(stage, task, *args):
+        pools[stage].apply_async(functions[stage], (*task, *args),
+                callback=lambda r: results.put((stage, task, r, None)),
+                error_callback=lambda e: results.put((stage, task, None, e)))
+
+    def _arrive(bug, item):
+        if item is not None:
+            ready[bug].append(item)
+        if upstream[bug] > 0 or len(ready[bug]) == 0:
+            return 0
+
+        _submit("run_tests", bug, ready.pop(bug))
+        return 1
+
+    running = 0
+    for stage, task, arg in tasks:
+        if stage == "generate":
+            upstream[task[:2]] += 1
+
+    for stage, task, arg in tasks:
+        if stage == "generate":
+            _submit(stage, task)
+            running += 1
+        elif stage == "initialize":
+            _submit(stage, task, arg)
+            running += 1
+        else:
+            ready[task[:2]].append((task[2], arg,))
+
+    for bug in list(ready):
+        running += _arrive(bug, None)
+
+    while running > 0:
+        stage, task, result, error = results.get()
+        running -= 1
+        if error is not None:
+            print(datetime.now(), ":", stage, "failed for", task, "-", error)
+
+        if stage == "run_tests":
+            for suite_type, all_tests_path in result or []:
+                if all_tests_path is not None:
+                    stats[stage] += 1
+                    _submit("initialize", (*task, suite_type,), all_tests_path)
+                    running += 1
+            continue
+
+        if result is not None:
+            stats[stage] += 1
+        if stage == "generate" and result is not None:
+            _submit("fix", task, result)
+            running += 1
+        elif stage in ("generate", "fix",):
+            upstream[task[:2]] -= 1
+            running += _arrive(task[:2], None if result is None else (task[2], result,))
+
+    for pool in pools.values():
+        pool.close()
+    for pool in pools.values():
+        pool.join()
+
+    return stats
 
 
 def _main():
     import sys
     import locale
-    import multiprocessing
-    
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--generate", type=int, default=4, help="number of concurrent EvoSuite/Randoop runs")
+    parser.add_argument("--fix", type=int, default=1, help="number of concurrent fix_test_suite.pl runs")
+    parser.add_argument("--test", type=int, default=2, help="number of concurrent test runs")
+    args = parser.parse_args(sys.argv[1:])
+
     loc = locale.getdefaultlocale()[1]
     if loc != "UTF-8":
         raise Exception("non-utf8 ({}) langauge may cause an infinite loop.".format(loc))
 
-    generators = {"evosuite-{}".format(t): EvoSuiteGenerator(t).generate for t in EvoSuite.CRITERIA}
-    generators["randoop"] = RandoopGenerator().generate
-    generators["dev"] = generate_devsuite
-
     tasks = []
     for proj_name in ["Math", "Chart", "Lang", "Time", "Closure"]:
         for suites in iterate_suites(proj_name):
             for s in suites:
-                if not s.is_suite_available():
+                stage = SuiteGenerator.get_stage(s)
+                if stage is None:
+                    continue
+
+                arg = None
+                if stage == "generate":
                     with open(os.path.join("mutations", proj_name, s.bug_id, "no_" + s.suite_type), "w"):
                         pass
-                    tasks.append([s.proj_name, s.bug_id, s.suite_type])
+                elif stage == "initialize":
+                    # a suite whose tests ran before an interruption only needs its killmap.
+                    arg = s.get_filepath(SuiteGenerator.ALL_TESTS)
+                tasks.append((stage, (s.proj_name, s.bug_id, s.suite_type,), arg,))
 
-    with multiprocessing.Pool(7) as pool:
-        pool.starmap(_generate, tasks)
+    stats = _pipeline(tasks, {"generate": args.generate, "fix": args.fix, "run_tests": args.test, "initialize": 1})
+    print(stats)
 
 
 if __name__ == "__main__":
-    _main()
\ No newline at end of file
+    _main()
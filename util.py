@@ -1,9 +1,9 @@
 import os
-import csv
-from collections import defaultdict, namedtuple
+from collections import defaultdict, namedtuple, OrderedDict
 import pandas as pd
 import matplotlib.pyplot as plt
 import d4j
+import store
 import numpy as np
 
 flierprops = {'marker': 'x', 'markersize': 3}
@@ -14,110 +14,52 @@ medianprops = dict(linestyle='-', linewidth=1)
 np.seterr(all='print')
 plt.rcParams["font.family"] = "sans-serif"
 
-def load_pit(proj_name, bug_id = None, ratio = None):
-    data = []
-    target_dir = os.path.join("cov_pit", proj_name)
-    if bug_id is not None:
-        target_dir = os.path.join(target_dir, bug_id)
-
-    for root, dirs, files in os.walk(target_dir):
-        if bug_id is None:
-            bug_id = os.path.split(root)[1]
-
-        for filename in files:
-            if not filename.endswith(".csv"):
-                continue
-            if os.path.split(root)[1].startswith("."):
-                continue
-
-            ratio_type = filename.split(".")[0]
-            try:
-                ratio_type = float(ratio_type) / 1000.0
-            except ValueError:
-                pass                
-                
-            if ratio is not None and ratio != ratio_type:
-                continue
-
-            lines = []
-            with open(os.path.join(root, filename), "r") as fh:
-                for line in fh:
-                    line = line.strip()
-                    if len(line) == 0:
-                        continue
-                    lines.append(line)
-                    
-            reader = csv.reader(lines)
-            for row in reader:
-                row[2] = float(row[2])
-                row[3] = float(row[3])
-                row[4] = float(row[4])
-                row[5] = float(row[5])
-
-                data.append(row)
-
-    if len(data) == 0:
-        print("Ignore empty", proj_name, bug_id, ratio)
-        return None
-
-    data = pd.DataFrame(data)
-    data.columns = ["name", "bug_id", "ratio", "cls_level", "method_level", "stmt_level", "is_bug"]
-    data = data.loc[data["cls_level"].notnull() & data["method_level"].notnull() & data["stmt_level"].notnull(), :]
-    for name in ["cls_level", "method_level", "stmt_level", "is_bug"]:
-        if len(np.unique(data[name])) == 1:
-            print("Ignore constant value", proj_name, bug_id, ratio, name)
-            return None
-
-    return data
-
-def load(proj_name, bug_id = None, ratio = None):
-    data = []
-    target_dir = os.path.join("cov", proj_name)
-    if bug_id is not None:
-        target_dir = os.path.join(target_dir, bug_id)
-
-    for root, dirs, files in os.walk(target_dir):
-        if bug_id is None:
-            bug_id = os.path.split(root)[1]
-
-        for filename in files:
-            if not filename.endswith(".csv"):
-                continue
-            if os.path.split(root)[1].startswith("."):
-                continue
-
-            ratio_type = filename.split(".")[0]
-            try:
-                ratio_type = float(ratio_type) / 1000.0
-            except ValueError:
-                pass                
-                
-            if ratio is not None and ratio != ratio_type:
-                continue
-
-            lines = []
-            with open(os.path.join(root, filename), "r") as fh:
-                for line in fh:
-                    line = line.strip()
-                    if len(line) == 0:
-                        continue
-                    lines.append(line)
-                    
-            reader = csv.reader(lines)
-            for row in reader:
-                row[2] = float(row[2])
-                row[3] = float(row[3])
-                row[4] = float(row[4])
-                row[5] = float(row[5])
-
-                data.append(row)
-
-    if len(data) == 0:
+CACHE_BYTES = 1 << 30
+_frame_cache = OrderedDict()
+_frame_cache_bytes = 0
+
+def clear_cache():
+    global _frame_cache_bytes
+    _frame_cache.clear()
+    _frame_cache_bytes = 0
+
+def _read_frame(root, path):
+    global _frame_cache_bytes
+    # partitions live at <root>/<proj>/<bug>/<ratio>.<ext>
+    key = (root,) + tuple(os.path.relpath(path, root).split(os.sep))
+    stat = os.stat(path)
+    version = (stat.st_mtime_ns, stat.st_size)
+    entry = _frame_cache.get(key)
+    if entry is not None and entry[0] == version:
+        _frame_cache.move_to_end(key)
+        return entry[1]
+
+    if entry is not None:
+        _frame_cache_bytes -= entry[2]
+    frame = pd.DataFrame(store.read_partition(path), columns=store.COLUMNS)
+    # the name and bug_id columns hold python strings, which only a deep count sees.
+    size = int(frame.memory_usage(index=True, deep=True).sum())
+    _frame_cache[key] = version, frame, size
+    _frame_cache.move_to_end(key)
+    _frame_cache_bytes += size
+    while _frame_cache_bytes > CACHE_BYTES and len(_frame_cache) > 1:
+        _, evicted = _frame_cache.popitem(last=False)
+        _frame_cache_bytes -= evicted[2]
+
+    return frame
+
+def _load(root, proj_name, bug_id = None, ratio = None):
+    frames = []
+    for path in store.find_partitions(root, proj_name, bug_id, ratio):
+        frame = _read_frame(root, path)
+        if len(frame) > 0:
+            frames.append(frame)
+
+    if len(frames) == 0:
         print("Ignore empty", proj_name, bug_id, ratio)
         return None
 
-    data = pd.DataFrame(data)
-    data.columns = ["name", "bug_id", "ratio", "cls_level", "method_level", "stmt_level", "is_bug"]
+    data = pd.concat(frames, ignore_index=True)
     data = data.loc[data["cls_level"].notnull() & data["method_level"].notnull() & data["stmt_level"].notnull(), :]
     for name in ["cls_level", "method_level", "stmt_level", "is_bug"]:
         unq = np.unique(data[name])
@@ -125,4 +67,10 @@ def load(proj_name, bug_id = None, ratio = None):
             print("Ignore constant value", proj_name, bug_id, ratio, unq)
             return None
 
-    return data
\ No newline at end of file
+    return data
+
+def load_pit(proj_name, bug_id = None, ratio = None):
+    return _load("cov_pit", proj_name, bug_id, ratio)
+
+def load(proj_name, bug_id = None, ratio = None):
+    return _load("cov", proj_name, bug_id, ratio)